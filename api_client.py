@@ -0,0 +1,123 @@
+"""
+Client for the chatAI API server (server.py), used by the Streamlit app.
+"""
+import json
+import os
+from functools import lru_cache
+
+import httpx
+
+
+API_URL = os.environ.get("CHATAI_API_URL", "http://localhost:8000")
+# Research and document uploads can take minutes, only connecting is bounded tightly
+TIMEOUT = httpx.Timeout(connect=5.0, read=300.0, write=60.0, pool=10.0)
+
+
+class ServerBusy(Exception):
+    pass
+
+
+@lru_cache(maxsize=1)
+def get_client() -> httpx.Client:
+    # One connection pool shared by every session of the app
+    return httpx.Client(base_url=API_URL, timeout=TIMEOUT)
+
+
+def _check(response: httpx.Response):
+    if response.status_code == 503:
+        raise ServerBusy("The server is busy, try again in a moment")
+    if response.is_error:
+        response.read()
+        try:
+            detail = response.json().get("detail", response.text)
+        except ValueError:
+            detail = response.text
+        raise RuntimeError(f"{response.status_code}: {detail}")
+
+
+def _stream_text(path: str, payload: dict, headers: dict = None):
+    with get_client().stream("POST", path, json=payload) as response:
+        _check(response)
+        if headers is not None:
+            headers.update(response.headers)
+        yield from response.iter_text()
+
+
+def stream_chat(messages, temperature: float = 1.0, top_k=None, top_p=None, headers: dict = None):
+    # X-Cache in `headers` tells whether the answer came from the semantic cache
+    payload = {"messages": messages, "temperature": temperature, "top_k": top_k, "top_p": top_p}
+    yield from _stream_text("/v1/chat", payload, headers)
+
+
+def web_search(query: str):
+    response = get_client().post("/v1/web", json={"query": query})
+    _check(response)
+    result = response.json()
+    return result["answer"], result["sources"]
+
+
+def upload_document(name: str, data: bytes, owner: str = "") -> dict:
+    response = get_client().post(
+        "/v1/documents", files={"file": (name, data, "application/pdf")}, data={"owner": owner}
+    )
+    _check(response)
+    return response.json()
+
+
+def document_status(doc_id: str):
+    response = get_client().get(f"/v1/documents/{doc_id}")
+    if response.status_code == 404:
+        return None
+    _check(response)
+    return response.json()
+
+
+def list_documents(owner: str = None) -> list:
+    params = {"owner": owner} if owner is not None else {}
+    response = get_client().get("/v1/documents", params=params)
+    _check(response)
+    return response.json()
+
+
+def delete_document(doc_id: str, owner: str = "") -> bool:
+    response = get_client().delete(f"/v1/documents/{doc_id}", params={"owner": owner})
+    if response.status_code == 404:
+        return False
+    _check(response)
+    return True
+
+
+def stream_rag(query: str, messages, doc_ids, headers: dict = None):
+    # X-Documents-Indexing in `headers` counts the documents only partly searched
+    payload = {"query": query, "messages": messages, "doc_ids": list(doc_ids)}
+    yield from _stream_text("/v1/rag", payload, headers)
+
+
+def stream_research(query: str, thread_id: str = None, **settings):
+    """
+    Stream a deep research run, yielding (node, update) like
+    deep_research.stream_deep_research, so it can back a ResearchJobRunner.
+    """
+    payload = {"query": query, "settings": settings}
+    with get_client().stream("POST", "/v1/research", json=payload) as response:
+        _check(response)
+        for line in response.iter_lines():
+            if not line:
+                continue
+            record = json.loads(line)
+            update = {"message": record["message"]}
+            if "report" in record:
+                update["running_summary"] = record["report"]
+            yield record["node"], update
+
+
+def stats() -> dict:
+    response = get_client().get("/v1/stats")
+    _check(response)
+    return response.json()
+
+
+def metrics_text() -> str:
+    response = get_client().get("/metrics")
+    _check(response)
+    return response.text
@@ -1,11 +1,88 @@
+import hashlib
+import time
+import uuid
+import httpx
 import streamlit as st
-from run_model import generate_response, generate_RAG_response
-from web_search import search_web
-from deep_research import perform_deep_research
-import tempfile
+import api_client
+from research_jobs import ResearchJobRunner, FINISHED_STATES
 
 st.set_page_config(layout="wide")
 
+
+# Models, indexes and caches live in the API server (server.py), this script only renders
+def format_latency(metrics):
+    return f"First token in {metrics['ttft']:.2f}s · total {metrics['total']:.2f}s"
+
+
+def timed(stream, metrics):
+    # Latency as the user sees it, including the round trip to the API server
+    start = time.perf_counter()
+    for text in stream:
+        metrics.setdefault("ttft", time.perf_counter() - start)
+        yield text
+    metrics.setdefault("ttft", time.perf_counter() - start)
+    metrics["total"] = time.perf_counter() - start
+
+
+@st.cache_resource
+def get_job_runner():
+    # Shared by every session, research runs outside the script thread and survives reruns
+    return ResearchJobRunner(max_workers=4, research_fn=api_client.stream_research)
+
+
+@st.fragment(run_every=2)
+def research_job_panel():
+    job_id = st.session_state.get("research_job_id")
+    if not job_id:
+        return
+
+    runner = get_job_runner()
+    job = runner.status(job_id)
+    if job is None:
+        del st.session_state["research_job_id"]
+        return
+
+    finished = job["status"] in FINISHED_STATES
+    with st.chat_message("assistant"):
+        state = {"done": "complete", "failed": "error", "cancelled": "error"}.get(job["status"], "running")
+        with st.status(f"Researching: {job['query']}", state=state, expanded=not finished):
+            for event in job["events"]:
+                st.write(event["message"])
+        if not finished and st.button("Cancel research", key=f"cancel-{job_id}"):
+            runner.cancel(job_id)
+
+    if finished:
+        response = job["result"] or f"Research {job['status']}. {job['error'] or ''}".strip()
+        st.session_state.messages.append({"role": "assistant", "content": response})
+        del st.session_state["research_job_id"]
+        st.rerun()
+
+
+@st.fragment(run_every=1)
+def ingest_progress(doc_id, source):
+    status = api_client.document_status(doc_id)
+    if status is None:
+        st.error(f"{source}: unknown to the server")
+    elif status["error"]:
+        st.error(f"{source}: indexing failed: {status['error']}")
+        if st.button(f"Retry {source}", key=f"retry-{doc_id}"):
+            # Forgetting the upload makes the next run send the file again, which starts a new ingest
+            uploaded_pdfs = st.session_state.uploaded_pdfs
+            for digest in [digest for digest, uploaded in uploaded_pdfs.items() if uploaded == doc_id]:
+                del uploaded_pdfs[digest]
+            del st.session_state.pdf_indexes[doc_id]
+            st.rerun(scope="app")
+    elif status["done"]:
+        st.caption(f"{source}: {status['pages']} pages ({status['chunks']} chunks)")
+    elif status["total_pages"]:
+        st.progress(
+            min(status["pages"] / status["total_pages"], 1.0),
+            text=f"{source}: indexed {status['pages']} of {status['total_pages']} pages, you can ask questions already",
+        )
+    else:
+        st.caption(f"{source}: indexed {status['pages']} pages so far...")
+
+
 def main():
     st.title("💬 Chat with Gemma")
     
@@ -48,8 +125,36 @@ def main():
         )
 
         if option == "Upload PDF":
-            file = st.file_uploader(label="Uploaded file will provide context to LLM", type="pdf")
-            
+            files = st.file_uploader(label="Uploaded files will provide context to LLM", type="pdf", accept_multiple_files=True)
+
+            # Every upload goes into the shared corpus in the background, this session
+            # only searches the documents it uploaded
+            session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+            pdf_indexes = st.session_state.setdefault("pdf_indexes", {})
+            uploaded_pdfs = st.session_state.setdefault("uploaded_pdfs", {})
+            for file in files:
+                data = file.getvalue()
+                digest = hashlib.sha256(data).hexdigest()
+                if digest not in uploaded_pdfs:
+                    status = api_client.upload_document(file.name, data, owner=session_id)
+                    pdf_indexes[status["doc_id"]] = file.name
+                    uploaded_pdfs[digest] = status["doc_id"]
+
+            for doc_id, source in list(pdf_indexes.items()):
+                ingest_progress(doc_id, source)
+                if st.button(f"Delete {source}", key=f"delete-{doc_id}"):
+                    if api_client.delete_document(doc_id, owner=session_id):
+                        del pdf_indexes[doc_id]
+                        st.rerun()
+                    st.warning(f"{source} is still being indexed, delete it once it's done")
+
+            selected_pdfs = st.multiselect(
+                "Search in",
+                options=list(pdf_indexes),
+                default=list(pdf_indexes),
+                format_func=lambda doc_id: pdf_indexes[doc_id],
+            )
+
 
         if option == "Web Search":
             st.write("Web Search Enabled for next query")
@@ -61,6 +166,26 @@ def main():
         if option == "Deep Web Search":
             st.write("Deep Web Research Enabled for next query")
 
+        try:
+            server_stats = api_client.stats()
+        except httpx.HTTPError:
+            st.error(f"Can't reach the API server at {api_client.API_URL}")
+            server_stats = None
+        if server_stats:
+            cache_stats = server_stats["semantic_cache"]
+            st.caption(f"Answer cache: {cache_stats['hit_rate']:.0%} hit rate, {cache_stats['entries']} entries")
+            search_stats = server_stats["search_cache"]
+            st.caption(f"Search cache: {search_stats['hit_rate']:.0%} hit rate, {search_stats['entries']} entries")
+
+            # Counters are per server process, these come from whichever one answered
+            with st.expander("Debug: traces"):
+                summary = server_stats["traces"]
+                if summary:
+                    st.dataframe(summary, hide_index=True)
+                    st.download_button("Prometheus metrics", api_client.metrics_text(), file_name="metrics.txt")
+                else:
+                    st.write("No traces recorded yet")
+
 
 
     # col1, col2 = st.columns([6, 1], gap="small")
@@ -80,43 +205,63 @@ def main():
         # Display user message
         st.chat_message("user").markdown(prompt)
         st.session_state.messages.append({"role": "user", "content": prompt})
-        if option == "Simple Chat":
+        response = None
 
-            response = generate_response(history=st.session_state.messages, query=prompt, temperature=temperature, top_k=top_k, top_p=top_p)
-            st.chat_message("assistant").markdown(response)
-            # st.session_state.messages.append({"role": "assistant", "content": response})
+        try:
+            if option == "Simple Chat":
+                # The server answers opening questions from its semantic cache when it can
+                with st.chat_message("assistant"):
+                    metrics, headers = {}, {}
+                    response = st.write_stream(timed(api_client.stream_chat(
+                        st.session_state.messages, temperature=temperature, top_k=top_k, top_p=top_p, headers=headers,
+                    ), metrics))
+                    if headers.get("x-cache") == "hit":
+                        st.caption("Answered from cache")
+                    else:
+                        st.caption(format_latency(metrics))
+                # st.session_state.messages.append({"role": "assistant", "content": response})
         
-        if option == "Web Search":
-            st.session_state.messages.append([{"role": "user", "content" : prompt}])
+            if option == "Web Search":
+                response, sources = api_client.web_search(prompt)
+                # asnswer = response
+                # st.chat_message("assistant").markdown(f"{response}\n\n###Sources\n{'\n'.join([source for source in sources])}")
+                with st.chat_message("assistant"):
+                    st.markdown(f"{response}\n\n### Sources\n" + "\n".join(sources))
 
-            response, sources = search_web(prompt)
-            # asnswer = response
-            # st.chat_message("assistant").markdown(f"{response}\n\n###Sources\n{'\n'.join([source for source in sources])}")
-            with st.chat_message("assistant"):
-                st.markdown(f"{response}\n\n### Sources\n" + "\n".join(sources))
+            if option == "Deep Web Search":
+                if st.session_state.get("research_job_id"):
+                    st.warning("A research job is already running for this session")
+                else:
+                    st.session_state.research_job_id = get_job_runner().submit(prompt)
+                # The answer is added to the history by research_job_panel once the job finishes
+                response = None
 
-        if option == "Deep Web Search":
-            st.session_state.messages.append([{"role": "user", "content" : prompt}])
+            if option == "Upload PDF":
+                if not selected_pdfs:
+                    st.warning("Upload a PDF to ask questions about it")
+                else:
+                    # One retrieval across every selected document, including the pages
+                    # indexed so far of those still being ingested
+                    metrics, headers = {}, {}
+                    try:
+                        with st.spinner("Indexing the first pages..."), st.chat_message("assistant"):
+                            response = st.write_stream(timed(api_client.stream_rag(
+                                prompt, st.session_state.messages, selected_pdfs, headers=headers,
+                            ), metrics))
+                            caption = format_latency(metrics)
+                            pending = int(headers.get("x-documents-indexing", 0))
+                            if pending:
+                                caption += f" · {pending} document(s) still being indexed"
+                            st.caption(caption)
+                    except RuntimeError as e:
+                        st.warning(f"Couldn't search the selected PDFs. {e}")
+        except api_client.ServerBusy as e:
+            st.warning(str(e))
 
-            response = perform_deep_research(prompt)
-            # asnswer = response
-            # st.chat_message("assistant").markdown(f"{response}\n\n###Sources\n{'\n'.join([source for source in sources])}")
-            with st.chat_message("assistant"):
-                st.markdown(response)
+        if response is not None:
+            st.session_state.messages.append({"role": "assistant", "content": response})
 
-        if option == "Upload PDF":
-            st.session_state.messages.append([{"role": "user", "content" : prompt}])
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-                tmp_file.write(file.read())
-                tmp_path = tmp_file.name
-            print(tmp_path)
-            response = generate_RAG_response(prompt, tmp_path, st.session_state.messages)
-            # print(file)
-            with st.chat_message("assistant"):
-                st.markdown(response)
-        
-        st.session_state.messages.append({"role": "assistant", "content": response})
+    research_job_panel()
         
         
     # # Slider in column 2
@@ -0,0 +1,62 @@
+"""Import time of app.py and cold-start time of each tool, each in a fresh process.
+
+Usage: python benchmarks/bench_cold_start.py [--mode "Simple Chat" ...]
+
+"import" is what every session pays before the page renders; "first use" is
+what the first request of a mode pays to load its models and clients (what a
+prewarm thread takes off the request path).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE_IMPORT = """
+import json, sys, time
+start = time.perf_counter()
+import app
+print(json.dumps({"seconds": time.perf_counter() - start, "modules": len(sys.modules)}))
+"""
+
+MEASURE_MODE = """
+import json, sys, time
+from warmup import warm_mode
+seconds = warm_mode(sys.argv[1])
+print(json.dumps({"seconds": seconds, "modules": len(sys.modules)}))
+"""
+
+
+def run(code, *args):
+    result = subprocess.run(
+        [sys.executable, "-c", code, *args], cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def report(name, result):
+    if "error" in result:
+        print(f"{name:<28} error: {result['error']}")
+    else:
+        print(f"{name:<28} {result['seconds'] * 1000:9.0f} ms {result['modules']:>7} modules")
+
+
+def main():
+    from warmup import MODE_WARMERS
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", nargs="*", default=list(MODE_WARMERS))
+    args = parser.parse_args()
+
+    report("import app", run(MEASURE_IMPORT))
+    for mode in args.mode:
+        report(f"first use: {mode}", run(MEASURE_MODE, mode))
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, ROOT)
+    main()
@@ -0,0 +1,110 @@
+"""One shared corpus vs a store per document: multi-document query latency and delete cost.
+
+Usage: python benchmarks/bench_corpus.py [--documents N] [--chunks-per-document M] [--dim D] [--k K]
+
+Both layouts use the quantized store with synthetic vectors, so the benchmark
+doesn't need the embedding model. Per-document stores are queried one by one
+and merged; the corpus answers with a single doc_id-filtered query. Deleting a
+document from the corpus is compared with rebuilding the store without it.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quantized_store import QuantizedVectorStore
+
+
+def add_document(store, doc, vectors):
+    ids = [f"doc{doc}:{n}" for n in range(len(vectors))]
+    metadatas = [{"doc_id": f"doc{doc}", "source": f"doc{doc}.pdf", "page": n // 3} for n in range(len(vectors))]
+    store.add_embeddings(ids, [f"doc{doc} chunk {n}" for n in range(len(vectors))], vectors, metadatas)
+
+
+def timed(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return (time.perf_counter() - start) / repeats * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=40)
+    parser.add_argument("--chunks-per-document", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(args.documents, args.chunks_per_document, args.dim)).astype(np.float32)
+    queries = rng.normal(size=(args.queries, args.dim)).astype(np.float32)
+    selected = list(range(0, args.documents, 2))
+
+    root = tempfile.mkdtemp(prefix="corpus_bench_")
+    try:
+        stores = []
+        for doc in range(args.documents):
+            store = QuantizedVectorStore(os.path.join(root, f"doc{doc}"), None)
+            add_document(store, doc, vectors[doc])
+            stores.append(store)
+        corpus = QuantizedVectorStore(os.path.join(root, "corpus"), None)
+        for doc in range(args.documents):
+            add_document(corpus, doc, vectors[doc])
+
+        def score(query, doc):
+            # Exact similarity, to merge the per-document results
+            vector = vectors[int(doc.metadata["doc_id"][3:]), int(doc.page_content.split()[-1])]
+            return float(np.dot(query, vector) / np.linalg.norm(vector))
+
+        def per_document():
+            results = []
+            for query in queries:
+                hits = [doc for d in selected for doc in stores[d].similarity_search_by_vector(query, args.k)]
+                hits.sort(key=lambda doc: -score(query, doc))
+                results.append([doc.page_content for doc in hits[:args.k]])
+            return results
+
+        where = {"doc_id": {"$in": [f"doc{d}" for d in selected]}}
+
+        def shared_corpus():
+            return [[doc.page_content for doc in corpus.similarity_search_by_vector(query, args.k, filter=where)] for query in queries]
+
+        candidates = vectors[selected].reshape(-1, args.dim)
+        candidates = candidates / np.linalg.norm(candidates, axis=1, keepdims=True)
+        exact = [
+            {f"doc{selected[i // args.chunks_per_document]} chunk {i % args.chunks_per_document}" for i in np.argsort(-(candidates @ query))[:args.k]}
+            for query in queries
+        ]
+        recall = lambda results: np.mean([len(set(found) & truth) / args.k for found, truth in zip(results, exact)])
+
+        per_document_ms, per_document_results = timed(per_document, 1)
+        corpus_ms, corpus_results = timed(shared_corpus, 1)
+
+        print(f"documents: {args.documents} x {args.chunks_per_document} chunks, searching {len(selected)} of them")
+        print(f"store per document: {per_document_ms / args.queries:7.2f} ms/query, recall@{args.k} {recall(per_document_results):.2f}")
+        print(f"filtered corpus:    {corpus_ms / args.queries:7.2f} ms/query, recall@{args.k} {recall(corpus_results):.2f}")
+
+        start = time.perf_counter()
+        corpus.delete(ids=[f"doc0:{n}" for n in range(args.chunks_per_document)])
+        delete_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        rebuilt = QuantizedVectorStore(os.path.join(root, "rebuilt"), None)
+        for doc in range(1, args.documents):
+            add_document(rebuilt, doc, vectors[doc])
+        rebuild_ms = (time.perf_counter() - start) * 1000
+        leaked = sum(doc.metadata["doc_id"] == "doc0" for query in queries for doc in corpus.similarity_search_by_vector(query, args.k))
+        print(f"delete a document:  {delete_ms:7.1f} ms (rebuild without it: {rebuild_ms:.1f} ms, deleted chunks returned: {leaked})")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Wall-clock time of a deep research run with searches run serially vs fanned out.
+
+Usage: python benchmarks/bench_deep_research_fanout.py [--queries-per-loop N] [--search-ms MS]
+
+The model and Tavily client are replaced by local stubs; every search sleeps for
+--search-ms to stand in for network latency. Both runs issue the same searches,
+the only difference is how many run at once.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+sys.modules.setdefault("api_key", types.SimpleNamespace(GOOGLE_API_KEY="stub", TAVILY_API_KEY="stub"))
+# Source passages are ranked with the stub embeddings rather than loading the local model
+os.environ.setdefault("CHATAI_BACKEND", "stub")
+
+import deep_research
+
+
+class StubModel:
+    def invoke(self, messages):
+        prompt = messages[-1].content
+        queries = [f"query {i} {time.perf_counter_ns()}" for i in range(deep_research.queries_per_loop)]
+        if "follow_up_queries" in prompt:
+            body = {"knowledge_gap": "gap", "follow_up_queries": queries}
+        elif '"queries"' in prompt:
+            body = {"queries": queries, "aspect": "aspect", "rationale": "rationale"}
+        else:
+            return types.SimpleNamespace(content="summary of the sources")
+        return types.SimpleNamespace(content=f"```json\n{json.dumps(body)}\n```")
+
+
+class StubSearchClient:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def search(self, query, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return {"results": [{
+            "title": query,
+            "url": f"https://example.com/{abs(hash(query))}",
+            "content": "content",
+            "raw_content": "raw content " * 50,
+        }]}
+
+
+def timed_run(workers):
+    deep_research.search_executor = ThreadPoolExecutor(max_workers=workers)
+    start = time.perf_counter()
+    deep_research.perform_deep_research("stub topic")
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries-per-loop", type=int, default=4)
+    parser.add_argument("--search-ms", type=float, default=200.0)
+    args = parser.parse_args()
+
+    deep_research.queries_per_loop = args.queries_per_loop
+    deep_research.gemma_model = StubModel()
+    search_client = StubSearchClient(args.search_ms / 1000)
+    deep_research.tavily_client = search_client
+
+    # Keep the summary prints of the research graph out of the report
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        serial = timed_run(1)
+        searches = search_client.calls
+        fanned_out = timed_run(args.queries_per_loop)
+    finally:
+        sys.stdout = stdout
+
+    print(f"searches per run : {searches}")
+    print(f"serial           : {serial:6.2f} s")
+    print(f"{'fan-out x' + str(args.queries_per_loop):<17}: {fanned_out:6.2f} s")
+    print(f"speedup          : {serial / fanned_out:6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Prompt tokens sent by each deep research node, loop by loop.
+
+Usage: python benchmarks/bench_deep_research_tokens.py [--loops N] [--summary-tokens T]
+
+Model and search are local stubs. The stub summarizer returns --summary-tokens
+worth of notes per call, so a summary that is re-sent in full shows up as
+prompt tokens growing linearly with the loop count.
+"""
+import argparse
+import json
+import os
+import sys
+import types
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+sys.modules.setdefault("api_key", types.SimpleNamespace(GOOGLE_API_KEY="stub", TAVILY_API_KEY="stub"))
+# Source passages are ranked with the stub embeddings rather than loading the local model
+os.environ.setdefault("CHATAI_BACKEND", "stub")
+
+import deep_research
+
+
+class CountingModel:
+    def __init__(self, summary_tokens):
+        self.summary_tokens = summary_tokens
+        self.calls = []
+        self.loop = 0
+
+    def invoke(self, messages):
+        prompt = messages[-1].content
+        tokens = deep_research.estimate_tokens(prompt)
+        n = deep_research.queries_per_loop
+        if "follow_up_queries" in prompt:
+            node = "reflect_on_summary"
+            body = {"knowledge_gap": f"gap {self.loop}", "follow_up_queries": [f"q{self.loop}.{i}" for i in range(n)]}
+            content = f"```json\n{json.dumps(body)}\n```"
+        elif '"queries"' in prompt:
+            node = "generate_query"
+            body = {"queries": [f"q0.{i}" for i in range(n)], "aspect": "overview", "rationale": "r"}
+            content = f"```json\n{json.dumps(body)}\n```"
+        elif "Condense the following" in prompt:
+            node = "compaction"
+            content = "condensed " * (self.summary_tokens // 4)
+        else:
+            node = "summarize_sources"
+            content = "fact " * (self.summary_tokens * 4 // 5)
+        self.calls.append((self.loop, node, tokens))
+        if node == "reflect_on_summary":
+            self.loop += 1
+        return types.SimpleNamespace(content=content)
+
+
+class StubSearchClient:
+    def search(self, query, **kwargs):
+        return {"results": [{
+            "title": query,
+            "url": f"https://example.com/{query}",
+            "content": "content " * 40,
+            "raw_content": "raw content " * 400,
+        }]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--loops", type=int, default=4)
+    parser.add_argument("--summary-tokens", type=int, default=400)
+    parser.add_argument("--budget", type=int, default=deep_research.summary_token_budget)
+    args = parser.parse_args()
+
+    model = CountingModel(args.summary_tokens)
+    deep_research.gemma_model = model
+    deep_research.tavily_client = StubSearchClient()
+
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        deep_research.perform_deep_research(
+            "stub topic", max_web_research_loops=args.loops, summary_token_budget=args.budget
+        )
+    finally:
+        sys.stdout = stdout
+
+    per_loop = defaultdict(lambda: defaultdict(int))
+    nodes = []
+    for loop, node, tokens in model.calls:
+        per_loop[loop][node] += tokens
+        if node not in nodes:
+            nodes.append(node)
+
+    print("loop " + "".join(f"{node:>20}" for node in nodes))
+    for loop in sorted(per_loop):
+        print(f"{loop:>4} " + "".join(f"{per_loop[loop].get(node, 0):>20}" for node in nodes))
+
+
+if __name__ == "__main__":
+    main()
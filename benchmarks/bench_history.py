@@ -0,0 +1,57 @@
+"""Per-turn latency over a long conversation, with and without the history budget.
+
+Usage: python benchmarks/bench_history.py [--turns N] [--ms-per-1k-tokens MS]
+
+The chat model is a stub whose latency grows with the prompt size
+(--ms-per-1k-tokens), and the summarizer is a stub with a fixed cost, so the
+numbers show how prompt growth turns into latency.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import HistoryManager, estimate_tokens, normalize_messages
+
+
+def stub_summarize(summary, messages):
+    time.sleep(0.005)
+    return (summary + " " + " ".join(m["content"][:40] for m in messages))[-1200:]
+
+
+def run(turns, build, ms_per_1k_tokens):
+    messages = []
+    latencies = []
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"question {turn} " + "lorem ipsum " * 40})
+        start = time.perf_counter()
+        prompt = build(messages)
+        tokens = sum(estimate_tokens(m["content"]) for m in prompt)
+        time.sleep(tokens / 1000 * ms_per_1k_tokens / 1000)
+        latencies.append((time.perf_counter() - start, tokens))
+        messages.append({"role": "assistant", "content": f"answer {turn} " + "dolor sit amet " * 60})
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=20.0)
+    parser.add_argument("--budget", type=int, default=3000)
+    args = parser.parse_args()
+
+    manager = HistoryManager(token_budget=args.budget, summarize_fn=stub_summarize)
+    full = run(args.turns, normalize_messages, args.ms_per_1k_tokens)
+    budgeted = run(args.turns, manager.build, args.ms_per_1k_tokens)
+
+    print(f"{'turn':>5} {'full ms':>9} {'full tok':>9} {'budget ms':>10} {'budget tok':>11}")
+    for turn in [0, 9, 24, 49, 74, 99]:
+        if turn < args.turns:
+            print(f"{turn + 1:>5} {full[turn][0] * 1000:>9.1f} {full[turn][1]:>9} "
+                  f"{budgeted[turn][0] * 1000:>10.1f} {budgeted[turn][1]:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Recall and latency of MMR, dense-only and hybrid (BM25 + dense, RRF) retrieval.
+
+Usage: python benchmarks/bench_hybrid_retrieval.py [--chunks N] [--k K] [--fetch-k F]
+
+The corpus is generated locally: maintenance notes for many near-identical
+components that only differ by part number and a few specifics. Half the
+queries name the exact part number, half paraphrase the specifics.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+import rag_utils
+from lexical_index import BM25Index
+
+COMPONENTS = ["hydraulic pump", "fuel injector", "cooling fan", "drive belt", "servo valve", "pressure sensor"]
+MATERIALS = ["titanium", "aluminium", "ceramic", "polymer", "stainless steel", "brass"]
+
+
+def build_corpus(n, rng):
+    documents, queries = [], []
+    for i in range(n):
+        part = f"{rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ')}{rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ')}-{rng.randint(1000, 9999)}"
+        component, material = rng.choice(COMPONENTS), rng.choice(MATERIALS)
+        interval = rng.randint(2, 48) * 250
+        torque = rng.randint(10, 90)
+        text = (
+            f"Part {part} is a {material} {component}. Inspect it every {interval} operating hours "
+            f"and tighten its mounting bolts to {torque} Nm. Replace the {component} when wear exceeds the limit "
+            f"given in the general maintenance chapter. Use only approved lubricants during reassembly."
+        )
+        chunk_id = f"bench:{i}"
+        documents.append(Document(page_content=text, metadata={"chunk_id": chunk_id}))
+        if i % 2:
+            queries.append((f"What torque should I use on {part}?", chunk_id))
+        else:
+            queries.append((f"{material} {component} inspected every {interval} hours", chunk_id))
+    return documents, queries
+
+
+def evaluate(name, retrieve, queries, k):
+    hits, latencies = 0, []
+    for query, chunk_id in queries:
+        start = time.perf_counter()
+        results = retrieve(query)
+        latencies.append(time.perf_counter() - start)
+        hits += any(doc.metadata.get("chunk_id") == chunk_id for doc in results[:k])
+    latencies.sort()
+    print(f"{name:>8} recall@{k}={hits / len(queries):.3f} "
+          f"p50={latencies[len(latencies) // 2] * 1000:.1f}ms p95={latencies[int(len(latencies) * 0.95)] * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=rag_utils.RETRIEVAL_K)
+    parser.add_argument("--fetch-k", type=int, default=rag_utils.RETRIEVAL_FETCH_K)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    documents, queries = build_corpus(args.chunks, rng)
+    queries = rng.sample(queries, min(args.queries, len(queries)))
+    ids = [doc.metadata["chunk_id"] for doc in documents]
+
+    store = tempfile.mkdtemp(prefix="chroma_bench_")
+    try:
+        vector_database = Chroma(persist_directory=store, embedding_function=rag_utils.ingest_embedding_model)
+        vector_database.add_documents(documents, ids=ids)
+        vector_database = Chroma(persist_directory=store, embedding_function=rag_utils.get_embedding_model())
+
+        lexical_index = BM25Index()
+        lexical_index.add_documents(documents, ids)
+        index_path = os.path.join(store, rag_utils.LEXICAL_INDEX_FILE)
+        lexical_index.save(index_path)
+        start = time.perf_counter()
+        lexical_index = BM25Index.load(index_path)
+        print(f"lexical index load: {(time.perf_counter() - start) * 1000:.1f}ms for {len(lexical_index)} chunks")
+
+        evaluate("mmr", lambda q: vector_database.max_marginal_relevance_search(q, k=args.k, fetch_k=args.fetch_k, lambda_mult=0.6), queries, args.k)
+        evaluate("dense", lambda q: vector_database.similarity_search(q, k=args.k), queries, args.k)
+        evaluate("hybrid", lambda q: rag_utils.find_related_documents(q, vector_database, lexical_index, args.k, args.fetch_k), queries, args.k)
+    finally:
+        shutil.rmtree(store, ignore_errors=True)
+        rag_utils.stop_embedding_pool()
+
+
+if __name__ == "__main__":
+    main()
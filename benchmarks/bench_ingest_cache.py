@@ -0,0 +1,53 @@
+"""Cold vs warm latency of generate_context on a PDF.
+
+Usage: python benchmarks/bench_ingest_cache.py path/to/file.pdf [--queries N]
+
+The first query pays the full ingest (load, chunk, embed); every later query on
+the same file should only pay retrieval because the ingestion registry already
+knows the collection.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rag_utils
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdf")
+    parser.add_argument("--queries", type=int, default=5)
+    parser.add_argument("--query", default="What is this document about?")
+    args = parser.parse_args()
+
+    # Isolated store so a previous run can't make the cold query warm
+    store = tempfile.mkdtemp(prefix="chroma_bench_")
+    rag_utils.CHROMA_ROOT = store
+    rag_utils.REGISTRY_PATH = os.path.join(store, "registry.json")
+
+    try:
+        start = time.perf_counter()
+        rag_utils.generate_context(args.query, args.pdf)
+        cold = time.perf_counter() - start
+
+        warm = []
+        for _ in range(args.queries):
+            start = time.perf_counter()
+            rag_utils.generate_context(args.query, args.pdf)
+            warm.append(time.perf_counter() - start)
+    finally:
+        shutil.rmtree(store, ignore_errors=True)
+
+    warm_avg = sum(warm) / len(warm)
+    print(f"cold query : {cold * 1000:9.1f} ms")
+    print(f"warm query : {warm_avg * 1000:9.1f} ms (avg of {len(warm)})")
+    print(f"speedup    : {cold / warm_avg:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
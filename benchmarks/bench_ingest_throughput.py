@@ -0,0 +1,63 @@
+"""Ingest throughput (pages/sec, chunks/sec) for a PDF across embedding worker counts.
+
+"first" is the time until the first chunks are searchable, when a query can
+already be answered while the rest of the PDF is ingested.
+
+Usage: python benchmarks/bench_ingest_throughput.py path/to/file.pdf [--workers 1 2 4 8]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rag_utils
+
+
+def run_ingest(pdf, workers, batch_size):
+    rag_utils.stop_embedding_pool()
+    rag_utils.EMBEDDING_WORKERS = workers
+    rag_utils.EMBEDDING_BATCH_SIZE = batch_size
+
+    store = tempfile.mkdtemp(prefix="chroma_bench_")
+    rag_utils.CHROMA_ROOT = store
+    rag_utils.REGISTRY_PATH = os.path.join(store, "registry.json")
+    try:
+        # Start the pool outside the timed region, it is paid once per process
+        if workers > 1:
+            rag_utils.get_embedding_pool()
+        start = time.perf_counter()
+        key = rag_utils.ingestion_key(pdf)
+        job = rag_utils.IngestJob(key)
+        ingest = threading.Thread(target=rag_utils.ProcessDocuments, args=(pdf, key, job))
+        ingest.start()
+        job.wait_until_searchable()
+        first = time.perf_counter() - start
+        ingest.join()
+        elapsed = time.perf_counter() - start
+        entry = rag_utils.load_registry()[key]
+    finally:
+        shutil.rmtree(store, ignore_errors=True)
+    return entry["pages"], entry["chunks"], first, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdf")
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--batch-size", type=int, default=rag_utils.EMBEDDING_BATCH_SIZE)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'pages':>7} {'chunks':>7} {'first':>8} {'secs':>8} {'pages/s':>9} {'chunks/s':>9}")
+    for workers in args.workers:
+        pages, chunks, first, elapsed = run_ingest(args.pdf, workers, args.batch_size)
+        print(f"{workers:>8} {pages:>7} {chunks:>7} {first:>8.2f} {elapsed:>8.2f} {pages / elapsed:>9.1f} {chunks / elapsed:>9.1f}")
+    rag_utils.stop_embedding_pool()
+
+
+if __name__ == "__main__":
+    main()
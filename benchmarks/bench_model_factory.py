@@ -0,0 +1,70 @@
+"""Per-turn overhead of getting a chat client: uncached, through the get_gemma cache,
+and one cached client with the sampling settings applied per call (run_model's path).
+
+Usage: python benchmarks/bench_model_factory.py [--turns N] [--construct-ms MS]
+
+ChatGoogleGenerativeAI is replaced by a local stub whose constructor sleeps for
+--construct-ms (client + transport setup) and whose invoke returns immediately,
+so the numbers isolate client construction from model latency.
+"""
+import argparse
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+sys.modules.setdefault("api_key", types.SimpleNamespace(GOOGLE_API_KEY="stub", TAVILY_API_KEY="stub"))
+
+import model
+
+
+class StubChatModel:
+    construct_seconds = 0.0
+    constructed = 0
+
+    def __init__(self, **kwargs):
+        time.sleep(StubChatModel.construct_seconds)
+        StubChatModel.constructed += 1
+        self.kwargs = kwargs
+
+    def bind(self, **kwargs):
+        return self
+
+    def invoke(self, history):
+        return types.SimpleNamespace(content="ok")
+
+
+def run_turns(factory, turns):
+    StubChatModel.constructed = 0
+    start = time.perf_counter()
+    for turn in range(turns):
+        # Slider values change occasionally, as they do in the app
+        temperature = 0.7 if turn % 10 < 8 else 1.0
+        factory(temperature=temperature, top_k=50, top_p=0.9).invoke([{"role": "user", "content": "hi"}])
+    return (time.perf_counter() - start) / turns, StubChatModel.constructed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--construct-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    StubChatModel.construct_seconds = args.construct_ms / 1000
+    model.ChatGoogleGenerativeAI = StubChatModel
+
+    before, before_built = run_turns(model.build_gemma, args.turns)
+    model._cached_gemma.cache_clear()
+    after, after_built = run_turns(model.get_gemma, args.turns)
+    model._cached_gemma.cache_clear()
+    overrides, overrides_built = run_turns(lambda **sampling: model.with_overrides(model.get_gemma(), **sampling), args.turns)
+
+    print(f"uncached : {before * 1e6:9.1f} us/turn, {before_built} clients built")
+    print(f"cached   : {after * 1e6:9.1f} us/turn, {after_built} clients built")
+    print(f"overrides: {overrides * 1e6:9.1f} us/turn, {overrides_built} clients built")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Single-stage retrieval vs cross-encoder reranking: context precision and reranker latency.
+
+Usage: python benchmarks/bench_reranker.py [--chunks N] [--queries Q] [--candidates C] [--max-chunks M] [--token-budget T] [--stub]
+
+The corpus is generated locally: maintenance notes for near-identical
+components, each query answered by exactly one chunk. Half the queries name the
+part number, half paraphrase its specifics. "hit" is the share of
+queries whose answer chunk reaches the context, "precision" the share of
+context chunks that are the answer chunk. Reranking runs twice to show the
+(query, chunk id) score cache. --stub swaps the embedding model and the
+cross-encoder for the local stand-ins.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+
+COMPONENTS = ["hydraulic pump", "fuel injector", "cooling fan", "drive belt", "servo valve", "pressure sensor"]
+MATERIALS = ["titanium", "aluminium", "ceramic", "polymer", "stainless steel", "brass"]
+
+
+def build_corpus(n, rng):
+    documents, queries = [], []
+    for i in range(n):
+        part = f"{rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ')}{rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ')}-{rng.randint(1000, 9999)}"
+        component, material = rng.choice(COMPONENTS), rng.choice(MATERIALS)
+        interval = rng.randint(2, 48) * 250
+        torque = rng.randint(10, 90)
+        text = (
+            f"Part {part} is a {material} {component}. Inspect it every {interval} operating hours "
+            f"and tighten its mounting bolts to {torque} Nm. Replace the {component} when wear exceeds the limit "
+            f"given in the general maintenance chapter."
+        )
+        chunk_id = f"bench:{i}"
+        documents.append(Document(page_content=text, metadata={"chunk_id": chunk_id}))
+        if i % 2:
+            queries.append((f"What torque should I use on {part}?", chunk_id))
+        else:
+            queries.append((f"How often should the {material} {component} with {interval} hour intervals be inspected?", chunk_id))
+    return documents, queries
+
+
+def evaluate(name, retrieve, queries, count_tokens):
+    hits = precision = tokens = 0
+    latencies = []
+    for query, chunk_id in queries:
+        start = time.perf_counter()
+        context = retrieve(query)
+        latencies.append(time.perf_counter() - start)
+        relevant = sum(doc.metadata["chunk_id"] == chunk_id for doc in context)
+        hits += relevant > 0
+        precision += relevant / max(len(context), 1)
+        tokens += sum(count_tokens(doc.page_content) for doc in context)
+    latencies.sort()
+    n = len(queries)
+    print(f"{name:>16} hit={hits / n:.3f} precision={precision / n:.3f} context={tokens / n:6.0f} tokens "
+          f"p50={latencies[n // 2] * 1000:7.1f}ms p95={latencies[int(n * 0.95)] * 1000:7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--candidates", type=int, default=None)
+    parser.add_argument("--max-chunks", type=int, default=None)
+    parser.add_argument("--token-budget", type=int, default=None)
+    parser.add_argument("--stub", action="store_true")
+    args = parser.parse_args()
+    if args.stub:
+        os.environ["CHATAI_BACKEND"] = "stub"
+
+    import rag_utils
+    from lexical_index import BM25Index
+    from quantized_store import QuantizedVectorStore
+    from reranker import Reranker
+    from source_fetcher import default_token_counter
+    from stubs import FakeEmbeddings
+
+    if args.stub:
+        rag_utils.get_embedding_model = lambda: FakeEmbeddings()
+    if args.candidates:
+        rag_utils.RERANK_CANDIDATES = args.candidates
+
+    rng = random.Random(7)
+    documents, queries = build_corpus(args.chunks, rng)
+    queries = rng.sample(queries, min(args.queries, len(queries)))
+    ids = [doc.metadata["chunk_id"] for doc in documents]
+    count_tokens = default_token_counter()
+
+    store = tempfile.mkdtemp(prefix="rerank_bench_")
+    try:
+        vector_database = QuantizedVectorStore(store, rag_utils.ingest_embedding_model)
+        vector_database.add_documents(documents, ids=ids)
+        lexical_index = BM25Index()
+        lexical_index.add_documents(documents, ids)
+
+        reranker = Reranker()
+        reranker.model.predict([("warm up", "warm up")])
+        import reranker as reranker_module
+        reranker_module._reranker = reranker
+
+        evaluate("single stage", lambda q: rag_utils.retrieve(q, vector_database, lexical_index, rerank=False), queries, count_tokens)
+        rerank = lambda q: rag_utils.retrieve(
+            q, vector_database, lexical_index, rerank=True, token_budget=args.token_budget, max_chunks=args.max_chunks
+        )
+        evaluate("reranked", rerank, queries, count_tokens)
+        evaluate("reranked, cached", rerank, queries, count_tokens)
+
+        candidates = [rag_utils.find_related_documents(q, vector_database, lexical_index, k=rag_utils.RERANK_CANDIDATES) for q, _ in queries]
+        cold = Reranker(model=reranker.model)
+        start = time.perf_counter()
+        for (query, _), docs in zip(queries, candidates):
+            cold.score(query, docs)
+        per_query = (time.perf_counter() - start) / len(queries)
+        print(f"cross-encoder: {per_query * 1000:.1f}ms per query for {rag_utils.RERANK_CANDIDATES} candidates "
+              f"(batch size {cold.batch_size}), {reranker.hits} of {reranker.hits + reranker.misses} scores served from cache")
+    finally:
+        shutil.rmtree(store, ignore_errors=True)
+        rag_utils.stop_embedding_pool()
+
+
+if __name__ == "__main__":
+    main()
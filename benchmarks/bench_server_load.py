@@ -0,0 +1,133 @@
+"""Throughput of the API server as uvicorn worker processes are added.
+
+Usage: python benchmarks/bench_server_load.py [--workers 1 2 4] [--per-worker N] [--clients C] [--duration S] [--warmup S] [--endpoint chat|research]
+
+Each run starts `uvicorn server:app --workers N` on the stub backend, in a
+fresh working directory, with the endpoint limited to --per-worker requests at
+once per process; the limit stands in for what one process can serve with a
+real model. --clients streaming clients (default: enough to saturate the
+largest run twice over) send requests for --warmup seconds, so every process
+has loaded its model, then for --duration seconds, retrying
+after the Retry-After delay whenever the server answers 503. Connections aren't
+reused: a kept-alive connection stays with one worker process, and only new
+connections are spread across them (a load balancer's job in production).
+Throughput, counted over requests completed within the window, should grow
+linearly with the number of workers, with rejects absorbing the excess.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers, per_worker, endpoint, cwd):
+    port = free_port()
+    env = dict(
+        os.environ,
+        CHATAI_BACKEND="stub",
+        CHATAI_VECTOR_BACKEND="quantized",
+        CHATAI_WORKER_THREADS=str(max(32, per_worker * 2)),
+        CHATAI_MAX_QUEUED="0",
+        **{f"CHATAI_MAX_CONCURRENT_{endpoint.upper()}": str(per_worker)},
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--app-dir", ROOT, "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/healthz", timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("the server didn't start")
+
+
+def request_for(endpoint, n):
+    if endpoint == "research":
+        return "/v1/research", {"query": f"history of topic {n}", "settings": {"max_web_research_loops": 1}}
+    # Sampled at the default temperature, so no answer comes from the semantic cache
+    return "/v1/chat", {"messages": [{"role": "user", "content": f"Tell me about topic {n}"}]}
+
+
+async def client_loop(client, endpoint, deadline, counter, results):
+    while time.monotonic() < deadline:
+        path, payload = request_for(endpoint, next(counter))
+        start = time.perf_counter()
+        async with client.stream("POST", path, json=payload) as response:
+            if response.status_code == 503:
+                results["rejected"] += 1
+                await asyncio.sleep(float(response.headers.get("retry-after", 1)))
+                continue
+            response.raise_for_status()
+            async for _ in response.aiter_bytes():
+                pass
+        if time.monotonic() <= deadline:
+            results["latencies"].append(time.perf_counter() - start)
+
+
+async def drive(url, endpoint, clients, duration):
+    results = {"latencies": [], "rejected": 0}
+    counter = iter(range(10 ** 9))
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=0)
+    async with httpx.AsyncClient(base_url=url, timeout=300, limits=limits) as client:
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*[client_loop(client, endpoint, deadline, counter, results) for _ in range(clients)])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--per-worker", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=None)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--warmup", type=float, default=10.0)
+    parser.add_argument("--endpoint", choices=["chat", "research"], default="chat")
+    args = parser.parse_args()
+    clients = args.clients or 2 * args.per_worker * max(args.workers)
+
+    print(f"{args.endpoint}: {args.per_worker} requests at once per worker, {clients} clients, {args.duration:.0f}s per run")
+    baseline = None
+    for workers in args.workers:
+        cwd = tempfile.mkdtemp(prefix="server_bench_")
+        process, url = start_server(workers, args.per_worker, args.endpoint, cwd)
+        try:
+            asyncio.run(drive(url, args.endpoint, clients, args.warmup))
+            results = asyncio.run(drive(url, args.endpoint, clients, args.duration))
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+            shutil.rmtree(cwd, ignore_errors=True)
+
+        latencies = sorted(results["latencies"])
+        n = len(latencies)
+        throughput = n / args.duration
+        baseline = baseline or throughput / workers
+        print(f"workers={workers:<3} {throughput:6.2f} req/s ({throughput / baseline / workers:4.0%} of linear) "
+              f"completed={n:<5} rejected={results['rejected']:<6} "
+              f"p50={latencies[n // 2]:.2f}s p95={latencies[int(n * 0.95)]:.2f}s" if n else f"workers={workers} no requests completed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Fetching and packing deep research sources from a local HTTP fixture.
+
+Usage: python benchmarks/bench_source_fetcher.py [--pages N] [--page-ms MS] [--concurrency N] [--token-budget N]
+
+A local server, allowed through FETCH_ALLOWED_HOSTS, serves --pages HTML
+pages, each delayed by --page-ms to stand in for network latency. Every page
+holds one paragraph about the query topic among boilerplate and unrelated
+paragraphs. The pages are fetched serially and then
+concurrently, and the packed context is checked for the relevant paragraphs and
+the token budget.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import source_fetcher
+from stubs import FakeEmbeddings
+
+TOPIC = "solid state battery electrolyte degradation"
+
+
+def fixture_page(n):
+    unrelated = "".join(
+        f"<p>Paragraph {i} of page {n} covers gardening, weather and local sports results in detail.</p>"
+        for i in range(12)
+    )
+    relevant = f"<p>Page {n} finding: {TOPIC} is driven by interface reactions between lithium and the electrolyte.</p>"
+    return (
+        f"<html><head><title>Page {n}</title><script>var tracking = {n};</script></head><body>"
+        f"<nav>Home | About | Contact</nav>{unrelated[:len(unrelated) // 2]}{relevant}{unrelated[len(unrelated) // 2:]}"
+        f"<footer>Copyright page {n}</footer></body></html>"
+    )
+
+
+def serve(page_ms):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(page_ms / 1000)
+            body = fixture_page(int(self.path.strip("/") or 0)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--page-ms", type=float, default=200)
+    parser.add_argument("--concurrency", type=int, default=source_fetcher.FETCH_CONCURRENCY)
+    parser.add_argument("--token-budget", type=int, default=1000)
+    args = parser.parse_args()
+
+    server = serve(args.page_ms)
+    # Only public addresses are fetched unless allowed
+    source_fetcher.FETCH_ALLOWED_HOSTS.append("127.0.0.1")
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"{base}/{n}" for n in range(args.pages)]
+
+    start = time.perf_counter()
+    serial = [source_fetcher.fetch_url(url) for url in urls]
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fetched = asyncio.run(source_fetcher.fetch_all(urls, args.concurrency))
+    concurrent_time = time.perf_counter() - start
+    assert [fetched[url] for url in urls] == serial
+
+    search_results = [{"results": [{"title": f"Page {n}", "url": url, "content": ""}]} for n, url in enumerate(urls)]
+    count_tokens = lambda text: len(text) // 4
+    start = time.perf_counter()
+    context = source_fetcher.gather_sources(
+        TOPIC, search_results, args.token_budget, embeddings=FakeEmbeddings(), count_tokens=count_tokens,
+        concurrency=args.concurrency,
+    )
+    gather_time = time.perf_counter() - start
+    server.shutdown()
+
+    raw_tokens = sum(count_tokens(text) for text in serial)
+    print(f"pages: {args.pages}, {args.page_ms:.0f} ms each, concurrency {args.concurrency}")
+    print(f"serial fetch:     {serial_time:.2f}s")
+    print(f"concurrent fetch: {concurrent_time:.2f}s ({serial_time / concurrent_time:.1f}x)")
+    print(f"fetch + rank + pack: {gather_time:.2f}s")
+    print(f"extracted tokens: {raw_tokens}, packed tokens: {count_tokens(context)} (budget {args.token_budget})")
+    passages = [p for block in context.split("Most relevant content from source: ")[1:] for p in block.split("\n...\n")]
+    print(f"packed passages holding the topic paragraph: {sum(TOPIC in p for p in passages)}/{len(passages)}")
+    print("boilerplate in context:", any(word in context for word in ("tracking", "Copyright", "Contact")))
+
+
+if __name__ == "__main__":
+    main()
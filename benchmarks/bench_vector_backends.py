@@ -0,0 +1,121 @@
+"""Chroma vs the quantized memory-mapped store: recall@k, query latency, resident memory.
+
+Usage: python benchmarks/bench_vector_backends.py [--vectors N] [--dim D] [--k K]
+
+Vectors are synthetic (clustered Gaussian, like sentence embeddings) so the
+benchmark doesn't need the embedding model. Recall is measured against exact
+float32 search. Each backend runs in its own process so their memory doesn't mix.
+"""
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_dataset(n, dim, queries, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(n // 500, 1), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_vectors = vectors[rng.choice(n, queries, replace=False)] + 0.05 * rng.normal(size=(queries, dim)).astype(np.float32)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    return vectors, query_vectors
+
+
+def build_store(backend, path, vectors, dtype):
+    ids = [str(i) for i in range(len(vectors))]
+    texts = [f"chunk {i}" for i in ids]
+    if backend == "chroma":
+        import chromadb
+        client = chromadb.PersistentClient(path=path)
+        collection = client.get_or_create_collection("bench", metadata={"hnsw:space": "cosine"})
+        batch = client.get_max_batch_size()
+        for start in range(0, len(ids), batch):
+            end = start + batch
+            collection.add(ids=ids[start:end], embeddings=vectors[start:end].tolist(), documents=texts[start:end])
+    else:
+        from quantized_store import QuantizedVectorStore
+        store = QuantizedVectorStore(path, None, dtype=dtype)
+        for start in range(0, len(ids), 50000):
+            end = start + 50000
+            store.add_embeddings(ids[start:end], texts[start:end], vectors[start:end])
+
+
+def open_search(backend, path):
+    if backend == "chroma":
+        import chromadb
+        collection = chromadb.PersistentClient(path=path).get_collection("bench")
+        return lambda q, k: [int(i) for i in collection.query(query_embeddings=[q.tolist()], n_results=k)["ids"][0]]
+    from quantized_store import QuantizedVectorStore
+    store = QuantizedVectorStore(path, None)
+    return lambda q, k: [int(doc.page_content.split()[1]) for doc in store.similarity_search_by_vector(q, k)]
+
+
+def run_backend(args):
+    vectors, query_vectors = make_dataset(args.vectors, args.dim, args.queries)
+    truth = np.argsort(-(query_vectors @ vectors.T), axis=1)[:, :args.k]
+
+    path = tempfile.mkdtemp(prefix=f"{args.backend}_bench_")
+    try:
+        build_store(args.backend, path, vectors, args.dtype)
+        del vectors
+        baseline = rss_mb()
+        search = open_search(args.backend, path)
+
+        latencies, hits = [], 0
+        for query, expected in zip(query_vectors, truth):
+            start = time.perf_counter()
+            found = search(query, args.k)
+            latencies.append(time.perf_counter() - start)
+            hits += len(set(found) & set(expected.tolist()))
+        latencies.sort()
+        disk_mb = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files) / 1e6
+        print(f"{args.backend + ('/' + args.dtype if args.backend == 'quantized' else ''):>16} "
+              f"recall@{args.k}={hits / (len(truth) * args.k):.3f} "
+              f"p50={latencies[len(latencies) // 2] * 1000:.2f}ms "
+              f"p95={latencies[int(len(latencies) * 0.95)] * 1000:.2f}ms "
+              f"rss+{rss_mb() - baseline:.0f}MB disk={disk_mb:.0f}MB")
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["chroma", "quantized", "all"], default="all")
+    parser.add_argument("--dtype", choices=["int8", "float16"], default="int8")
+    parser.add_argument("--vectors", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.backend != "all":
+        run_backend(args)
+        return
+
+    common = ["--vectors", str(args.vectors), "--dim", str(args.dim), "--queries", str(args.queries), "--k", str(args.k)]
+    for backend, dtype in [("chroma", "int8"), ("quantized", "int8"), ("quantized", "float16")]:
+        subprocess.run([sys.executable, __file__, "--backend", backend, "--dtype", dtype] + common, check=True)
+
+
+if __name__ == "__main__":
+    main()
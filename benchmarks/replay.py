@@ -0,0 +1,177 @@
+"""Replay a traffic trace against the chat, web search and deep research pipelines.
+
+Usage:
+    python benchmarks/replay.py requests.jsonl --modes chat web deep --concurrency 1 4 16
+    python benchmarks/replay.py trace.jsonl --save-baseline baseline.json
+    python benchmarks/replay.py trace.jsonl --baseline baseline.json --max-regression 0.2
+
+Each trace line is a JSON object. The query is taken from "query", "prompt",
+"title" or "body", and an optional "mode" pins the line to one pipeline;
+otherwise every line is replayed in every requested mode.
+
+By default the stub backends from stubs.py are used (CHATAI_BACKEND=stub),
+with latencies set by --llm-latency-ms, --tokens-per-second and
+--search-latency-ms. Pass --live to hit the real services instead.
+With --baseline, the run fails (exit code 1) when any mode/concurrency p95
+latency or throughput is worse than the baseline by more than --max-regression.
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ("chat", "rag", "web", "deep")
+
+
+def load_trace(path, limit=None):
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            query = record.get("query") or record.get("prompt") or record.get("title") or record.get("body")
+            if query:
+                entries.append({"query": query[:2000], "mode": record.get("mode")})
+            if limit and len(entries) >= limit:
+                break
+    return entries
+
+
+def make_runner(mode, args):
+    if mode == "chat":
+        from run_model import generate_response
+        return lambda query: generate_response([{"role": "user", "content": query}])
+    if mode == "rag":
+        from run_model import generate_RAG_response
+        return lambda query: generate_RAG_response(query, args.pdf, [{"role": "user", "content": query}])
+    if mode == "web":
+        from web_search import search_web
+        return search_web
+    if mode == "deep":
+        from deep_research import perform_deep_research
+        return lambda query: perform_deep_research(query, max_web_research_loops=args.research_loops)
+    raise ValueError(mode)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def replay(run, queries, concurrency):
+    latencies, errors = [], 0
+
+    def timed(query):
+        start = time.perf_counter()
+        try:
+            run(query)
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, e
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency, error in pool.map(timed, queries):
+            latencies.append(latency)
+            errors += error is not None
+    wall = time.perf_counter() - start
+    return {
+        "requests": len(queries),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "throughput_rps": len(queries) / wall,
+    }
+
+
+def regressions(results, baseline, max_regression):
+    found = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        # A pipeline that fails fast would otherwise pass with better latency
+        previous_errors = previous.get("errors", 0) if previous else 0
+        if current["errors"] > previous_errors:
+            found.append(f"{key}: errors {previous_errors} -> {current['errors']}")
+        if not previous:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+            found.append(f"{key}: p95 {previous['p95_ms']:.0f}ms -> {current['p95_ms']:.0f}ms")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - max_regression):
+            found.append(f"{key}: throughput {previous['throughput_rps']:.2f} -> {current['throughput_rps']:.2f} req/s")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("trace")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=["chat", "web", "deep"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--limit", type=int, default=None, help="Replay at most this many trace lines")
+    parser.add_argument("--pdf", help="PDF used for rag mode")
+    parser.add_argument("--research-loops", type=int, default=1)
+    parser.add_argument("--live", action="store_true", help="Use the real model and search services")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--tokens-per-second", type=float, default=80)
+    parser.add_argument("--search-latency-ms", type=float, default=400)
+    parser.add_argument("--baseline")
+    parser.add_argument("--save-baseline")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if "rag" in args.modes and not args.pdf:
+        parser.error("rag mode needs --pdf")
+
+    if not args.live:
+        os.environ["CHATAI_BACKEND"] = "stub"
+        os.environ["CHATAI_STUB_LATENCY_MS"] = str(args.llm_latency_ms)
+        os.environ["CHATAI_STUB_TOKENS_PER_SECOND"] = str(args.tokens_per_second)
+        os.environ["CHATAI_STUB_SEARCH_LATENCY_MS"] = str(args.search_latency_ms)
+    # A warm search cache from an earlier run would hide the search latency
+    os.environ["CHATAI_SEARCH_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="replay_"), "search_cache.sqlite3")
+    os.environ.setdefault("CHATAI_TRACE_EXPORT", "0")
+
+    trace = load_trace(args.trace, args.limit)
+    results = {}
+    print(f"{'mode':<6} {'conc':>5} {'reqs':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+    for mode in args.modes:
+        queries = [entry["query"] for entry in trace if entry["mode"] in (None, mode)]
+        if not queries:
+            continue
+        run = make_runner(mode, args)
+        for concurrency in args.concurrency:
+            # Fresh cache per level, each level pays its own searches
+            import search_cache
+            search_cache.get_search_client().cache.clear()
+            # The pipelines print progress, keep it out of the report
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                result = replay(run, queries, concurrency)
+            results[f"{mode}@{concurrency}"] = result
+            print(f"{mode:<6} {concurrency:>5} {result['requests']:>5} {result['errors']:>4} "
+                  f"{result['p50_ms']:>9.0f} {result['p95_ms']:>9.0f} {result['p99_ms']:>9.0f} {result['throughput_rps']:>8.2f}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            found = regressions(results, json.load(f), args.max_regression)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
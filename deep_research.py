@@ -3,34 +3,52 @@ import os
 from typing import Annotated, Dict, Any, List, Union, Optional
 from typing_extensions import TypedDict, Annotated, Literal
 import operator
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 from re import T
 import json
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph import START, END, StateGraph
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 import time
-from tavily import TavilyClient
+from concurrent.futures import ThreadPoolExecutor
 import re
+import threading
+import uuid
 from model import get_gemma
+from search_cache import get_search_client
+from tracing import traced, get_callbacks
+from source_fetcher import gather_sources
 
-from api_key import TAVILY_API_KEY
-
-gemma_model = get_gemma()
-
-tavily_client = TavilyClient(api_key=TAVILY_API_KEY)
+# Created on first use by research_model() and research_search_client()
+gemma_model = None
+tavily_client = None
 
+# Defaults for a research run, each can be overridden per run through RunnableConfig
 max_web_research_loops: int = 4
+# Number of search queries generated and run concurrently in each research loop
+queries_per_loop: int = 3
+results_per_query: int = 3
+# Token budget of the passages packed from each loop's sources
+source_token_budget: int = 1500
+# Approximate token budget of all summary notes before older sections are condensed
+summary_token_budget: int = 1500
+
+# Shared across sessions so concurrent research runs can't open unbounded threads
+search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="web_research")
 
 
 @dataclass(kw_only=True)
 class SummaryState:
     research_topic: str = field(default=None)
     search_query: str = field(default=None)
+    search_queries: list = field(default_factory=list)
     web_search_results: Annotated[list, operator.add] = field(default_factory=list)
-    sources_gathered: Annotated[list, operator.add] = field(default=list)
+    sources_gathered: Annotated[list, operator.add] = field(default_factory=list)
     research_loop_count: int = 0
     running_summary: str = None
+    # Research notes keyed by section title, so each loop only works on one slice
+    summary_sections: dict = field(default_factory=dict)
+    current_section: str = None
 
 
 @dataclass(kw_only=True)
@@ -42,15 +60,32 @@ class SummaryStateOutput:
     running_summary: str = None
 
 
+@dataclass(kw_only=True)
+class Configuration:
+    """Per-run research settings, read from RunnableConfig["configurable"]."""
+    max_web_research_loops: int = field(default_factory=lambda: max_web_research_loops)
+    queries_per_loop: int = field(default_factory=lambda: queries_per_loop)
+    results_per_query: int = field(default_factory=lambda: results_per_query)
+    summary_token_budget: int = field(default_factory=lambda: summary_token_budget)
+    source_token_budget: int = field(default_factory=lambda: source_token_budget)
+
+    @classmethod
+    def from_runnable_config(cls, config: Optional[RunnableConfig] = None) -> "Configuration":
+        configurable = (config or {}).get("configurable", {})
+        values = {f.name: configurable[f.name] for f in fields(cls) if configurable.get(f.name) is not None}
+        return cls(**values)
+
+
 # Query Writer
-query_writer_instructions = """Your gola is to generate web search query.
-The query will gather information about specific topic.
+query_writer_instructions = """Your gola is to generate {number_of_queries} web search queries.
+The queries will gather information about specific topic.
+Each query should cover a different angle of the topic so their results don't overlap.
 
 Topic: {research_topic}
 
-Return your query as JSON object:
+Return your queries as JSON object:
 {{
-    "query": "string",
+    "queries": ["string", ...],
     "aspect" : "string",
     "rationale" : "string"
 }}
@@ -80,45 +115,134 @@ In both cases:
 7. You will generate tables using markdown when user asks you to do.
 """
 
+# Compaction Instructions
+compaction_instructions = """Condense the following research notes to at most {max_tokens} tokens.
+Keep every concrete fact, number and name. Drop repetition and filler.
+Return only the condensed notes, without preamble.
+"""
+
 # Reflection Instructions
 reflection_summary = """You are an expert research assistant analyzing summary about {research_topic}.
 
 Your Tasks :
 1. Identify knowledge gaps or areas the need further exploration.
-2. Generate a follow-up question that would help in expanding the understanding.
+2. Generate {number_of_queries} follow-up questions that would help in expanding the understanding.
 3. Focus on technical details, implementation specifics.
 
-Ensure follow-up question is self-contained and includes necessary context for web search.
+Ensure each follow-up question is self-contained and includes necessary context for web search.
 
 Return response as JSON object:
 {{
     "knowledge_gap" : "string",
-    "follow_up_query" : "string"
+    "follow_up_queries" : ["string", ...]
 }}
 """
 
 
-def generate_query(state: SummaryState):
+def research_model():
+    global gemma_model
+    if gemma_model is None:
+        gemma_model = get_gemma()
+    return gemma_model
+
+
+def research_search_client():
+    global tavily_client
+    if tavily_client is None:
+        tavily_client = get_search_client()
+    return tavily_client
+
+
+def parse_json_response(raw_content: str) -> Dict[str, Any]:
+    # Models usually fence their JSON, fall back to the outermost braces when they don't
+    match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", raw_content, re.DOTALL)
+    if not match:
+        match = re.search(r"(\{.*\})", raw_content, re.DOTALL)
+    if not match:
+        raise ValueError(f"Failed to extract JSON from model response: {raw_content}")
+    return json.loads(match.group(1))
+
+
+def estimate_tokens(text: str) -> int:
+    # Using rough estimate of 4 characters per token
+    return len(text or "") // 4
+
+
+def section_title(title: Optional[str], fallback: str) -> str:
+    title = " ".join((title or "").split())
+    return (title or fallback)[:120]
+
+
+def render_sections(sections: Dict[str, str]) -> str:
+    return "\n\n".join(f"### {title}\n{notes}" for title, notes in sections.items() if notes)
+
+
+def summary_outline(sections: Dict[str, str], detail_section: Optional[str] = None) -> str:
+    """
+    Compact view of the notes: every section title, with full notes only for `detail_section`.
+    """
+    lines = []
+    for title, notes in sections.items():
+        if title == detail_section:
+            lines.append(f"### {title}\n{notes}")
+        else:
+            lines.append(f"- {title}")
+    return "\n".join(lines)
+
+
+def compact_sections(sections: Dict[str, str], budget: int, keep: Optional[str] = None) -> Dict[str, str]:
+    """
+    Condense the oldest sections (never `keep`) until the notes fit in `budget` tokens.
+    """
+    sections = dict(sections)
+    for title in list(sections):
+        total = sum(estimate_tokens(notes) for notes in sections.values())
+        if total <= budget:
+            break
+        if title == keep or not sections[title]:
+            continue
+        target = max(estimate_tokens(sections[title]) // 2, 1)
+        result = research_model().invoke([HumanMessage(
+            content=f"IMPORTANT INSTRUCTIONS:\n{compaction_instructions.format(max_tokens=target)}\n\nNotes:\n{sections[title]}"
+        )])
+        condensed = result.content.strip()
+        # Never let a compaction grow the notes
+        if estimate_tokens(condensed) > target:
+            condensed = condensed[:target * 4]
+        sections[title] = condensed
+    return sections
+
+
+def select_queries(queries, fallback: str, limit: int) -> List[str]:
+    if isinstance(queries, str):
+        queries = [queries]
+    queries = [q.strip() for q in (queries or []) if isinstance(q, str) and q.strip()]
+    return (queries or [fallback])[:limit]
+
+
+def generate_query(state: SummaryState, config: RunnableConfig):
     # To generate query for web search
+    configuration = Configuration.from_runnable_config(config)
 
-    system_message_for_query_writer = query_writer_instructions.format(research_topic=state.research_topic)
+    system_message_for_query_writer = query_writer_instructions.format(
+        research_topic=state.research_topic,
+        number_of_queries=configuration.queries_per_loop
+    )
 
-    result = gemma_model.invoke(
+    result = research_model().invoke(
         [
-            HumanMessage(content=f"IMPORTANT INSTRUCTIONS:\n{system_message_for_query_writer}\n\nGenerate a query for web search")
+            HumanMessage(content=f"IMPORTANT INSTRUCTIONS:\n{system_message_for_query_writer}\n\nGenerate queries for web search")
         ]
     )
 
     # print(f"[FUN] GENERATE_QUERY:\nType: {type(result)}\nContent: {result}")
-    raw_content = result.content.strip()
-    match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", raw_content, re.DOTALL)
-    if match:
-        json_str = match.group(1)
-    else:
-        raise ValueError(f"Failed to extract JSON from model response: {raw_content}")
-
-    query = json.loads(json_str)
-    return {"search_query" : query["query"]}
+    query = parse_json_response(result.content.strip())
+    queries = select_queries(query.get("queries", query.get("query")), state.research_topic, configuration.queries_per_loop)
+    return {
+        "search_query" : queries[0],
+        "search_queries" : queries,
+        "current_section" : section_title(query.get("aspect"), state.research_topic)
+    }
 
 
 def deduplicate_and_format_sources(
@@ -204,79 +328,103 @@ def format_sources(search_results: Dict[str, Any]) -> str:
     )
 
 
-def web_research(state: SummaryState):
-    search_results = tavily_client.search(state.search_query, include_raw_content=True, max_results=1)
-    search_str = deduplicate_and_format_sources(search_results, max_tokens_per_source=1000)
+def search_one(query: str, max_results: int = 1) -> Dict[str, Any]:
+    return research_search_client().search(query, include_raw_content=True, max_results=max_results)
+
+
+def web_research(state: SummaryState, config: RunnableConfig):
+    # All queries of this loop are searched concurrently and merged into one set of sources
+    configuration = Configuration.from_runnable_config(config)
+    queries = state.search_queries or [state.search_query]
+    search_results = list(search_executor.map(
+        lambda query: search_one(query, configuration.results_per_query), queries
+    ))
+    # Best passages across all fetched pages; plain snippets if nothing could be extracted
+    search_str = gather_sources(
+        " ".join([state.research_topic or ""] + queries), search_results, configuration.source_token_budget
+    ) or deduplicate_and_format_sources(search_results, max_tokens_per_source=1000)
     return {
-        "sources_gathered" : [format_sources(search_results)],
+        "sources_gathered" : [format_sources(result) for result in search_results],
         "research_loop_count" : state.research_loop_count + 1,
         "web_search_results" : [search_str]
     }
 
 
-def summarize_sources(state: SummaryState):
-    existing_summary = state.running_summary
-    print(state.web_search_results)
+def summarize_sources(state: SummaryState, config: RunnableConfig):
+    # Only the notes of the section this loop researched are sent, other sections by title
+    configuration = Configuration.from_runnable_config(config)
+    section = state.current_section or state.research_topic
+    existing_summary = state.summary_sections.get(section)
+    covered = [title for title in state.summary_sections if title != section]
     most_recent_web_search = state.web_search_results[-1]
 
+    covered_message = (
+        f"Other sections already cover (don't repeat them): {'; '.join(covered)}\n\n" if covered else ""
+    )
     if existing_summary:
         human_message = (
             f"IMPORTANT INSTRUCTIONS:\n{summerizer_instructions}\n\n"
-            f"Extend the existing summary: {existing_summary}\n\n"
+            f"{covered_message}"
+            f"Extend the existing summary of the section '{section}': {existing_summary}\n\n"
             f"Include new search results: {most_recent_web_search}"
             f"That addresses the following topic: {state.research_topic}"
         )
     else:
         human_message = (
             f"IMPORTANT INSTRUCTIONS:\n{summerizer_instructions}\n\n"
-            f"Generate summary of these search results: {most_recent_web_search}"
+            f"{covered_message}"
+            f"Generate summary for the section '{section}' of these search results: {most_recent_web_search}"
             f"That addresses the following topic: {state.research_topic}"
         )
 
-    result = gemma_model.invoke([HumanMessage(content=human_message)])
+    result = research_model().invoke([HumanMessage(content=human_message)])
+
+    sections = dict(state.summary_sections)
+    sections[section] = result.content
+    sections = compact_sections(sections, configuration.summary_token_budget, keep=section)
 
-    return {"running_summary" : result.content}
+    return {"summary_sections" : sections, "running_summary" : render_sections(sections)}
 
 
-def reflect_on_summary(state: SummaryState):
-    result = gemma_model([
-        HumanMessage(content=f"IMPORTANT INSTRUCTIONS:\n{reflection_summary.format(research_topic=state.research_topic)}\n\nIdentify a knowledge gap and generate a follow-up web search query based on existing knowledge: {state.running_summary}")
+def reflect_on_summary(state: SummaryState, config: RunnableConfig):
+    configuration = Configuration.from_runnable_config(config)
+    instructions = reflection_summary.format(research_topic=state.research_topic, number_of_queries=configuration.queries_per_loop)
+    result = research_model().invoke([
+        HumanMessage(content=f"IMPORTANT INSTRUCTIONS:\n{instructions}\n\nIdentify a knowledge gap and generate follow-up web search queries based on existing knowledge: {summary_outline(state.summary_sections, state.current_section)}")
     ])
 #    print(f">> [FUN] REFLECT ON SUMMARY:\n{result.content}")
-    raw_content = result.content.strip()
-    match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", raw_content, re.DOTALL)
-    if match:
-        json_str = match.group(1)
-    else:
-        raise ValueError(f"Failed to extract JSON from model response: {raw_content}")
-
-    query = json.loads(json_str)
+    query = parse_json_response(result.content.strip())
     print(query)
-    return {"search_query" : query["follow_up_query"]}
+    queries = select_queries(query.get("follow_up_queries", query.get("follow_up_query")), state.research_topic, configuration.queries_per_loop)
+    return {
+        "search_query" : queries[0],
+        "search_queries" : queries,
+        "current_section" : section_title(query.get("knowledge_gap"), queries[0])
+    }
 
 
 def finalize_summary(state: SummaryState):
     all_sources = "\n".join(source for source in state.sources_gathered)
     print(f"All Sources: {all_sources}")
-    running_summary = f"## Summary\n\n{state.running_summary}\n\nSources:\n{all_sources}"
+    running_summary = f"## Summary\n\n{render_sections(state.summary_sections)}\n\nSources:\n{all_sources}"
     return {"running_summary" : running_summary}
 
-def route_research(state: SummaryState):
-    if state.research_loop_count <= max_web_research_loops:
+def route_research(state: SummaryState, config: RunnableConfig):
+    configuration = Configuration.from_runnable_config(config)
+    if state.research_loop_count <= configuration.max_web_research_loops:
         return "web_research"
     else:
         return "finalize_summary"
     
 
-def perform_deep_research(query):
-    
-    builder = StateGraph(SummaryState, input_schema=SummaryStateInput, output_schema=SummaryStateOutput)
+def build_research_graph():
+    builder = StateGraph(SummaryState, input_schema=SummaryStateInput, output_schema=SummaryStateOutput, config_schema=Configuration)
 
-    builder.add_node("generate_query", generate_query)
-    builder.add_node("web_research", web_research)
-    builder.add_node("summarize_sources", summarize_sources)
-    builder.add_node("reflect_on_summary", reflect_on_summary)
-    builder.add_node("finalize_summary", finalize_summary)
+    builder.add_node("generate_query", traced("research.generate_query", "node")(generate_query))
+    builder.add_node("web_research", traced("research.web_research", "node")(web_research))
+    builder.add_node("summarize_sources", traced("research.summarize_sources", "node")(summarize_sources))
+    builder.add_node("reflect_on_summary", traced("research.reflect_on_summary", "node")(reflect_on_summary))
+    builder.add_node("finalize_summary", traced("research.finalize_summary", "node")(finalize_summary))
 
     # Add edges
     builder.add_edge(START, "generate_query")
@@ -286,11 +434,60 @@ def perform_deep_research(query):
     builder.add_conditional_edges("reflect_on_summary", route_research)
     builder.add_edge("finalize_summary", END)
 
+    return builder.compile()
+
+
+_research_graph = None
+_research_graph_lock = threading.Lock()
+
 
-    graph = builder.compile()
+def get_research_graph():
+    # Compiled once per process; the graph holds no run state so sessions can share it
+    global _research_graph
+    if _research_graph is None:
+        with _research_graph_lock:
+            if _research_graph is None:
+                _research_graph = build_research_graph()
+    return _research_graph
 
+
+def research_config(thread_id: Optional[str] = None, **settings) -> RunnableConfig:
+    configuration = Configuration(**{k: v for k, v in settings.items() if v is not None})
+    # generate_query, finalize_summary and three nodes per loop, with headroom
+    recursion_limit = 3 * (configuration.max_web_research_loops + 1) + 10
+    return {
+        "configurable": {"thread_id": thread_id or uuid.uuid4().hex, **configuration.__dict__},
+        "recursion_limit": recursion_limit,
+        # Model calls inside the nodes inherit these, so their tokens are traced too
+        "callbacks": get_callbacks(),
+    }
+
+
+def perform_deep_research(query, thread_id: Optional[str] = None, **settings):
+    """
+    Run the research graph on `query`.
+
+    Args:
+        query (str): Research topic
+        thread_id (str, optional): Identifies the caller's session in traces and callbacks.
+            A fresh id is used per run when not given.
+        **settings: Per-run overrides of Configuration fields, e.g. max_web_research_loops=2
+    """
     research_input = SummaryStateInput(research_topic=query)
 
-    research_output = graph.invoke(research_input)
+    research_output = get_research_graph().invoke(research_input, config=research_config(thread_id, **settings))
+
+    return research_output["running_summary"]
+
+
+def stream_deep_research(query, thread_id: Optional[str] = None, **settings):
+    """
+    Run the research graph on `query`, yielding (node_name, state_update) after every node.
+
+    The final update comes from finalize_summary and carries the full report in "running_summary".
+    """
+    research_input = SummaryStateInput(research_topic=query)
 
-    return research_output["running_summary"]
\ No newline at end of file
+    for update in get_research_graph().stream(research_input, config=research_config(thread_id, **settings), stream_mode="updates"):
+        for node, values in update.items():
+            yield node, values or {}
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+# Approximate tokens of verbatim history sent with each turn, older turns are summarized
+HISTORY_TOKEN_BUDGET = 3000
+# Older turns are summarized this many messages at a time, so earlier summaries never change
+SUMMARY_SEGMENT_MESSAGES = 8
+MAX_CACHED_SUMMARIES = 512
+
+history_summary_instructions = """Update the running summary of a conversation between a user and an assistant.
+Keep facts, decisions, names and open questions the assistant may need later. Drop pleasantries.
+Return only the updated summary.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    # Using rough estimate of 4 characters per token
+    return len(text or "") // 4
+
+
+def normalize_messages(messages):
+    """
+    Flatten the chat history into a list of {"role", "content"} dicts.
+
+    Nested lists are unpacked, records without string content are dropped and
+    a record that repeats the previous one verbatim is skipped.
+    """
+    normalized = []
+    stack = list(reversed(messages or []))
+    while stack:
+        message = stack.pop()
+        if isinstance(message, (list, tuple)):
+            stack.extend(reversed(message))
+            continue
+        if not isinstance(message, dict) or not isinstance(message.get("content"), str):
+            continue
+        role = message.get("role", "user")
+        role = "assistant" if role in ("assistant", "ai") else "user"
+        record = {"role": role, "content": message["content"]}
+        if normalized and normalized[-1] == record:
+            continue
+        normalized.append(record)
+    return normalized
+
+
+def messages_key(messages) -> str:
+    return hashlib.sha256(json.dumps(messages).encode()).hexdigest()
+
+
+def summarize_with_gemma(summary: str, messages) -> str:
+    from model import get_gemma
+
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = history_summary_instructions.format(summary=summary or "(empty)", messages=transcript)
+    return get_gemma().invoke([{"role": "user", "content": prompt}]).content
+
+
+class HistoryManager:
+    """
+    Fits chat history into a token budget.
+
+    Recent messages are sent verbatim while they fit in `token_budget`; everything
+    before them is folded into a rolling summary one fixed-size segment at a time.
+    When the newest segment alone doesn't fit, its oldest messages are folded in
+    too. The summary of every prefix is cached, so each turn pays at most one
+    summary call for the messages that just aged out of the window.
+    """
+
+    def __init__(self, token_budget: int = HISTORY_TOKEN_BUDGET, segment_messages: int = SUMMARY_SEGMENT_MESSAGES,
+                 summarize_fn=None, max_cached_summaries: int = MAX_CACHED_SUMMARIES):
+        self.token_budget = token_budget
+        self.segment_messages = segment_messages
+        self.summarize_fn = summarize_fn or summarize_with_gemma
+        self.max_cached_summaries = max_cached_summaries
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached_summary(self, prefix, summary: str, new_messages) -> str:
+        # Summary of `prefix`, made by folding its last `new_messages` into `summary`
+        key = messages_key(prefix)
+        with self._lock:
+            cached = self._summaries.get(key)
+            if cached is not None:
+                self._summaries.move_to_end(key)
+        if cached is None:
+            cached = self.summarize_fn(summary, new_messages)
+            with self._lock:
+                self._summaries[key] = cached
+                while len(self._summaries) > self.max_cached_summaries:
+                    self._summaries.popitem(last=False)
+        return cached
+
+    def summary_of(self, messages) -> str:
+        summary = ""
+        for end in range(self.segment_messages, len(messages) + 1, self.segment_messages):
+            summary = self._cached_summary(messages[:end], summary, messages[end - self.segment_messages:end])
+        return summary
+
+    def build(self, messages):
+        messages = normalize_messages(messages)
+        if sum(estimate_tokens(m["content"]) for m in messages) <= self.token_budget:
+            return messages
+
+        # Move the cut forward a whole segment at a time until the recent window fits
+        cut = 0
+        while cut + self.segment_messages < len(messages):
+            recent_tokens = sum(estimate_tokens(m["content"]) for m in messages[cut:])
+            if recent_tokens <= self.token_budget:
+                break
+            cut += self.segment_messages
+
+        # A single oversized segment still has to fit, its oldest messages join the summary
+        dropped = 0
+        while cut + dropped < len(messages) - 1:
+            if sum(estimate_tokens(m["content"]) for m in messages[cut + dropped:]) <= self.token_budget:
+                break
+            dropped += 1
+        recent = messages[cut + dropped:]
+
+        summary = self.summary_of(messages[:cut])
+        if dropped:
+            summary = self._cached_summary(messages[:cut + dropped], summary, messages[cut:cut + dropped])
+        if not summary:
+            return recent
+
+        preface = f"Summary of the earlier conversation:\n{summary}"
+        if recent[0]["role"] == "user":
+            return [{"role": "user", "content": f"{preface}\n\n{recent[0]['content']}"}] + recent[1:]
+        return [{"role": "user", "content": preface}] + recent
+
+
+history_manager = HistoryManager()
+
+
+def build_history(messages):
+    return history_manager.build(messages)
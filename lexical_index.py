@@ -0,0 +1,188 @@
+import gzip
+import json
+import math
+import os
+import re
+import threading
+import operator
+from collections import Counter, defaultdict
+
+
+# Keeps identifiers like "XK-4471" or "v2.3.1" whole, their parts are indexed too
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+COMPARISONS = {
+    "$eq": operator.eq, "$ne": operator.ne, "$gt": operator.gt,
+    "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le,
+}
+
+
+def matches_filter(metadata: dict, where: dict) -> bool:
+    """
+    Evaluate a Chroma-style metadata filter against one chunk's metadata.
+
+    Supports field equality, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin and nested $and/$or.
+    """
+    for field, condition in where.items():
+        if field == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+            continue
+        if field == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+            continue
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        value = metadata.get(field)
+        for op, expected in condition.items():
+            if op in ("$in", "$nin"):
+                if (value in expected) != (op == "$in"):
+                    return False
+            elif value is None and op != "$ne":
+                return False
+            elif not COMPARISONS[op](value, expected):
+                return False
+    return True
+
+
+def tokenize(text: str):
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = re.split(r"[-_./]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class BM25Index:
+    """
+    In-memory BM25 inverted index over document chunks, persisted as gzipped JSON.
+
+    Chunks are identified by the same ids used for the vector store, so lexical
+    and dense results can be fused by id. Searches may run while a background
+    ingest is still adding chunks.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)   # term -> {doc_id: term frequency}
+        self.doc_lengths = {}
+        self.documents = {}                 # doc_id -> {"page_content", "metadata"}
+        self.total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, doc_id: str, text: str, metadata: dict = None):
+        counts = Counter(tokenize(text))
+        with self._lock:
+            if doc_id in self.doc_lengths:
+                return
+            for term, frequency in counts.items():
+                self.postings[term][doc_id] = frequency
+            length = sum(counts.values())
+            self.doc_lengths[doc_id] = length
+            self.total_length += length
+            self.documents[doc_id] = {"page_content": text, "metadata": metadata or {}}
+
+    def add_documents(self, documents, ids):
+        for doc_id, document in zip(ids, documents):
+            self.add(doc_id, document.page_content, document.metadata)
+
+    def merge(self, other: "BM25Index"):
+        # Adds the chunks of `other` that aren't indexed yet, without re-tokenizing them
+        with self._lock:
+            new_ids = {doc_id for doc_id in other.doc_lengths if doc_id not in self.doc_lengths}
+            if not new_ids:
+                return
+            for term, postings in other.postings.items():
+                for doc_id, frequency in postings.items():
+                    if doc_id in new_ids:
+                        self.postings[term][doc_id] = frequency
+            for doc_id in new_ids:
+                self.doc_lengths[doc_id] = other.doc_lengths[doc_id]
+                self.total_length += other.doc_lengths[doc_id]
+                self.documents[doc_id] = other.documents[doc_id]
+
+    def remove(self, ids):
+        with self._lock:
+            for doc_id in ids:
+                if doc_id not in self.doc_lengths:
+                    continue
+                for term in tokenize(self.documents[doc_id]["page_content"]):
+                    postings = self.postings.get(term)
+                    if postings is not None:
+                        postings.pop(doc_id, None)
+                        if not postings:
+                            del self.postings[term]
+                self.total_length -= self.doc_lengths.pop(doc_id)
+                del self.documents[doc_id]
+
+    def search(self, query: str, k: int = 10, filter: dict = None):
+        """
+        Return up to `k` (doc_id, score) pairs, best first.
+
+        With `filter`, only chunks whose metadata matches it are scored.
+        """
+        terms = set(tokenize(query))
+        scores = defaultdict(float)
+        with self._lock:
+            if not self.doc_lengths:
+                return []
+            n = len(self.doc_lengths)
+            average_length = self.total_length / n
+            allowed = {}
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    if filter:
+                        if doc_id not in allowed:
+                            allowed[doc_id] = matches_filter(self.documents[doc_id]["metadata"], filter)
+                        if not allowed[doc_id]:
+                            continue
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / average_length)
+                    scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        payload = {
+            "k1": self.k1,
+            "b": self.b,
+            "postings": self.postings,
+            "doc_lengths": self.doc_lengths,
+            "documents": self.documents,
+        }
+        tmp_path = path + ".tmp"
+        with self._lock, gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+        index = cls(k1=payload["k1"], b=payload["b"])
+        index.postings = defaultdict(dict, payload["postings"])
+        index.doc_lengths = payload["doc_lengths"]
+        index.documents = payload["documents"]
+        index.total_length = sum(index.doc_lengths.values())
+        return index
+
+
+def reciprocal_rank_fusion(rankings, k: int = 60):
+    """
+    Fuse several best-first lists of ids into one, scoring each id by sum(1 / (k + rank)).
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] += 1 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -1,14 +1,24 @@
-from api_key import GOOGLE_API_KEY
+from functools import lru_cache
 from langchain_google_genai import ChatGoogleGenerativeAI
+from stubs import use_stubs, FakeChatModel
 
 
+# Clients are shared across turns so their HTTP connections stay pooled;
+# one client per distinct sampling setting, least recently used evicted first
+MAX_CACHED_CLIENTS = 8
 
-def get_gemma(temperature=0, top_k=40, top_p=0.95):
+
+def build_gemma(temperature=0, top_k=40, top_p=0.95, max_tokens=2048):
+    if use_stubs():
+        return FakeChatModel()
+
+    # Imported here so the stub backend runs without API keys
+    from api_key import GOOGLE_API_KEY
 
     gemma_model = ChatGoogleGenerativeAI(
             model="gemma-3-12b-it",
             temperature=temperature,
-            max_tokens=2048,
+            max_tokens=max_tokens,
             timeout=None,
             max_retries=2,
             google_api_key=GOOGLE_API_KEY,
@@ -16,4 +26,29 @@ def get_gemma(temperature=0, top_k=40, top_p=0.95):
             top_p=top_p 
     )
 
-    return gemma_model
\ No newline at end of file
+    return gemma_model
+
+
+@lru_cache(maxsize=MAX_CACHED_CLIENTS)
+def _cached_gemma(temperature, top_k, top_p, max_tokens):
+    return build_gemma(temperature=temperature, top_k=top_k, top_p=top_p, max_tokens=max_tokens)
+
+
+def get_gemma(temperature=0, top_k=40, top_p=0.95, max_tokens=2048):
+    # Normalize so 1 and 1.0 from the sliders hit the same cache entry
+    temperature = None if temperature is None else float(temperature)
+    top_p = None if top_p is None else float(top_p)
+    top_k = None if top_k is None else int(top_k)
+    return _cached_gemma(temperature, top_k, top_p, max_tokens)
+
+
+def with_overrides(gemma_model, **generation_config):
+    """
+    Apply per-call sampling overrides (e.g. temperature, top_k, max_output_tokens)
+    to a cached client without constructing a new one. None values keep the
+    client's setting.
+    """
+    generation_config = {key: value for key, value in generation_config.items() if value is not None}
+    if not generation_config:
+        return gemma_model
+    return gemma_model.bind(generation_config=generation_config)
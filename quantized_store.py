@@ -0,0 +1,430 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from langchain_core.documents import Document
+
+
+# Rows scored per block, bounds the float32 working set of a query
+SCORE_BLOCK_ROWS = 16384
+
+
+def quantize_int8(vectors: np.ndarray):
+    # Symmetric per-row quantization, the row scale restores the magnitude
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+COMPARISONS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+FILTER_CACHE_SIZE = 32
+# Metadata fields with an expression index, filters on them don't scan the table
+INDEXED_FIELDS = ("doc_id",)
+
+
+def metadata_field(field: str) -> str:
+    # Inlined rather than bound so the expression matches the indexes
+    if not re.fullmatch(r"\w+", field):
+        raise ValueError(f"Unsupported metadata field in filter: {field!r}")
+    return f"json_extract(metadata, '$.{field}')"
+
+
+def where_sql(where: dict):
+    """
+    Translate a Chroma-style metadata filter into a SQL condition and its parameters.
+
+    Supports field equality, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin and nested $and/$or.
+    """
+    clauses, params = [], []
+    for field, condition in where.items():
+        if field in ("$and", "$or"):
+            parts = [where_sql(sub) for sub in condition]
+            clauses.append("(" + f" {field[1:].upper()} ".join(clause for clause, _ in parts) + ")")
+            for _, sub_params in parts:
+                params.extend(sub_params)
+            continue
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, value in condition.items():
+            if operator in ("$in", "$nin"):
+                negate = "NOT " if operator == "$nin" else ""
+                clauses.append(f"{metadata_field(field)} {negate}IN ({','.join('?' * len(value))})")
+                params.extend(value)
+            else:
+                clauses.append(f"{metadata_field(field)} {COMPARISONS[operator]} ?")
+                params.append(value)
+    return " AND ".join(clauses) or "1", params
+
+
+class QuantizedVectorStore:
+    """
+    Vector store keeping int8 or float16 embeddings in memory-mapped files.
+
+    Vectors are L2-normalized on insert so scores are cosine similarities. Chunk
+    text and metadata live in a SQLite sidecar table, looked up only for the
+    rows that make the top k. With `keep_full_precision`, float32 copies are
+    written too and used to rerank the quantized candidates. Metadata filters
+    are evaluated in SQLite, so only the matching rows are scored, and deleted
+    rows are dropped from the table without rewriting the vector files until
+    compact() is called.
+
+    Exposes the subset of the Chroma interface rag_utils uses.
+    """
+
+    def __init__(self, persist_directory: str, embedding_function, dtype: str = "int8",
+                 keep_full_precision: bool = True, rerank_factor: int = 4):
+        self.persist_directory = persist_directory
+        self.embedding_function = embedding_function
+        self.rerank_factor = rerank_factor
+        self._lock = threading.Lock()
+        os.makedirs(persist_directory, exist_ok=True)
+
+        config_path = os.path.join(persist_directory, "store.json")
+        if os.path.exists(config_path):
+            with open(config_path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        else:
+            config = {"dtype": dtype, "keep_full_precision": keep_full_precision, "dim": None}
+        self.config = config
+        self._config_path = config_path
+
+        self._meta = sqlite3.connect(os.path.join(persist_directory, "meta.sqlite3"), check_same_thread=False)
+        self._meta.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        for field in INDEXED_FIELDS:
+            self._meta.execute(f"CREATE INDEX IF NOT EXISTS chunks_{field} ON chunks({metadata_field(field)})")
+        self._meta.commit()
+        self._maps = None
+        self._maps_version = None
+
+    @contextmanager
+    def _write_lock(self):
+        # Appends from several server processes must not interleave in the vector files
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._path("store.lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.persist_directory, name)
+
+    def _generation(self) -> int:
+        # Bumped by compact() in the same transaction that renumbers the rows
+        return self._meta.execute("PRAGMA user_version").fetchone()[0]
+
+    def _vector_path(self, name: str, generation: int = None) -> str:
+        # Compacted files are written beside the current ones, e.g. vectors.2.i8
+        generation = self._generation() if generation is None else generation
+        if generation:
+            stem, extension = name.split(".")
+            name = f"{stem}.{generation}.{extension}"
+        return self._path(name)
+
+    def _vector_files(self) -> dict:
+        # File name -> element dtype and elements per row
+        dim = self.config["dim"]
+        if self.config["dtype"] == "int8":
+            files = {"vectors.i8": (np.int8, dim), "scales.f32": (np.float32, 1)}
+        else:
+            files = {"vectors.f16": (np.float16, dim)}
+        if self.config["keep_full_precision"]:
+            files["vectors.f32"] = (np.float32, dim)
+        return files
+
+    def __len__(self):
+        return self._meta.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def _row_count(self, generation: int = None) -> int:
+        # Rows written to the vector files, deleted ones included
+        dim = self.config["dim"]
+        if not dim:
+            return 0
+        name, itemsize = ("vectors.i8", 1) if self.config["dtype"] == "int8" else ("vectors.f16", 2)
+        path = self._vector_path(name, generation)
+        return os.path.getsize(path) // (dim * itemsize) if os.path.exists(path) else 0
+
+    def reclaimable_bytes(self) -> int:
+        # Space compact() would give back: deleted rows in the vector files and free SQLite pages
+        dead_rows = row_bytes = 0
+        if self.config["dim"]:
+            dead_rows = self._row_count() - len(self)
+            row_bytes = sum(np.dtype(dtype).itemsize * width for dtype, width in self._vector_files().values())
+        free_pages = self._meta.execute("PRAGMA freelist_count").fetchone()[0]
+        page_size = self._meta.execute("PRAGMA page_size").fetchone()[0]
+        return dead_rows * row_bytes + free_pages * page_size
+
+    def _open_maps(self):
+        # Re-opened after every write, readers only ever see complete rows. data_version
+        # changes when another process commits, so its writes are picked up too
+        version = self._meta.execute("PRAGMA data_version").fetchone()[0]
+        if self._maps is not None and self._maps_version == version:
+            return self._maps
+        if self.config["dim"] is None and os.path.exists(self._config_path):
+            with open(self._config_path, "r", encoding="utf-8") as f:
+                self.config = json.load(f)
+        while True:
+            generation = self._generation()
+            try:
+                maps = self._map_generation(generation)
+            except FileNotFoundError:
+                # Compacted away by another process since the generation was read
+                if self._generation() == generation:
+                    raise
+                continue
+            if self._generation() == generation:
+                break
+        self._maps = maps
+        self._maps_version = version
+        return maps
+
+    def _map_generation(self, generation: int) -> dict:
+        n, dim = self._row_count(generation), self.config["dim"]
+        maps = {"generation": generation}
+        if n and dim:
+            keys = {"vectors.i8": "vectors", "vectors.f16": "vectors", "scales.f32": "scales", "vectors.f32": "full"}
+            for name, (dtype, width) in self._vector_files().items():
+                shape = (n, width) if name != "scales.f32" else (n,)
+                maps[keys[name]] = np.memmap(self._vector_path(name, generation), dtype=dtype, mode="r", shape=shape)
+            if len(self) < n:
+                # Deleted rows stay in the files until the store is compacted, only live ones are scored
+                maps["live"] = np.fromiter((row for (row,) in self._meta.execute("SELECT row FROM chunks ORDER BY row")), dtype=np.int64)
+        return maps
+
+    def _search(self, search):
+        # Rows are renumbered by compact(), a search that overlapped one runs again on the new files
+        while True:
+            maps = self._open_maps()
+            result = search(maps)
+            if self._generation() == maps["generation"]:
+                return result
+
+    def add_embeddings(self, ids, texts, embeddings, metadatas=None):
+        vectors = normalize(np.asarray(embeddings, dtype=np.float32))
+        metadatas = metadatas or [{} for _ in ids]
+        with self._write_lock():
+            if self.config["dim"] is None and os.path.exists(self._config_path):
+                with open(self._config_path, "r", encoding="utf-8") as f:
+                    self.config = json.load(f)
+            if self.config["dim"] is None:
+                self.config["dim"] = int(vectors.shape[1])
+                with open(self._config_path, "w", encoding="utf-8") as f:
+                    json.dump(self.config, f)
+
+            existing = {row[0] for row in self._meta.execute(
+                f"SELECT id FROM chunks WHERE id IN ({','.join('?' * len(ids))})", list(ids)
+            )} if ids else set()
+            # Ids already stored, or repeated within the batch, keep their first vector
+            keep = []
+            for i, doc_id in enumerate(ids):
+                if doc_id not in existing:
+                    existing.add(doc_id)
+                    keep.append(i)
+            if not keep:
+                return []
+            vectors = vectors[keep]
+            start = self._row_count()
+
+            if self.config["dtype"] == "int8":
+                quantized, scales = quantize_int8(vectors)
+                parts = {"vectors.i8": quantized, "scales.f32": scales}
+            else:
+                parts = {"vectors.f16": vectors.astype(np.float16)}
+            if self.config["keep_full_precision"]:
+                parts["vectors.f32"] = vectors
+            # Rows are located by file offset, so a failed insert must not leave vectors behind
+            paths = {name: self._vector_path(name) for name in parts}
+            sizes = {name: os.path.getsize(path) if os.path.exists(path) else 0 for name, path in paths.items()}
+            try:
+                for name, array in parts.items():
+                    with open(paths[name], "ab") as f:
+                        f.write(array.tobytes())
+                self._meta.executemany(
+                    "INSERT INTO chunks (row, id, page_content, metadata) VALUES (?, ?, ?, ?)",
+                    [(start + n, ids[i], texts[i], json.dumps(metadatas[i])) for n, i in enumerate(keep)]
+                )
+                self._meta.commit()
+            except BaseException:
+                self._meta.rollback()
+                for name, size in sizes.items():
+                    if os.path.exists(paths[name]):
+                        with open(paths[name], "r+b") as f:
+                            f.truncate(size)
+                raise
+            finally:
+                self._maps = None
+        return [ids[i] for i in keep]
+
+    def add_documents(self, documents, ids=None):
+        ids = ids or [doc.metadata.get("chunk_id") or str(n) for n, doc in enumerate(documents, self._row_count())]
+        texts = [doc.page_content for doc in documents]
+        embeddings = self.embedding_function.embed_documents(texts)
+        return self.add_embeddings(ids, texts, embeddings, [doc.metadata for doc in documents])
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return False
+        with self._write_lock():
+            self._meta.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(ids))})", list(ids))
+            self._meta.commit()
+            self._maps = None
+        return True
+
+    def compact(self) -> int:
+        """
+        Rewrite the vector files and the SQLite table without deleted rows.
+
+        The live rows are copied into files of the next generation and
+        renumbered in one transaction, so readers in any process switch over
+        at once; the old files are removed afterwards. Returns the bytes freed.
+        """
+        with self._write_lock():
+            before = self._disk_usage()
+            generation = self._generation()
+            n = self._row_count(generation)
+            if n > len(self):
+                live = np.fromiter((row for (row,) in self._meta.execute("SELECT row FROM chunks ORDER BY row")), dtype=np.int64)
+                written = []
+                try:
+                    for name, (dtype, width) in self._vector_files().items():
+                        shape = (n, width) if name != "scales.f32" else (n,)
+                        old = np.memmap(self._vector_path(name, generation), dtype=dtype, mode="r", shape=shape)
+                        written.append(self._vector_path(name, generation + 1))
+                        with open(written[-1], "wb") as f:
+                            for start in range(0, len(live), SCORE_BLOCK_ROWS):
+                                f.write(np.ascontiguousarray(old[live[start:start + SCORE_BLOCK_ROWS]]).tobytes())
+                        del old
+                    # Ascending, so a row only ever moves to a number that is already free
+                    self._meta.executemany(
+                        "UPDATE chunks SET row = ? WHERE row = ?",
+                        [(new, int(old_row)) for new, old_row in enumerate(live) if new != old_row]
+                    )
+                    self._meta.execute(f"PRAGMA user_version = {generation + 1}")
+                    self._meta.commit()
+                except BaseException:
+                    self._meta.rollback()
+                    for path in written:
+                        if os.path.exists(path):
+                            os.remove(path)
+                    raise
+                finally:
+                    self._maps = None
+                for name in self._vector_files():
+                    os.remove(self._vector_path(name, generation))
+            self._meta.execute("VACUUM")
+            return before - self._disk_usage()
+
+    def _disk_usage(self) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(self.persist_directory) if entry.is_file())
+
+    def _filtered_rows(self, maps, filter: dict):
+        # Cached with the maps, so repeated queries over the same documents skip SQLite until the next write
+        cache = maps.setdefault("filtered", {})
+        cache_key = json.dumps(filter, sort_keys=True)
+        rows = cache.get(cache_key)
+        if rows is None:
+            condition, params = where_sql(filter)
+            rows = np.fromiter((row for (row,) in self._meta.execute(
+                f"SELECT row FROM chunks WHERE {condition} ORDER BY row", params
+            )), dtype=np.int64)
+            if len(cache) >= FILTER_CACHE_SIZE:
+                cache.pop(next(iter(cache)))
+            cache[cache_key] = rows
+        return rows
+
+    def _top_rows(self, maps, query_vector: np.ndarray, k: int, filter: dict = None):
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if "vectors" not in maps:
+            return empty
+        vectors = maps["vectors"]
+        # None scores every row in contiguous blocks, otherwise only the listed rows
+        rows = maps.get("live")
+        if filter:
+            rows = self._filtered_rows(maps, filter)
+        n = vectors.shape[0] if rows is None else len(rows)
+        if n == 0:
+            return empty
+        candidates = min(n, k * self.rerank_factor if "full" in maps else k)
+
+        best_rows, best_scores = [], []
+        for start in range(0, n, SCORE_BLOCK_ROWS):
+            block_rows = slice(start, start + SCORE_BLOCK_ROWS) if rows is None else rows[start:start + SCORE_BLOCK_ROWS]
+            scores = vectors[block_rows].astype(np.float32) @ query_vector
+            if "scales" in maps:
+                scores *= maps["scales"][block_rows]
+            top = np.argpartition(-scores, min(candidates, len(scores)) - 1)[:candidates]
+            best_rows.append(top + start if rows is None else block_rows[top])
+            best_scores.append(scores[top])
+        rows = np.concatenate(best_rows)
+        scores = np.concatenate(best_scores)
+
+        if "full" in maps:
+            # Exact scores for the quantized shortlist, only these rows are paged in
+            order = np.sort(rows)
+            scores = maps["full"][order] @ query_vector
+            rows = order
+
+        top = np.argsort(-scores)[:k]
+        return rows[top], scores[top]
+
+    def _documents(self, rows):
+        if len(rows) == 0:
+            return []
+        found = {
+            row: Document(page_content=text, metadata=json.loads(metadata))
+            for row, text, metadata in self._meta.execute(
+                f"SELECT row, page_content, metadata FROM chunks WHERE row IN ({','.join('?' * len(rows))})",
+                [int(row) for row in rows]
+            )
+        }
+        return [found[int(row)] for row in rows]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, filter: dict = None):
+        query_vector = normalize(np.asarray(embedding, dtype=np.float32))
+        return self._search(lambda maps: self._documents(self._top_rows(maps, query_vector, k, filter)[0]))
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict = None):
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k, filter)
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5,
+                                      filter: dict = None):
+        query_vector = normalize(np.asarray(self.embedding_function.embed_query(query), dtype=np.float32))
+        return self._search(lambda maps: self._max_marginal_relevance(maps, query_vector, k, fetch_k, lambda_mult, filter))
+
+    def _max_marginal_relevance(self, maps, query_vector, k, fetch_k, lambda_mult, filter):
+        rows, scores = self._top_rows(maps, query_vector, fetch_k, filter)
+        if len(rows) == 0:
+            return []
+        order = np.argsort(rows)
+        if "full" in maps:
+            candidates = np.asarray(maps["full"][rows[order]])
+        else:
+            candidates = normalize(np.asarray(maps["vectors"][rows[order]], dtype=np.float32))
+        rows, scores = rows[order], scores[order]
+
+        selected = [int(np.argmax(scores))]
+        while len(selected) < min(k, len(rows)):
+            redundancy = (candidates @ candidates[selected].T).max(axis=1)
+            mmr = lambda_mult * scores - (1 - lambda_mult) * redundancy
+            mmr[selected] = -np.inf
+            selected.append(int(np.argmax(mmr)))
+        return self._documents(rows[selected])
@@ -1,54 +1,959 @@
+import atexit
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from functools import lru_cache
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from tracing import tracer
 
+try:
+    import fcntl
+except ImportError:
+    # Without flock the registry is only guarded within one process
+    fcntl = None
+
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIMENSIONS = 384
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# Retrieval returns RETRIEVAL_K chunks fused from the top RETRIEVAL_FETCH_K
+# dense and lexical candidates
+RETRIEVAL_K = int(os.environ.get("CHATAI_RETRIEVAL_K", 2))
+RETRIEVAL_FETCH_K = int(os.environ.get("CHATAI_RETRIEVAL_FETCH_K", 10))
+RRF_K = 60
+
+# Two-stage retrieval: RERANK_CANDIDATES fused candidates are rescored by the
+# cross-encoder in reranker.py, and up to CONTEXT_MAX_CHUNKS of the best that fit
+# CONTEXT_TOKEN_BUDGET become the context. With CHATAI_RERANK=0 the RETRIEVAL_K
+# fused chunks are used.
+RERANK = os.environ.get("CHATAI_RERANK", "1") == "1"
+RERANK_CANDIDATES = int(os.environ.get("CHATAI_RERANK_CANDIDATES", 20))
+CONTEXT_MAX_CHUNKS = int(os.environ.get("CHATAI_CONTEXT_MAX_CHUNKS", 3))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CHATAI_CONTEXT_TOKEN_BUDGET", 800))
+LEXICAL_INDEX_FILE = "lexical_index.json.gz"
+# BM25 indexes of corpus documents are stored one file per document, so server
+# processes can each ingest and pick up the others' documents from the registry
+LEXICAL_DIRECTORY = "lexical"
+CORPUS_SYNC_SECONDS = float(os.environ.get("CHATAI_CORPUS_SYNC_SECONDS", 1.0))
+
+# "chroma", or "quantized" for the memory-mapped int8/float16 store in quantized_store
+VECTOR_BACKEND = os.environ.get("CHATAI_VECTOR_BACKEND", "chroma")
+QUANTIZED_DTYPE = os.environ.get("CHATAI_QUANTIZED_DTYPE", "int8")
+
+# Chunks are embedded EMBEDDING_BATCH_SIZE at a time on each of EMBEDDING_WORKERS
+# processes, and written to Chroma once a full round of batches is ready
+EMBEDDING_BATCH_SIZE = int(os.environ.get("CHATAI_EMBEDDING_BATCH_SIZE", 64))
+EMBEDDING_WORKERS = int(os.environ.get("CHATAI_EMBEDDING_WORKERS", os.cpu_count() or 1))
+
+# Uploads ingested at once in the background, queries run against the pages indexed so far
+INGEST_WORKERS = int(os.environ.get("CHATAI_INGEST_WORKERS", 2))
+
+CHROMA_ROOT = "./chroma_store"
+REGISTRY_PATH = os.path.join(CHROMA_ROOT, "registry.json")
+# Progress of running ingests, readable by every server process
+INGEST_PROGRESS_DIRECTORY = "ingest"
+# Every document is indexed into one shared corpus under CHROMA_ROOT
+CORPUS_NAME = "corpus" if VECTOR_BACKEND == "chroma" else f"corpus-{VECTOR_BACKEND}-{QUANTIZED_DTYPE}"
+
+# Least recently used collections are deleted once the store grows past this
+CHROMA_DISK_QUOTA_MB = int(os.environ.get("CHATAI_CHROMA_DISK_QUOTA_MB", 2048))
+# Documents ingested or searched this recently are never collected, whatever the quota
+GC_GRACE_SECONDS = int(os.environ.get("CHATAI_GC_GRACE_SECONDS", 60 * 60))
+# Corpora are compacted by GC once this share of their directory is space freed by deletes
+COMPACT_DEAD_FRACTION = float(os.environ.get("CHATAI_COMPACT_DEAD_FRACTION", 0.25))
+# last_used is rewritten at most this often per document
+TOUCH_INTERVAL_SECONDS = 60
+# Uploads are staged in temp files with this prefix, stale ones are swept up
+UPLOAD_TEMP_PREFIX = "chatai_upload_"
+UPLOAD_TEMP_MAX_AGE_SECONDS = 60 * 60
+
+@lru_cache(maxsize=1)
+def get_embedding_model():
+    # Loading sentence-transformers is slow, only pay for it once RAG is actually used
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        encode_kwargs={"batch_size": EMBEDDING_BATCH_SIZE}
+    )
+
+_embedding_pool = None
+_embedding_pool_lock = threading.Lock()
+
+
+def get_embedding_pool():
+    # One sentence-transformers worker per core, started on first large ingest
+    global _embedding_pool
+    if EMBEDDING_WORKERS <= 1:
+        return None
+    with _embedding_pool_lock:
+        if _embedding_pool is None:
+            _embedding_pool = get_embedding_model()._client.start_multi_process_pool(
+                target_devices=["cpu"] * EMBEDDING_WORKERS
+            )
+        return _embedding_pool
+
+
+def stop_embedding_pool():
+    global _embedding_pool
+    with _embedding_pool_lock:
+        if _embedding_pool is not None:
+            get_embedding_model()._client.stop_multi_process_pool(_embedding_pool)
+            _embedding_pool = None
+
+
+atexit.register(stop_embedding_pool)
+
+
+def embed_chunks(texts):
+    # Small inputs aren't worth the inter-process round trip
+    if len(texts) <= EMBEDDING_BATCH_SIZE:
+        return get_embedding_model().embed_documents(texts)
+    pool = get_embedding_pool()
+    if pool is None:
+        return get_embedding_model().embed_documents(texts)
+
+    vectors = get_embedding_model()._client.encode_multi_process(
+        texts, pool, batch_size=EMBEDDING_BATCH_SIZE,
+        chunk_size=-(-len(texts) // EMBEDDING_WORKERS)
+    )
+    return vectors.tolist()
+
+
+class ParallelEmbeddings(Embeddings):
+    """Embedding function used for ingest: documents go through the worker pool, queries stay in-process."""
+
+    def embed_documents(self, texts):
+        return embed_chunks(texts)
+
+    def embed_query(self, text):
+        return get_embedding_model().embed_query(text)
+
+
+ingest_embedding_model = ParallelEmbeddings()
 
-embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
 
 def load_pdf_document(file_path):
+    # Pages are yielded one at a time so ingest never holds the whole PDF
     document_loader = PyPDFLoader(file_path)
-    return document_loader.load()
+    return document_loader.lazy_load()
+
+def count_pdf_pages(file_path):
+    # Only the page tree is read, not the page contents
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(file_path).pages)
+    except Exception:
+        return None
 
 def chunk_documents(raw_documents):
     text_processor = RecursiveCharacterTextSplitter(
-        chunk_size = 1000,
-        chunk_overlap = 200,
+        chunk_size = CHUNK_SIZE,
+        chunk_overlap = CHUNK_OVERLAP,
         add_start_index = True
     )
     return text_processor.split_documents(raw_documents)
 
-def find_related_documents(query, vector_database):
-    # return vector_database.similarity_search(query, k=2)
-    return vector_database.max_marginal_relevance_search(query, k=2, fetch_k=5, lambda_mult=0.6)
+def open_vector_store(persist_directory: str, embedding_function=None, backend: str = None):
+    backend = backend or VECTOR_BACKEND
+    embedding_function = embedding_function or get_embedding_model()
+    if backend == "quantized":
+        from quantized_store import QuantizedVectorStore
+        return QuantizedVectorStore(persist_directory, embedding_function, dtype=QUANTIZED_DTYPE)
+    return Chroma(persist_directory=persist_directory, embedding_function=embedding_function)
+
 
+def find_related_documents(query, vector_database, lexical_index=None, k=None, fetch_k=None, filter=None):
+    """
+    Return the `k` chunks most related to `query`.
 
-def ProcessDocuments(document_path: str) -> str:
+    `filter` is a Chroma-style metadata filter (see corpus_filter), applied
+    inside the vector and lexical searches rather than to their results.
+    """
+    k = k or RETRIEVAL_K
+    fetch_k = fetch_k or RETRIEVAL_FETCH_K
+    if lexical_index is None:
+        # Collections ingested before the lexical index existed
+        return vector_database.max_marginal_relevance_search(query, k=k, fetch_k=fetch_k, lambda_mult=0.6, filter=filter)
 
-    loaded_doc = load_pdf_document(document_path)
-    chunked_doc = chunk_documents(loaded_doc)
+    # Plain similarity search is much cheaper than MMR, fusion with BM25 already diversifies
+    dense = vector_database.similarity_search(query, k=fetch_k, filter=filter)
+    lexical = lexical_index.search(query, k=fetch_k, filter=filter)
 
-    
-    vector_database = Chroma(
-        persist_directory=f"./chroma_store/{document_path.split("\\")[-1].split(".")[0]}",
-        embedding_function=embedding_model
+    documents = {}
+    for doc in dense:
+        documents.setdefault(doc.metadata.get("chunk_id", doc.page_content), doc)
+    for doc_id, _ in lexical:
+        if doc_id not in documents:
+            stored = lexical_index.documents[doc_id]
+            documents[doc_id] = Document(page_content=stored["page_content"], metadata=stored["metadata"])
+
+    fused = reciprocal_rank_fusion(
+        [[doc.metadata.get("chunk_id", doc.page_content) for doc in dense], [doc_id for doc_id, _ in lexical]],
+        k=RRF_K
     )
+    return [documents[doc_id] for doc_id in fused[:k]]
+
 
-    vector_database.add_documents(chunked_doc)
+def pack_documents(documents, token_budget: int, count_tokens, max_documents: int = None):
+    # Greedy in rank order, a chunk that doesn't fit is skipped for smaller ones below it
+    packed, used = [], 0
+    for doc in documents:
+        if max_documents is not None and len(packed) >= max_documents:
+            break
+        tokens = count_tokens(doc.page_content)
+        if used + tokens > token_budget:
+            continue
+        packed.append(doc)
+        used += tokens
+    return packed, used
 
 
-def generate_context(query: str, file: str):
+def retrieve(query, vector_database, lexical_index=None, filter=None, rerank: bool = None,
+             token_budget: int = None, max_chunks: int = None):
+    """
+    Return the chunks to use as context for `query`.
 
-    ProcessDocuments(file)
+    With reranking, a wide candidate set from find_related_documents is
+    rescored by the cross-encoder, and at most `max_chunks` are packed best
+    first into `token_budget` tokens. Otherwise the RETRIEVAL_K fused chunks
+    are returned as they are.
+    """
+    rerank = RERANK if rerank is None else rerank
+    with tracer.span("rag.retrieve", "rag", hybrid=lexical_index is not None, filtered=filter is not None) as span:
+        if rerank:
+            documents = find_related_documents(
+                query, vector_database, lexical_index, k=RERANK_CANDIDATES,
+                fetch_k=max(RETRIEVAL_FETCH_K, RERANK_CANDIDATES), filter=filter
+            )
+        else:
+            documents = find_related_documents(query, vector_database, lexical_index, filter=filter)
+        span["results"] = len(documents)
+    if not rerank:
+        return documents
 
-    
-    vector_database = Chroma(
-        persist_directory=f"./chroma_store/{file.split("\\")[-1].split(".")[0]}",
-        embedding_function=embedding_model
+    from reranker import get_reranker
+    from source_fetcher import default_token_counter
+    ranked = get_reranker().rerank(query, documents)
+    packed, _ = pack_documents(
+        ranked, token_budget or CONTEXT_TOKEN_BUDGET, default_token_counter(), max_chunks or CONTEXT_MAX_CHUNKS
     )
+    return packed
+
+
+class Corpus:
+    """
+    Shared index of every ingested document: one vector store and one BM25 index.
+
+    Chunks carry doc_id, source, page, uploaded_at and owner metadata, so one
+    retrieval can span any subset of documents, and a document is deleted by
+    removing its chunks from both indexes. The in-memory BM25 index is kept in
+    step with the registry by sync(), which loads documents ingested by other
+    processes and drops ones they deleted.
+    """
+
+    def __init__(self, persist_directory: str, backend: str = None):
+        self.persist_directory = persist_directory
+        self.vector_database = open_vector_store(persist_directory, ingest_embedding_model, backend)
+        self.lexical_index = BM25Index()
+        self._loaded = {}        # doc_id -> chunk count in the lexical index
+        self._ingesting = set()  # doc_ids being added live by this process
+        self._synced_at = None
+        self._sync_lock = threading.Lock()
+
+    def lexical_index_path(self, key: str) -> str:
+        return os.path.join(self.persist_directory, LEXICAL_DIRECTORY, f"{key}.json.gz")
+
+    def sync(self, force: bool = False):
+        now = time.monotonic()
+        if not force and self._synced_at is not None and now - self._synced_at < CORPUS_SYNC_SECONDS:
+            return
+        with self._sync_lock:
+            self._synced_at = now
+            entries = {
+                key: entry for key, entry in load_registry().items()
+                if entry.get("corpus") and entry["persist_directory"] == self.persist_directory
+            }
+            for key in list(self._loaded):
+                if key not in entries and key not in self._ingesting:
+                    self.lexical_index.remove(document_chunk_ids(key, self._loaded.pop(key)))
+            for key, entry in entries.items():
+                if key in self._loaded or key in self._ingesting:
+                    continue
+                path = self.lexical_index_path(key)
+                if os.path.exists(path):
+                    self.lexical_index.merge(BM25Index.load(path))
+                self._loaded[key] = entry["chunks"]
+
+    def begin_ingest(self, key: str):
+        with self._sync_lock:
+            self._ingesting.add(key)
+
+    def end_ingest(self, key: str, document_index: BM25Index = None):
+        # Persists the document's own BM25 index; without one the ingest failed
+        if document_index is not None:
+            document_index.save(self.lexical_index_path(key))
+        with self._sync_lock:
+            self._ingesting.discard(key)
+            if document_index is not None:
+                self._loaded[key] = len(document_index)
+
+    def delete(self, key: str, chunks: int):
+        ids = document_chunk_ids(key, chunks)
+        if ids:
+            self.vector_database.delete(ids=ids)
+            self.lexical_index.remove(ids)
+        with self._sync_lock:
+            self._loaded.pop(key, None)
+        try:
+            os.remove(self.lexical_index_path(key))
+        except OSError:
+            pass
+
+    def reclaimable_bytes(self) -> int:
+        # Deletes only mark chunks as gone, this much of the directory is theirs until compact()
+        if hasattr(self.vector_database, "reclaimable_bytes"):
+            return self.vector_database.reclaimable_bytes()
+        path = os.path.join(self.persist_directory, "chroma.sqlite3")
+        if not os.path.exists(path):
+            return 0
+        with closing(sqlite3.connect(path)) as db:
+            return db.execute("PRAGMA freelist_count").fetchone()[0] * db.execute("PRAGMA page_size").fetchone()[0]
+
+    def compact(self):
+        # Gives the space of deleted chunks back to the disk
+        if hasattr(self.vector_database, "compact"):
+            self.vector_database.compact()
+            return
+        # Chroma only frees its SQLite pages when vacuumed; its HNSW files keep
+        # deleted labels and reuse them for later inserts
+        with closing(sqlite3.connect(os.path.join(self.persist_directory, "chroma.sqlite3"), timeout=30)) as db:
+            db.execute("VACUUM")
+
+
+# One Corpus per directory for the life of the process: ingest jobs and
+# searches hold on to theirs, and a second instance would miss their writes
+_corpora = {}
+_corpora_lock = threading.Lock()
+
+
+def _open_corpus(persist_directory: str, backend: str) -> Corpus:
+    directory = os.path.abspath(persist_directory)
+    with _corpora_lock:
+        corpus = _corpora.get(directory)
+        if corpus is None:
+            corpus = _corpora[directory] = Corpus(persist_directory, backend)
+    return corpus
+
+
+def get_corpus(persist_directory: str = None, backend: str = None) -> Corpus:
+    corpus = _open_corpus(persist_directory or os.path.join(CHROMA_ROOT, CORPUS_NAME), backend or VECTOR_BACKEND)
+    corpus.sync()
+    return corpus
+
+
+def corpus_filter(doc_ids=None, **metadata):
+    """
+    Build a metadata filter for the corpus, e.g. corpus_filter(doc_ids=[...], owner=session_id).
+
+    Returns None, meaning the whole corpus, when no condition is given.
+    """
+    conditions = []
+    if doc_ids is not None:
+        conditions.append({"doc_id": {"$in": list(doc_ids)}})
+    conditions.extend({field: value} for field, value in metadata.items() if value is not None)
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def document_chunk_ids(key: str, chunks: int):
+    return [f"{key}:{n}" for n in range(chunks)]
+
+
+def file_content_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def ingestion_key_for_hash(content_hash: str) -> str:
+    # Same bytes with the same chunker and embedding settings always map to the same collection
+    settings = f"{EMBEDDING_MODEL_NAME}|{CHUNK_SIZE}|{CHUNK_OVERLAP}"
+    if VECTOR_BACKEND != "chroma":
+        settings += f"|{VECTOR_BACKEND}|{QUANTIZED_DTYPE}"
+    settings_hash = hashlib.sha256(settings.encode()).hexdigest()[:12]
+    return f"{content_hash[:32]}-{settings_hash}"
+
+
+def ingestion_key(file_path: str) -> str:
+    return ingestion_key_for_hash(file_content_hash(file_path))
+
+
+def ingestion_key_for_bytes(data: bytes) -> str:
+    return ingestion_key_for_hash(hashlib.sha256(data).hexdigest())
+
+
+_registry_lock = threading.RLock()
+_registry_lock_file = None
+_registry_lock_depth = 0
+
+
+@contextmanager
+def registry_lock():
+    # Serializes registry updates across threads, and across server processes with flock
+    global _registry_lock_file, _registry_lock_depth
+    with _registry_lock:
+        if _registry_lock_depth == 0 and fcntl is not None:
+            os.makedirs(CHROMA_ROOT, exist_ok=True)
+            _registry_lock_file = open(REGISTRY_PATH + ".lock", "a")
+            fcntl.flock(_registry_lock_file, fcntl.LOCK_EX)
+        _registry_lock_depth += 1
+        try:
+            yield
+        finally:
+            _registry_lock_depth -= 1
+            if _registry_lock_depth == 0 and _registry_lock_file is not None:
+                _registry_lock_file.close()
+                _registry_lock_file = None
+
+
+def load_registry() -> dict:
+    if not os.path.exists(REGISTRY_PATH):
+        return {}
+    with open(REGISTRY_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_registry(registry: dict):
+    os.makedirs(CHROMA_ROOT, exist_ok=True)
+    tmp_path = REGISTRY_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(registry, f, indent=2)
+    os.replace(tmp_path, REGISTRY_PATH)
+
+
+def timed_iter(iterable, stage_seconds: dict, stage: str):
+    # Time spent producing each item is added to stage_seconds[stage]
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            stage_seconds[stage] += time.perf_counter() - start
+            return
+        stage_seconds[stage] += time.perf_counter() - start
+        yield item
+
+
+class IngestJob:
+    """
+    Ingest of one document into the corpus, usually running in the background.
+
+    Chunks are searchable as soon as they are written, so queries filtered to
+    this document are answered from the pages indexed so far.
+    """
+
+    def __init__(self, key: str, source: str = None, owner: str = None, corpus: Corpus = None):
+        self.key = key
+        self.source = source
+        self.owner = owner
+        # Sessions that uploaded this content while it was being ingested
+        self.owners = {owner or ""}
+        self.corpus = corpus or get_corpus()
+        self.vector_database = self.corpus.vector_database
+        self.lexical_index = self.corpus.lexical_index
+        self.filter = corpus_filter(doc_ids=[key])
+        self.pages = 0
+        self.total_pages = None
+        self.chunks = 0
+        self.error = None
+        self.done = threading.Event()
+
+    @classmethod
+    def completed(cls, key: str, entry: dict) -> "IngestJob":
+        job = cls(
+            key, entry.get("source"), entry.get("owner"),
+            corpus=get_corpus(entry["persist_directory"], entry.get("backend")),
+        )
+        job.pages = job.total_pages = entry.get("pages")
+        job.chunks = entry.get("chunks", 0)
+        job.done.set()
+        return job
+
+    def status(self) -> dict:
+        return {
+            "doc_id": self.key,
+            "source": self.source,
+            "pages": self.pages,
+            "total_pages": self.total_pages,
+            "chunks": self.chunks,
+            # A failed ingest is over, even while it is still cleaning up
+            "done": self.done.is_set() or self.error is not None,
+            "error": self.error,
+        }
+
+    def publish(self):
+        # Progress for the other server processes, see get_ingest_status
+        path = ingest_progress_path(self.key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(self.status(), updated_at=time.time()), f)
+        os.replace(tmp_path, path)
+
+    def wait(self, timeout: float = None) -> bool:
+        return self.done.wait(timeout)
+
+    def wait_until_searchable(self, timeout: float = None) -> bool:
+        # The first round of chunks is enough to start answering
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.chunks and not self.done.wait(0.1):
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+        return self.chunks > 0
+
+
+def ProcessDocuments(document_path: str, key: str = None, job: IngestJob = None) -> str:
+    """
+    Stream a PDF into the corpus vector store and lexical index, one page at a time.
+
+    Chunks are written in rounds that start at one embedding batch and double
+    up to a full round of batches, so the first pages become searchable
+    quickly while at most one round of chunks is held in memory. Progress is
+    reported on `job` when one is given.
+    """
+    key = key or ingestion_key(document_path)
+
+    job = job or IngestJob(key)
+    job.total_pages = count_pdf_pages(document_path)
+    job.publish()
+    vector_database = job.vector_database
+    lexical_index = job.lexical_index
+    document_index = BM25Index()
+    job.corpus.begin_ingest(key)
+    source = job.source or os.path.basename(document_path)
+    uploaded_at = time.time()
+    stored_bytes = 0
+
+    def flush(chunks, first_id):
+        nonlocal stored_bytes
+        ids = [f"{key}:{first_id + n}" for n in range(len(chunks))]
+        for chunk_id, chunk in zip(ids, chunks):
+            chunk.metadata.update(
+                chunk_id=chunk_id, doc_id=key, source=source,
+                page=int(chunk.metadata.get("page", 0)), uploaded_at=uploaded_at, owner=job.owner or "",
+            )
+            # Text is held by both indexes, plus one float32 vector
+            stored_bytes += 2 * len(chunk.page_content.encode()) + 4 * EMBEDDING_DIMENSIONS
+        vector_database.add_documents(chunks, ids=ids)
+        lexical_index.add_documents(chunks, ids)
+        document_index.add_documents(chunks, ids)
+
+    max_flush_size = EMBEDDING_BATCH_SIZE * max(EMBEDDING_WORKERS, 1)
+    flush_size = EMBEDDING_BATCH_SIZE
+    stage_seconds = {"rag.load": 0.0, "rag.chunk": 0.0, "rag.embed": 0.0}
+    page_count = chunk_count = 0
+    pending = []
+    for page in timed_iter(load_pdf_document(document_path), stage_seconds, "rag.load"):
+        page_count += 1
+        start = time.perf_counter()
+        pending.extend(chunk_documents([page]))
+        stage_seconds["rag.chunk"] += time.perf_counter() - start
+        if len(pending) >= flush_size:
+            start = time.perf_counter()
+            flush(pending, chunk_count)
+            stage_seconds["rag.embed"] += time.perf_counter() - start
+            chunk_count += len(pending)
+            pending = []
+            flush_size = min(flush_size * 2, max_flush_size)
+            job.pages, job.chunks = page_count, chunk_count
+            job.publish()
+    if pending:
+        start = time.perf_counter()
+        flush(pending, chunk_count)
+        stage_seconds["rag.embed"] += time.perf_counter() - start
+        chunk_count += len(pending)
+    job.pages, job.chunks = page_count, chunk_count
+    job.total_pages = page_count
+
+    for stage, seconds in stage_seconds.items():
+        tracer.record(stage, seconds, "rag", pages=page_count, chunks=chunk_count)
+
+    with registry_lock():
+        registry = load_registry()
+        previous = registry.get(key)
+        if previous and not previous.get("corpus"):
+            # Documents indexed into their own collection before the shared corpus
+            shutil.rmtree(previous["persist_directory"], ignore_errors=True)
+        registry[key] = {
+            "persist_directory": job.corpus.persist_directory,
+            "corpus": True,
+            "source": source,
+            "owner": job.owner or "",
+            "owners": sorted(job.owners),
+            "uploaded_at": uploaded_at,
+            "pages": page_count,
+            "chunks": chunk_count,
+            "bytes": stored_bytes,
+            "backend": VECTOR_BACKEND,
+            "last_used": time.time(),
+        }
+        save_registry(registry)
+    # Registered first, so a sync in between can't drop the document's chunks
+    job.corpus.end_ingest(key, document_index)
+    try:
+        os.remove(ingest_progress_path(key))
+    except OSError:
+        pass
+
+    collect_garbage(keep={key})
+    job.done.set()
+
+    return job.corpus.persist_directory
+
+
+_last_touched = {}
+
+
+def touch_registry_entry(*keys: str):
+    # Only rewrite the registry when a timestamp is meaningfully stale; documents
+    # touched recently by this process don't even read it
+    now = time.time()
+    keys = [key for key in keys if now - _last_touched.get(key, 0) > TOUCH_INTERVAL_SECONDS]
+    if not keys:
+        return
+    with registry_lock():
+        registry = load_registry()
+        stale = [key for key in keys if key in registry
+                 and now - registry[key].get("last_used", 0) > TOUCH_INTERVAL_SECONDS]
+        for key in stale:
+            registry[key]["last_used"] = now
+        if stale:
+            save_registry(registry)
+    for key in keys:
+        _last_touched[key] = now
+
+
+def filter_doc_ids(filter) -> list:
+    # doc_id values a corpus filter selects, e.g. from corpus_filter(doc_ids=...)
+    if not isinstance(filter, dict):
+        return []
+    doc_ids = []
+    for field, condition in filter.items():
+        if field in ("$and", "$or"):
+            for sub in condition:
+                doc_ids.extend(filter_doc_ids(sub))
+        elif field == "doc_id":
+            if isinstance(condition, dict):
+                doc_ids.extend(condition.get("$in", [condition["$eq"]] if "$eq" in condition else []))
+            else:
+                doc_ids.append(condition)
+    return doc_ids
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def collect_garbage(quota_mb: int = None, keep=()):
+    """
+    Delete least recently used documents until the store fits in `quota_mb`.
+
+    Documents whose key is in `keep`, or that were ingested or searched in
+    the last GC_GRACE_SECONDS, are never deleted. The store is measured on
+    disk; deleting a corpus document only frees its space once the corpus is
+    compacted, so eviction stops when the store would fit after compaction.
+    A corpus is compacted when the store is over quota, or when its deleted
+    chunks hold COMPACT_DEAD_FRACTION of its directory. Returns the keys that
+    were removed.
+    """
+    quota_bytes = (CHROMA_DISK_QUOTA_MB if quota_mb is None else quota_mb) * 1024 * 1024
+    removed = []
+    with registry_lock():
+        registry = load_registry()
+        corpora = [
+            get_corpus(persist_directory, backend) for persist_directory, backend in {
+                (entry["persist_directory"], entry.get("backend")) for entry in registry.values() if entry.get("corpus")
+            }
+        ]
+        total = directory_size(CHROMA_ROOT)
+        reclaimable = sum(corpus.reclaimable_bytes() for corpus in corpora)
+        by_age = sorted(registry, key=lambda key: registry[key].get("last_used", 0))
+        for key in by_age:
+            if total - reclaimable <= quota_bytes:
+                break
+            if key in keep or time.time() - registry[key].get("last_used", 0) < GC_GRACE_SECONDS:
+                continue
+            delete_document(key)
+            removed.append(key)
+            if registry[key].get("corpus"):
+                reclaimable = sum(corpus.reclaimable_bytes() for corpus in corpora)
+            else:
+                total = directory_size(CHROMA_ROOT)
+        for corpus in corpora:
+            dead = corpus.reclaimable_bytes()
+            if dead and (total > quota_bytes or dead >= COMPACT_DEAD_FRACTION * directory_size(corpus.persist_directory)):
+                corpus.compact()
+    return removed
+
+
+def document_owners(entry: dict) -> list:
+    # Entries written before owners were tracked only name the first uploader
+    if "owners" in entry:
+        return entry["owners"]
+    return [entry["owner"]] if entry.get("owner") is not None else []
+
+
+def add_document_owners(key: str, owners) -> bool:
+    # Identical uploads share one document, each uploader owns it until they delete it
+    with registry_lock():
+        registry = load_registry()
+        entry = registry.get(key)
+        if entry is None:
+            return False
+        current = document_owners(entry)
+        added = [owner for owner in owners if owner not in current]
+        if added:
+            entry["owners"] = current + added
+            save_registry(registry)
+    return True
+
+
+def delete_document(key: str, owner: str = None) -> bool:
+    """
+    Remove one document from the store; the rest of the corpus is left as is.
+
+    With `owner`, only that owner's claim on the document is removed, and the
+    chunks are dropped once no owner is left. Returns False when the document
+    isn't indexed or `owner` doesn't own it.
+    """
+    with registry_lock():
+        registry = load_registry()
+        entry = registry.get(key)
+        if entry is None:
+            return False
+        if owner is not None:
+            owners = document_owners(entry)
+            if owner not in owners:
+                return False
+            entry["owners"] = [other for other in owners if other != owner]
+            if entry["owners"]:
+                save_registry(registry)
+                return True
+        del registry[key]
+        if entry.get("corpus"):
+            corpus = get_corpus(entry["persist_directory"], entry.get("backend"))
+            corpus.delete(key, entry["chunks"])
+        else:
+            shutil.rmtree(entry["persist_directory"], ignore_errors=True)
+        save_registry(registry)
+    return True
+
+
+def list_documents(owner: str = None, **metadata) -> dict:
+    # Registry entries of the indexed corpus documents, optionally only those owned by `owner`
+    # or matching other entry fields
+    return {
+        key: entry for key, entry in load_registry().items()
+        if entry.get("corpus")
+        and (owner is None or owner in document_owners(entry))
+        and all(entry.get(field) == value for field, value in metadata.items())
+    }
+
+
+def cleanup_temp_files(max_age_seconds: int = UPLOAD_TEMP_MAX_AGE_SECONDS):
+    # Uploads left behind by sessions that ended before their temp file was removed
+    now = time.time()
+    temp_dir = tempfile.gettempdir()
+    for name in os.listdir(temp_dir):
+        path = os.path.join(temp_dir, name)
+        if name.startswith(UPLOAD_TEMP_PREFIX) and now - os.path.getmtime(path) > max_age_seconds:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def is_indexed(entry) -> bool:
+    return bool(entry and entry.get("corpus") and os.path.isdir(entry["persist_directory"]))
+
+
+def get_vector_database(file: str, key: str = None):
+    """
+    Make sure `file` is in the corpus and return the corpus vector database.
+
+    Documents are only embedded the first time their content is seen. Filter
+    on doc_id to search only this file.
+    """
+    key = key or ingestion_key(file)
+    entry = load_registry().get(key)
+
+    if is_indexed(entry):
+        touch_registry_entry(key)
+        return get_corpus(entry["persist_directory"], entry.get("backend")).vector_database
+    ProcessDocuments(file, key)
+    return get_corpus().vector_database
+
+
+_ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+_ingest_jobs = {}
+_ingest_jobs_lock = threading.Lock()
+
+
+def _run_ingest(data: bytes, job: IngestJob):
+    with tempfile.NamedTemporaryFile(delete=False, prefix=UPLOAD_TEMP_PREFIX, suffix=".pdf") as tmp_file:
+        tmp_file.write(data)
+        tmp_path = tmp_file.name
+    try:
+        ProcessDocuments(tmp_path, job.key, job)
+    except Exception as e:
+        # Chunks written before the failure would otherwise stay in the corpus unregistered,
+        # and an entry registered just before it would make a retry look indexed
+        job.corpus.delete(job.key, job.chunks)
+        job.corpus.end_ingest(job.key)
+        with registry_lock():
+            registry = load_registry()
+            if registry.pop(job.key, None) is not None:
+                save_registry(registry)
+        job.error = str(e)
+        # Stays readable by every process until the document is uploaded again
+        job.publish()
+        job.done.set()
+    finally:
+        os.remove(tmp_path)
+        with _ingest_jobs_lock:
+            # A retry of a failed ingest may already have taken the key
+            if _ingest_jobs.get(job.key) is job:
+                del _ingest_jobs[job.key]
+        # Sessions that joined after the registry entry was written; later
+        # uploads of the content find the entry instead of this job
+        if not job.error:
+            add_document_owners(job.key, sorted(job.owners))
+
+
+def ingest_progress_path(key: str) -> str:
+    return os.path.join(CHROMA_ROOT, INGEST_PROGRESS_DIRECTORY, f"{key}.json")
+
+
+def get_ingest_status(key: str):
+    """
+    Status of a document's ingest, as IngestJob.status() reports it, or None if unknown.
+
+    Answers for ingests running in any server process, from their progress
+    files, as well as for documents that are already indexed.
+    """
+    with _ingest_jobs_lock:
+        job = _ingest_jobs.get(key)
+    if job is not None:
+        return job.status()
+    entry = load_registry().get(key)
+    if is_indexed(entry):
+        return IngestJob.completed(key, entry).status()
+    try:
+        with open(ingest_progress_path(key), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def start_ingest(data: bytes, key: str = None, source: str = None, owner: str = None) -> IngestJob:
+    """
+    Start indexing the bytes of an uploaded PDF into the corpus in the background and return its job.
+
+    `source` (the file name) and `owner` (the uploading session) are stored
+    with every chunk. Content that is already indexed returns a finished job,
+    and an upload that is already being ingested by another session shares
+    that session's job. Either way `owner` becomes one of the document's
+    owners, see delete_document.
+    """
+    key = key or ingestion_key_for_bytes(data)
+    with _ingest_jobs_lock:
+        job = _ingest_jobs.get(key)
+        # Once a failed job has published its error, the upload starts over
+        if job is not None and not (job.error and job.done.is_set()):
+            job.owners.add(owner or "")
+            return job
+        entry = load_registry().get(key)
+        if is_indexed(entry):
+            add_document_owners(key, [owner or ""])
+            touch_registry_entry(key)
+            return IngestJob.completed(key, entry)
+        job = IngestJob(key, source, owner)
+        _ingest_jobs[key] = job
+    # Progress of an earlier attempt that failed, superseded by this one
+    try:
+        os.remove(ingest_progress_path(key))
+    except OSError:
+        pass
+    _ingest_executor.submit(_run_ingest, data, job)
+    return job
+
+
+def index_uploaded_pdf(data: bytes, key: str = None):
+    """
+    Index the bytes of an uploaded PDF and return the corpus vector database.
+
+    The upload is staged in a temp file only for the duration of the ingest.
+    Filter on doc_id to search only this upload.
+    """
+    job = start_ingest(data, key)
+    job.wait()
+    if job.error:
+        raise RuntimeError(f"Ingest failed: {job.error}")
+    return job.vector_database
+
+
+def generate_context(query: str, file: str = None, vector_database=None, lexical_index=None, filter=None):
+    """
+    Retrieve context for `query` from the corpus.
+
+    With `file`, it is ingested if needed and retrieval is limited to it;
+    otherwise `filter` selects the documents, e.g. corpus_filter(doc_ids=...).
+    """
+    if vector_database is None:
+        if file is not None:
+            key = ingestion_key(file)
+            get_vector_database(file, key)
+            filter = filter or corpus_filter(doc_ids=[key])
+        corpus = get_corpus()
+        vector_database, lexical_index = corpus.vector_database, corpus.lexical_index
+
+    relevant_docs = retrieve(query, vector_database, lexical_index, filter=filter)
+    # Searching a document is what keeps it from being collected, whichever handle was used
+    touch_registry_entry(*{
+        *filter_doc_ids(filter), *(doc.metadata["doc_id"] for doc in relevant_docs if doc.metadata.get("doc_id"))
+    })
+    # Chunks may come from several documents, label each with where it came from
+    context_text = "\n".join([
+        f"[{doc.metadata['source']}, page {doc.metadata.get('page', 0) + 1}]\n{doc.page_content}"
+        if doc.metadata.get("source") else doc.page_content
+        for doc in relevant_docs
+    ])
 
-    relevant_docs = find_related_documents(query, vector_database)
-    context_text = "\n".join([doc.page_content for doc in relevant_docs])
- 
     return query, context_text
 
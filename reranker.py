@@ -0,0 +1,104 @@
+"""
+Second retrieval stage: rescoring candidate chunks with a local cross-encoder.
+
+The first stage (dense + BM25) is cheap but coarse. A cross-encoder reads the
+query and chunk together, which ranks far better, at the price of one forward
+pass per pair. Pairs are scored in batches and scores are cached per
+(query, chunk id), so follow-up turns and repeated questions skip the model.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from stubs import use_stubs, FakeCrossEncoder
+from tracing import tracer
+
+
+RERANKER_MODEL_NAME = os.environ.get("CHATAI_RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_BATCH_SIZE = int(os.environ.get("CHATAI_RERANK_BATCH_SIZE", 32))
+SCORE_CACHE_SIZE = int(os.environ.get("CHATAI_RERANK_CACHE_SIZE", 20000))
+
+
+@lru_cache(maxsize=1)
+def get_reranker_model():
+    # Loaded on the first RAG query, small enough to run on CPU
+    if use_stubs():
+        return FakeCrossEncoder()
+    from sentence_transformers import CrossEncoder
+
+    return CrossEncoder(RERANKER_MODEL_NAME, device="cpu")
+
+
+def chunk_key(document) -> str:
+    return document.metadata.get("chunk_id") or hashlib.sha256(document.page_content.encode()).hexdigest()
+
+
+class Reranker:
+    """
+    Batched cross-encoder scoring with an LRU cache of (query, chunk id) scores.
+    """
+
+    def __init__(self, model=None, batch_size: int = RERANK_BATCH_SIZE, cache_size: int = SCORE_CACHE_SIZE):
+        self._model = model
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def model(self):
+        return self._model or get_reranker_model()
+
+    def score(self, query: str, documents):
+        return self._score(query, documents)[0]
+
+    def _score(self, query: str, documents):
+        # Returns the scores and how many of them came from the cache
+        normalized = " ".join(query.lower().split())
+        keys = [(normalized, chunk_key(doc)) for doc in documents]
+        scores = {}
+        with self._lock:
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[key] = self._scores[key]
+        missing = [(key, doc) for key, doc in zip(keys, documents) if key not in scores]
+        if missing:
+            predicted = self.model.predict(
+                [(query, doc.page_content) for _, doc in missing], batch_size=self.batch_size
+            )
+            with self._lock:
+                for (key, _), value in zip(missing, predicted):
+                    scores[key] = self._scores[key] = float(value)
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+        with self._lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        return [scores[key] for key in keys], len(keys) - len(missing)
+
+    def rerank(self, query: str, documents):
+        """
+        Return `documents` best first by cross-encoder score.
+        """
+        if not documents:
+            return []
+        with tracer.span("rag.rerank", "rag", candidates=len(documents)) as span:
+            scores, span["cached"] = self._score(query, documents)
+        order = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)
+        return [documents[i] for i in order]
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> Reranker:
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = Reranker()
+        return _reranker
@@ -0,0 +1,170 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass(kw_only=True)
+class ResearchJob:
+    job_id: str
+    query: str
+    settings: Dict[str, Any] = field(default_factory=dict)
+    status: str = QUEUED
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    result: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    cancel_requested: threading.Event = field(default_factory=threading.Event)
+    future: Any = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+
+def describe_update(node: str, update: Dict[str, Any]) -> str:
+    # One line of progress per graph node, shown to the user while research runs
+    if "message" in update:
+        # Already described by the API server
+        return update["message"]
+    if node == "generate_query":
+        return "Queries generated: " + "; ".join(update.get("search_queries", []))
+    if node == "web_research":
+        return f"Sources fetched (loop {update.get('research_loop_count', '?')}): {len(update.get('sources_gathered', []))} result sets"
+    if node == "summarize_sources":
+        sections = update.get("summary_sections", {})
+        return f"Summary updated: {len(sections)} sections"
+    if node == "reflect_on_summary":
+        return "Follow-up queries: " + "; ".join(update.get("search_queries", []))
+    if node == "finalize_summary":
+        return "Report ready"
+    return node
+
+
+class ResearchJobRunner:
+    """
+    Runs deep research jobs on a bounded worker pool, off the Streamlit script thread.
+
+    Jobs are identified by id and survive reruns of the script. Each job records
+    per-node progress events, and can be cancelled while queued or between nodes.
+    Only the most recent `max_finished_jobs` finished jobs are kept.
+    """
+
+    def __init__(self, max_workers: int = 4, max_finished_jobs: int = 200, research_fn=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="research_job")
+        self._jobs: Dict[str, ResearchJob] = {}
+        self._lock = threading.Lock()
+        self.max_finished_jobs = max_finished_jobs
+        self._research_fn = research_fn
+
+    def submit(self, query: str, **settings) -> str:
+        job = ResearchJob(job_id=uuid.uuid4().hex, query=query, settings=settings)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune()
+        job.future = self._executor.submit(self._run, job)
+        return job.job_id
+
+    def get(self, job_id: str) -> Optional[ResearchJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            return {
+                "job_id": job.job_id,
+                "query": job.query,
+                "status": job.status,
+                "events": list(job.events),
+                "result": job.result,
+                "error": job.error,
+            }
+
+    def events(self, job_id: str, since: int = 0) -> List[Dict[str, Any]]:
+        job = self.get(job_id)
+        if job is None:
+            return []
+        with self._lock:
+            return job.events[since:]
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel_requested.set()
+        # Jobs still waiting for a worker never start
+        if job.future is not None and job.future.cancel():
+            self._finish(job, CANCELLED)
+        return True
+
+    def shutdown(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel_requested.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _add_event(self, job: ResearchJob, node: str, message: str):
+        with self._lock:
+            job.events.append({"node": node, "message": message, "time": time.time()})
+
+    def _finish(self, job: ResearchJob, status: str, result: str = None, error: str = None):
+        with self._lock:
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished_at = time.time()
+
+    def _run(self, job: ResearchJob):
+        if job.cancel_requested.is_set():
+            self._finish(job, CANCELLED)
+            return
+        with self._lock:
+            job.status = RUNNING
+
+        research_fn = self._research_fn
+        if research_fn is None:
+            from deep_research import stream_deep_research
+            research_fn = stream_deep_research
+
+        result = None
+        try:
+            for node, update in research_fn(job.query, thread_id=job.job_id, **job.settings):
+                self._add_event(job, node, describe_update(node, update))
+                if "running_summary" in update and node == "finalize_summary":
+                    result = update["running_summary"]
+                if job.cancel_requested.is_set():
+                    raise JobCancelled()
+        except JobCancelled:
+            self._finish(job, CANCELLED)
+        except Exception as e:
+            self._finish(job, FAILED, error=str(e))
+        else:
+            self._finish(job, DONE, result=result)
+
+    def _prune(self):
+        finished = sorted(
+            (job for job in self._jobs.values() if job.finished),
+            key=lambda job: job.finished_at or job.created_at
+        )
+        for job in finished[:max(len(finished) - self.max_finished_jobs, 0)]:
+            del self._jobs[job.job_id]
@@ -1,21 +1,68 @@
-from model import get_gemma
-from rag_utils import generate_context
+import time
+from model import get_gemma, with_overrides
+from history import build_history
+from tracing import tracer, get_callbacks
+
+
+def sampled_gemma(temperature=None, top_k=None, top_p=None):
+    # Slider values change from turn to turn, so they go with the call and every
+    # turn shares the one pooled client
+    return with_overrides(get_gemma(), temperature=temperature, top_k=top_k, top_p=top_p)
 
 
 def generate_response(history=[], temperature: float=0.0, top_k=None, top_p=None):
     
-    gemma_model = get_gemma(temperature=temperature, top_k=top_k, top_p=top_p)
+    gemma_model = sampled_gemma(temperature=temperature, top_k=top_k, top_p=top_p)
    
-    response = gemma_model.invoke(history).content
+    response = gemma_model.invoke(build_history(history)).content
 
     return response
 
-def generate_RAG_response(query: str, file_path, history=[]):
+def generate_RAG_response(query: str, file_path, history=[], vector_database=None, lexical_index=None, filter=None):
+    from rag_utils import generate_context
+
     gemma_model = get_gemma()
-    query, context = generate_context(query, file_path)
+    query, context = generate_context(query, file_path, vector_database, lexical_index, filter)
 
-    history[-1] = {"role" : "user", "content" : f"INSTRUCTION: Answer the query with given context in mind.\nQUERY: {query}\n\nCONTEXT : {context}"}
+    messages = build_history(history)
+    messages[-1] = {"role" : "user", "content" : f"INSTRUCTION: Answer the query with given context in mind.\nQUERY: {query}\n\nCONTEXT : {context}"}
     
-    response = gemma_model.invoke(history).content
+    response = gemma_model.invoke(messages).content
+
+    return response
+
+
+def timed_stream(chunks, metrics=None, start=None):
+    # Yields the text of each chunk and records time-to-first-token and total latency in `metrics`
+    start = start or time.perf_counter()
+    metrics = metrics if metrics is not None else {}
+    for chunk in chunks:
+        if not chunk.content:
+            continue
+        if "ttft" not in metrics:
+            metrics["ttft"] = time.perf_counter() - start
+        yield chunk.content
+    metrics.setdefault("ttft", time.perf_counter() - start)
+    metrics["total"] = time.perf_counter() - start
+    tracer.record("chat.stream", metrics["total"], "chat", ttft=metrics["ttft"])
+
+
+def stream_response(history=[], temperature: float=0.0, top_k=None, top_p=None, metrics=None):
+    start = time.perf_counter()
+    gemma_model = sampled_gemma(temperature=temperature, top_k=top_k, top_p=top_p)
+
+    yield from timed_stream(gemma_model.stream(build_history(history), config={"callbacks": get_callbacks()}), metrics, start)
+
+
+def stream_RAG_response(query: str, file_path, history=[], metrics=None, vector_database=None, lexical_index=None, filter=None):
+    # Retrieval counts towards time-to-first-token, it is part of what the user waits for
+    start = time.perf_counter()
+    from rag_utils import generate_context
+
+    gemma_model = get_gemma()
+    query, context = generate_context(query, file_path, vector_database, lexical_index, filter)
+
+    messages = build_history(history)
+    messages[-1] = {"role" : "user", "content" : f"INSTRUCTION: Answer the query with given context in mind.\nQUERY: {query}\n\nCONTEXT : {context}"}
 
-    return response
\ No newline at end of file
+    yield from timed_stream(gemma_model.stream(messages, config={"callbacks": get_callbacks()}), metrics, start)
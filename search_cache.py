@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from tracing import tracer
+from stubs import use_stubs, FakeTavilyClient
+
+
+SEARCH_CACHE_PATH = os.environ.get("CHATAI_SEARCH_CACHE_PATH", "./search_cache.sqlite3")
+SEARCH_CACHE_TTL_SECONDS = int(os.environ.get("CHATAI_SEARCH_CACHE_TTL", 24 * 60 * 60))
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("CHATAI_SEARCH_CACHE_MAX_ENTRIES", 5000))
+
+
+def normalize_query(query: str) -> str:
+    # Case and whitespace differences shouldn't cost another search
+    return " ".join(query.lower().split())
+
+
+def search_cache_key(query: str, params: dict) -> str:
+    payload = json.dumps({"query": normalize_query(query), "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class SearchCache:
+    """
+    SQLite-backed cache of search responses with TTL expiry and LRU eviction.
+
+    Entries older than `ttl_seconds` are treated as misses. Once more than
+    `max_entries` are stored, the least recently read ones are evicted.
+    """
+
+    def __init__(self, path: str = SEARCH_CACHE_PATH, ttl_seconds: int = SEARCH_CACHE_TTL_SECONDS,
+                 max_entries: int = SEARCH_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS search_cache_last_access ON search_cache (last_access)")
+        self._conn.commit()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE search_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_cache (key, response, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(response), now, now)
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM search_cache WHERE key IN "
+                    "(SELECT key FROM search_cache ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM search_cache")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+
+class CachedSearchClient:
+    """Drop-in for TavilyClient.search that answers repeated queries from a SearchCache."""
+
+    def __init__(self, client, cache: SearchCache):
+        self.client = client
+        self.cache = cache
+
+    def search(self, query: str, **params):
+        with tracer.span("search", "search") as span:
+            key = search_cache_key(query, params)
+            response = self.cache.get(key)
+            span["cache_hit"] = response is not None
+            if response is None:
+                response = self.client.search(query, **params)
+                self.cache.set(key, response)
+        return response
+
+
+def default_cache_path() -> str:
+    # Stub results must never be served to a real deployment, they get their own file
+    # unless a path was chosen explicitly
+    if use_stubs() and "CHATAI_SEARCH_CACHE_PATH" not in os.environ:
+        root, extension = os.path.splitext(SEARCH_CACHE_PATH)
+        return f"{root}.stub{extension}"
+    return SEARCH_CACHE_PATH
+
+
+_search_cache = None
+_search_client = None
+_search_client_lock = threading.Lock()
+
+
+def get_search_cache() -> SearchCache:
+    # Separate from the client, so its stats can be read without loading the search API
+    global _search_cache
+    with _search_client_lock:
+        if _search_cache is None:
+            _search_cache = SearchCache(default_cache_path())
+        return _search_cache
+
+
+def get_search_client() -> CachedSearchClient:
+    # One client and cache per process, shared by web search, the agent and deep research
+    global _search_client
+    cache = get_search_cache()
+    with _search_client_lock:
+        if _search_client is None:
+            if use_stubs():
+                client = FakeTavilyClient()
+            else:
+                from tavily import TavilyClient
+                from api_key import TAVILY_API_KEY
+                client = TavilyClient(api_key=TAVILY_API_KEY)
+            _search_client = CachedSearchClient(client, cache)
+        return _search_client
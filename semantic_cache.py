@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("CHATAI_SEMANTIC_CACHE_THRESHOLD", 0.92))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.environ.get("CHATAI_SEMANTIC_CACHE_TTL", 6 * 60 * 60))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("CHATAI_SEMANTIC_CACHE_MAX_ENTRIES", 1000))
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+
+def embed_with_minilm(text: str):
+    from rag_utils import get_embedding_model
+    return get_embedding_model().embed_query(text)
+
+
+class SemanticCache:
+    """
+    Answer cache that matches repeated and near-duplicate questions.
+
+    Entries are bucketed by mode and sampling parameters; within a bucket a
+    question hits on an exact normalized match, or when the cosine similarity of
+    its embedding to a stored question is at least `threshold`. Only answers
+    generated at temperature 0 are stored or served, sampled answers are not
+    reusable. Entries expire after `ttl_seconds` and the least recently used
+    are evicted past `max_entries`.
+    """
+
+    def __init__(self, embed_fn=None, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl_seconds: int = SEMANTIC_CACHE_TTL_SECONDS, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.embed_fn = embed_fn or embed_with_minilm
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self._entries = OrderedDict()   # (bucket, normalized query) -> entry
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def bucket(mode: str, temperature=0.0, top_k=None, top_p=None):
+        return (mode, float(temperature or 0.0), top_k, None if top_p is None else float(top_p))
+
+    @staticmethod
+    def cacheable(temperature) -> bool:
+        return not temperature
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embed_fn(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now: float):
+        expired = [key for key, entry in self._entries.items() if now - entry["created_at"] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, query: str, mode: str, temperature=0.0, top_k=None, top_p=None):
+        if not self.cacheable(temperature):
+            with self._lock:
+                self.skipped += 1
+            return None
+
+        bucket = self.bucket(mode, temperature, top_k, top_p)
+        normalized = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get((bucket, normalized))
+            if entry is not None:
+                self._entries.move_to_end((bucket, normalized))
+                self.hits += 1
+                return entry["answer"]
+            candidates = [(key, entry) for key, entry in self._entries.items() if key[0] == bucket]
+
+        best_key, best_score = None, -1.0
+        if candidates:
+            vector = self._embed(normalized)
+            scores = np.stack([entry["vector"] for _, entry in candidates]) @ vector
+            best = int(np.argmax(scores))
+            best_key, best_score = candidates[best][0], float(scores[best])
+
+        with self._lock:
+            if best_key is not None and best_score >= self.threshold and best_key in self._entries:
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                return self._entries[best_key]["answer"]
+            self.misses += 1
+        return None
+
+    def store(self, query: str, answer, mode: str, temperature=0.0, top_k=None, top_p=None):
+        if not self.cacheable(temperature):
+            return
+        bucket = self.bucket(mode, temperature, top_k, top_p)
+        normalized = normalize_query(query)
+        vector = self._embed(normalized)
+        with self._lock:
+            self._entries[(bucket, normalized)] = {"vector": vector, "answer": answer, "created_at": time.time()}
+            self._entries.move_to_end((bucket, normalized))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticCache:
+    global _semantic_cache
+    with _semantic_cache_lock:
+        if _semantic_cache is None:
+            _semantic_cache = SemanticCache()
+        return _semantic_cache
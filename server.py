@@ -0,0 +1,448 @@
+"""
+Headless HTTP API for chat, web search, RAG and deep research.
+
+Run with `uvicorn server:app --workers N`. Each worker process loads its models
+and clients once and serves many requests. Processes only share the on-disk
+stores (registry, corpus, search cache), so capacity grows with the number of
+workers. With more than one worker use CHATAI_VECTOR_BACKEND=quantized, since
+Chroma's embedded client isn't safe to share between processes.
+
+Blocking work runs on one shared thread pool per process. Every endpoint class
+admits a fixed number of requests at once and queues a few more; beyond that,
+requests are rejected with 503 and Retry-After instead of piling up. Streams
+are produced on the pool and pause when the client reads slower than the
+model writes.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
+
+from search_cache import get_search_cache
+from semantic_cache import get_semantic_cache
+from tracing import tracer
+from warmup import start_prewarm_thread
+
+
+WORKER_THREADS = int(os.environ.get("CHATAI_WORKER_THREADS", 32))
+# Requests of each kind running at once in this process, and waiting for a slot
+CONCURRENCY_LIMITS = {
+    "chat": int(os.environ.get("CHATAI_MAX_CONCURRENT_CHAT", 16)),
+    "web": int(os.environ.get("CHATAI_MAX_CONCURRENT_WEB", 8)),
+    "rag": int(os.environ.get("CHATAI_MAX_CONCURRENT_RAG", 8)),
+    "research": int(os.environ.get("CHATAI_MAX_CONCURRENT_RESEARCH", 2)),
+    "documents": int(os.environ.get("CHATAI_MAX_CONCURRENT_DOCUMENTS", 4)),
+}
+MAX_QUEUED = int(os.environ.get("CHATAI_MAX_QUEUED", 32))
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get("CHATAI_QUEUE_TIMEOUT_SECONDS", 10))
+# Stream items buffered per response before the producer waits for the client
+STREAM_BUFFER = 64
+# How long a RAG request waits for the first chunks of documents still being ingested
+RAG_WAIT_SECONDS = 60
+MAX_RESEARCH_LOOPS = int(os.environ.get("CHATAI_MAX_RESEARCH_LOOPS", 6))
+MAX_UPLOAD_BYTES = int(os.environ.get("CHATAI_MAX_UPLOAD_MB", 100)) * 1024 * 1024
+
+worker_pool = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="api_worker")
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ConcurrencyLimiter:
+    """
+    Admits `limit` requests at once; up to `max_queued` more wait up to
+    `timeout` seconds for a slot, anything beyond is rejected.
+    """
+
+    def __init__(self, limit: int, max_queued: int = MAX_QUEUED, timeout: float = QUEUE_TIMEOUT_SECONDS):
+        self.limit = limit
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        if not self._semaphore.locked():
+            # A free slot is taken without suspending, so nothing can claim it in between
+            await self._semaphore.acquire()
+            self.active += 1
+            return
+        if self.waiting >= self.max_queued:
+            self.rejected += 1
+            raise Overloaded()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "active": self.active, "waiting": self.waiting, "rejected": self.rejected}
+
+
+limiters = {kind: ConcurrencyLimiter(limit) for kind, limit in CONCURRENCY_LIMITS.items()}
+
+
+async def run_blocking(fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(worker_pool, partial(fn, *args, **kwargs))
+
+
+_DONE = object()
+
+
+class _StreamError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def stream_from_pool(generator_fn, *args, **kwargs):
+    """
+    Run a blocking generator on the worker pool and yield its items.
+
+    At most STREAM_BUFFER items are buffered; past that the producer thread
+    waits for the client. When the client goes away the producer stops at
+    its next item.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=STREAM_BUFFER)
+    stop = threading.Event()
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce():
+        try:
+            for item in generator_fn(*args, **kwargs):
+                if stop.is_set():
+                    break
+                put(item)
+        except BaseException as e:
+            put(_StreamError(e))
+        finally:
+            put(_DONE)
+
+    loop.run_in_executor(worker_pool, produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _StreamError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        # Unblock a producer waiting on a full queue so it can see the stop flag
+        while not queue.empty():
+            queue.get_nowait()
+
+
+def ndjson(record: dict) -> str:
+    return json.dumps(record) + "\n"
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Optional: load every tool in the background as soon as the server starts
+    if os.environ.get("CHATAI_PREWARM", "0") == "1":
+        start_prewarm_thread()
+    yield
+    worker_pool.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(title="chatAI", lifespan=lifespan)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc):
+    return JSONResponse({"detail": "Server busy, retry shortly"}, status_code=503, headers={"Retry-After": "1"})
+
+
+class AdmittedStream(StreamingResponse):
+    """
+    A streaming response holding a concurrency slot. The slot is given back
+    exactly once: when the body ends, raises or is closed on disconnect, or
+    when the response ends without the body having started.
+    """
+
+    def __init__(self, limiter: ConcurrencyLimiter, body, **kwargs):
+        self._limiter = limiter
+        self._released = False
+        super().__init__(self._guarded(body), **kwargs)
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self._limiter.release()
+
+    async def _guarded(self, body):
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            self._release()
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+
+async def admitted_stream(kind: str, body, media_type: str, headers: dict = None, admitted: bool = False):
+    # The slot is taken before the response starts, so overload is still a 503
+    limiter = limiters[kind]
+    if not admitted:
+        await limiter.acquire()
+    return AdmittedStream(limiter, body, media_type=media_type, headers=headers)
+
+
+class ChatRequest(BaseModel):
+    messages: List[Dict[str, Any]]
+    temperature: float = 1.0
+    top_k: Optional[int] = None
+    top_p: Optional[float] = None
+
+
+class WebRequest(BaseModel):
+    query: str
+
+
+class RagRequest(BaseModel):
+    query: str
+    messages: List[Dict[str, Any]] = []
+    doc_ids: List[str]
+
+
+class ResearchSettings(BaseModel):
+    # The Configuration fields a client may override, within what one server can afford
+    model_config = ConfigDict(extra="forbid")
+
+    max_web_research_loops: Optional[int] = Field(None, ge=0, le=MAX_RESEARCH_LOOPS)
+    queries_per_loop: Optional[int] = Field(None, ge=1, le=5)
+    results_per_query: Optional[int] = Field(None, ge=1, le=5)
+    summary_token_budget: Optional[int] = Field(None, ge=100, le=4000)
+    source_token_budget: Optional[int] = Field(None, ge=100, le=4000)
+
+
+class ResearchRequest(BaseModel):
+    query: str
+    settings: ResearchSettings = ResearchSettings()
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+@app.post("/v1/chat")
+async def chat(request: ChatRequest):
+    from run_model import stream_response
+
+    sampling = {"temperature": request.temperature, "top_k": request.top_k, "top_p": request.top_p}
+    prompt = request.messages[-1]["content"] if request.messages else ""
+    # Only an opening question stands on its own, later ones depend on the conversation
+    cache = get_semantic_cache() if len(request.messages) == 1 else None
+    if cache is not None:
+        cached = await run_blocking(cache.lookup, prompt, "Simple Chat", **sampling)
+        if cached is not None:
+            return PlainTextResponse(cached, headers={"X-Cache": "hit"})
+
+    async def body():
+        parts = []
+        async for text in stream_from_pool(stream_response, history=request.messages, **sampling):
+            parts.append(text)
+            yield text
+        if cache is not None:
+            await run_blocking(cache.store, prompt, "".join(parts), "Simple Chat", **sampling)
+
+    return await admitted_stream("chat", body(), "text/plain; charset=utf-8", {"X-Cache": "miss"})
+
+
+@app.post("/v1/web")
+async def web(request: WebRequest):
+    from web_search import search_web
+
+    # The search agent always samples at get_gemma's defaults, temperature 0
+    cache = get_semantic_cache()
+    cached = await run_blocking(cache.lookup, request.query, "Web Search")
+    if cached is not None:
+        answer, sources = cached
+        return {"answer": answer, "sources": sources, "cached": True}
+    async with limiters["web"].slot():
+        answer, sources = await run_blocking(search_web, request.query)
+    await run_blocking(cache.store, request.query, [answer, sources], "Web Search")
+    return {"answer": answer, "sources": sources, "cached": False}
+
+
+@app.post("/v1/documents")
+async def upload_document(file: UploadFile = File(...), owner: str = Form("")):
+    from rag_utils import start_ingest
+
+    async with limiters["documents"].slot():
+        data = await file.read(MAX_UPLOAD_BYTES + 1)
+        if len(data) > MAX_UPLOAD_BYTES:
+            raise HTTPException(413, f"Uploads are limited to {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+        job = await run_blocking(start_ingest, data, source=file.filename, owner=owner)
+    return job.status()
+
+
+@app.get("/v1/documents")
+async def list_documents(owner: Optional[str] = None):
+    from rag_utils import list_documents
+
+    filters = {"owner": owner} if owner is not None else {}
+    entries = await run_blocking(list_documents, **filters)
+    return [
+        {"doc_id": key, "source": entry.get("source"), "pages": entry.get("pages"), "chunks": entry.get("chunks"),
+         "owner": entry.get("owner"), "uploaded_at": entry.get("uploaded_at")}
+        for key, entry in entries.items()
+    ]
+
+
+@app.get("/v1/documents/{doc_id}")
+async def document_status(doc_id: str):
+    from rag_utils import get_ingest_status
+
+    status = await run_blocking(get_ingest_status, doc_id)
+    if status is None:
+        raise HTTPException(404, "Unknown document")
+    return status
+
+
+@app.delete("/v1/documents/{doc_id}")
+async def delete_document(doc_id: str, owner: str = ""):
+    # Only the caller's claim is removed, the chunks go once no uploader is left
+    from rag_utils import delete_document
+
+    if not await run_blocking(delete_document, doc_id, owner=owner):
+        raise HTTPException(404, "Unknown, still indexing or not owned by this owner")
+    return {"deleted": doc_id}
+
+
+async def wait_until_searchable(doc_ids, timeout: float = RAG_WAIT_SECONDS):
+    """
+    Wait until each document has its first chunks indexed, or has finished.
+
+    Returns the searchable doc ids and those of them still being ingested.
+    Polls from the event loop, so waiting holds no pool thread.
+    """
+    from rag_utils import get_ingest_status
+
+    deadline = time.monotonic() + timeout
+    while True:
+        statuses = [status for status in await run_blocking(lambda: list(map(get_ingest_status, doc_ids)))
+                    if status is not None]
+        waiting = [status for status in statuses if not status["chunks"] and not status["done"]]
+        if not waiting or time.monotonic() > deadline:
+            searchable = [status for status in statuses if status["chunks"] and not status["error"]]
+            return (
+                [status["doc_id"] for status in searchable],
+                [status["doc_id"] for status in searchable if not status["done"]],
+            )
+        await asyncio.sleep(0.2)
+
+
+@app.post("/v1/rag")
+async def rag(request: RagRequest):
+    from rag_utils import get_corpus, corpus_filter
+    from run_model import stream_RAG_response
+
+    # Admitted first, so requests waiting on documents still count against the limit
+    limiter = limiters["rag"]
+    await limiter.acquire()
+    try:
+        searchable, pending = await wait_until_searchable(request.doc_ids)
+        if not searchable:
+            raise HTTPException(409, "None of the documents has searchable content yet")
+        corpus = await run_blocking(get_corpus)
+    except BaseException:
+        limiter.release()
+        raise
+    messages = request.messages or [{"role": "user", "content": request.query}]
+
+    body = stream_from_pool(
+        stream_RAG_response, request.query, None, messages,
+        vector_database=corpus.vector_database, lexical_index=corpus.lexical_index,
+        filter=corpus_filter(doc_ids=searchable),
+    )
+    # Answers use the pages indexed so far of documents still being ingested
+    headers = {"X-Documents-Indexing": str(len(pending))}
+    return await admitted_stream("rag", body, "text/plain; charset=utf-8", headers, admitted=True)
+
+
+@app.post("/v1/research")
+async def research(request: ResearchRequest):
+    """
+    Stream a deep research run as NDJSON: one {"node", "message"} line per graph
+    node, the last one ("finalize_summary") also carrying the "report".
+    """
+    from deep_research import stream_deep_research
+    from research_jobs import describe_update
+
+    async def body():
+        async for node, update in stream_from_pool(
+            stream_deep_research, request.query, thread_id=uuid.uuid4().hex,
+            **request.settings.model_dump(exclude_none=True),
+        ):
+            record = {"node": node, "message": describe_update(node, update)}
+            if node == "finalize_summary":
+                record["report"] = update.get("running_summary")
+            yield ndjson(record)
+
+    return await admitted_stream("research", body(), "application/x-ndjson")
+
+
+@app.get("/v1/stats")
+async def stats():
+    return {
+        "semantic_cache": get_semantic_cache().stats(),
+        "search_cache": await run_blocking(get_search_cache().stats),
+        "limits": {kind: limiter.stats() for kind, limiter in limiters.items()},
+        "traces": tracer.summary(),
+        "pid": os.getpid(),
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    lines = [tracer.prometheus_text().rstrip("\n")]
+    for kind, limiter in limiters.items():
+        for name, value in limiter.stats().items():
+            lines.append(f'chatai_requests_{name}{{kind="{kind}"}} {value}')
+    lines += ["# TYPE chatai_cache_lookups_total counter", "# TYPE chatai_cache_entries gauge"]
+    caches = {"semantic": get_semantic_cache().stats(), "search": await run_blocking(get_search_cache().stats)}
+    for cache, cache_stats in caches.items():
+        lines.append(f'chatai_cache_lookups_total{{cache="{cache}",result="hit"}} {cache_stats["hits"]}')
+        lines.append(f'chatai_cache_lookups_total{{cache="{cache}",result="miss"}} {cache_stats["misses"]}')
+        lines.append(f'chatai_cache_entries{{cache="{cache}"}} {cache_stats["entries"]}')
+    return PlainTextResponse("\n".join(lines) + "\n")
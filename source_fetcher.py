@@ -0,0 +1,328 @@
+import asyncio
+import http.client
+import ipaddress
+import os
+import re
+import socket
+import threading
+import time
+import urllib.parse
+import urllib.request
+from html.parser import HTMLParser
+import numpy as np
+from stubs import use_stubs, FakeEmbeddings
+
+
+FETCH_CONCURRENCY = 8
+FETCH_TIMEOUT_SECONDS = 10
+FETCH_MAX_BYTES = 2 * 1024 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+PASSAGE_CHARS = 800
+USER_AGENT = "Mozilla/5.0 (compatible; chatAI research)"
+# Search results are untrusted, file:// or ftp:// must never be opened
+FETCH_SCHEMES = ("http", "https")
+# Nor may they reach the server's own network: only public addresses are fetched, except
+# for these host names and addresses or networks, e.g. "127.0.0.1,10.0.0.0/8,wiki.internal"
+FETCH_ALLOWED_HOSTS = [host.strip() for host in os.environ.get("CHATAI_FETCH_ALLOWED_HOSTS", "").split(",") if host.strip()]
+
+SKIPPED_TAGS = {"script", "style", "noscript", "nav", "header", "footer", "aside", "form", "svg"}
+BLOCK_TAGS = {"p", "div", "section", "article", "li", "h1", "h2", "h3", "h4", "h5", "h6", "tr", "br", "pre", "blockquote"}
+
+
+class TextExtractor(HTMLParser):
+    """Collects the visible text of a page, one line per block element."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+    def text(self) -> str:
+        lines = (" ".join(line.split()) for line in "".join(self.parts).split("\n"))
+        return "\n".join(line for line in lines if line)
+
+
+def extract_text(html: str) -> str:
+    parser = TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return parser.text()
+
+
+def check_scheme(url: str):
+    scheme = urllib.parse.urlsplit(url).scheme.lower()
+    if scheme not in FETCH_SCHEMES:
+        raise ValueError(f"Unsupported URL scheme: {scheme or 'none'!r}")
+
+
+def is_allowed_host(host: str, address) -> bool:
+    for allowed in FETCH_ALLOWED_HOSTS:
+        if allowed.lower() == host.lower():
+            return True
+        try:
+            if address in ipaddress.ip_network(allowed, strict=False):
+                return True
+        except ValueError:
+            pass
+    return False
+
+
+def check_address(host: str, address: str):
+    # Loopback, private, link-local (cloud metadata), shared and reserved ranges are all non-global
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if (not ip.is_global or ip.is_multicast) and not is_allowed_host(host, ip):
+        raise ValueError(f"Refusing to fetch {host}: {ip} is not a public address")
+
+
+def resolve_public(host: str, port: int):
+    # Every address the name resolves to must be public, not just the first one
+    addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    for *_, sockaddr in addresses:
+        check_address(host, sockaddr[0])
+    return addresses
+
+
+def check_url(url: str):
+    check_scheme(url)
+    parts = urllib.parse.urlsplit(url)
+    if not parts.hostname:
+        raise ValueError(f"No host in URL: {url!r}")
+    resolve_public(parts.hostname, parts.port or (443 if parts.scheme.lower() == "https" else 80))
+
+
+def connect_public(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    # Connects to the addresses that were checked, a second DNS answer can't point elsewhere
+    host, port = address
+    error = None
+    for family, socktype, proto, _, sockaddr in resolve_public(host, port):
+        try:
+            return socket.create_connection(sockaddr[:2], timeout, source_address)
+        except OSError as e:
+            error = e
+    raise error or OSError(f"{host} has no address")
+
+
+class SocketResponse(http.client.HTTPResponse):
+    # Keeps the socket, so fetch_url can shorten its timeout as the deadline nears
+    def __init__(self, sock, *args, **kwargs):
+        super().__init__(sock, *args, **kwargs)
+        self.socket = sock
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+    response_class = SocketResponse
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = connect_public
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+    response_class = SocketResponse
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = connect_public
+
+
+class PublicHTTPHandler(urllib.request.HTTPHandler):
+    def do_open(self, http_class, req, **kwargs):
+        return super().do_open(PublicHTTPConnection, req, **kwargs)
+
+
+class PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def do_open(self, http_class, req, **kwargs):
+        return super().do_open(PublicHTTPSConnection, req, **kwargs)
+
+
+class HTTPRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # urllib follows redirects to ftp:// too, only public http(s) ones are allowed here
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+# Only the http(s) handlers, so nothing but web pages can be opened. No proxy either:
+# connections go straight to the address that was checked
+_opener = urllib.request.OpenerDirector()
+for _handler in (PublicHTTPHandler(), PublicHTTPSHandler(), HTTPRedirectHandler(),
+                 urllib.request.HTTPErrorProcessor(), urllib.request.HTTPDefaultErrorHandler()):
+    _opener.add_handler(_handler)
+
+
+def fetch_url(url: str, timeout: float = FETCH_TIMEOUT_SECONDS) -> str:
+    # The whole download shares one deadline, a slow host can't keep the thread for longer
+    deadline = time.monotonic() + timeout
+    check_url(url)
+    request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+    with _opener.open(request, timeout=timeout) as response:
+        content_type = response.headers.get("Content-Type", "")
+        if content_type and not any(kind in content_type for kind in ("html", "text", "xml")):
+            return ""
+        chunks, size = [], 0
+        while size < FETCH_MAX_BYTES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Not downloaded within {timeout}s")
+            response.socket.settimeout(remaining)
+            chunk = response.read1(min(READ_CHUNK_BYTES, FETCH_MAX_BYTES - size))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        charset = response.headers.get_content_charset() or "utf-8"
+    html = b"".join(chunks).decode(charset, errors="replace")
+    return extract_text(html) if "<" in html[:1000] else html
+
+
+async def fetch_all(urls, concurrency: int = FETCH_CONCURRENCY, timeout: float = FETCH_TIMEOUT_SECONDS):
+    """
+    Fetch and extract `urls` with at most `concurrency` requests in flight.
+
+    Returns {url: text}; pages that fail or time out map to "". A fetch holds
+    its slot until its thread is done, fetch_url enforces the timeout.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(url):
+        async with semaphore:
+            try:
+                return url, await asyncio.to_thread(fetch_url, url, timeout)
+            except Exception as e:
+                print(f"Warning: failed to fetch {url}: {e}")
+                return url, ""
+
+    return dict(await asyncio.gather(*(fetch(url) for url in urls)))
+
+
+def run_async(coroutine):
+    # Graph nodes are sync; give the coroutine its own loop even if the caller already runs one
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(value=asyncio.run(coroutine)))
+    thread.start()
+    thread.join()
+    return result["value"]
+
+
+def split_passages(text: str, passage_chars: int = PASSAGE_CHARS):
+    passages, current = [], ""
+    for paragraph in re.split(r"\n+", text or ""):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        while len(paragraph) > passage_chars:
+            cut = paragraph.rfind(" ", 0, passage_chars)
+            cut = cut if cut > passage_chars // 2 else passage_chars
+            if current:
+                passages.append(current)
+                current = ""
+            passages.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        if len(current) + len(paragraph) + 1 > passage_chars and current:
+            passages.append(current)
+            current = ""
+        current = f"{current}\n{paragraph}".strip()
+    if current:
+        passages.append(current)
+    return passages
+
+
+def default_embeddings():
+    if use_stubs():
+        return FakeEmbeddings()
+    from rag_utils import get_embedding_model
+    return get_embedding_model()
+
+
+def default_token_counter():
+    # The embedding model's tokenizer is a real tokenizer that is already loaded, unlike Gemma's
+    tokenizer = None if use_stubs() else getattr(getattr(default_embeddings(), "_client", None), "tokenizer", None)
+    if tokenizer is None:
+        return lambda text: len(text) // 4
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def rank_passages(query: str, passages, embeddings=None):
+    """
+    Order (source, passage) pairs by cosine similarity of the passage to `query`.
+    """
+    if not passages:
+        return []
+    embeddings = embeddings or default_embeddings()
+    vectors = np.asarray(embeddings.embed_documents([passage for _, passage in passages]), dtype=np.float32)
+    query_vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query_vector /= max(np.linalg.norm(query_vector), 1e-12)
+    order = np.argsort(-(vectors @ query_vector))
+    return [passages[i] for i in order]
+
+
+def pack_passages(ranked, token_budget: int, count_tokens):
+    packed, used = [], 0
+    for source, passage in ranked:
+        tokens = count_tokens(passage)
+        if used + tokens > token_budget:
+            continue
+        packed.append((source, passage))
+        used += tokens
+    return packed, used
+
+
+def gather_sources(query: str, search_results, token_budget: int, embeddings=None, count_tokens=None,
+                   concurrency: int = FETCH_CONCURRENCY):
+    """
+    Turn search responses into the most query-relevant passages that fit `token_budget`.
+
+    Pages missing raw content are fetched concurrently. Each page is split into
+    passages, ranked against `query` with the local embedding model and packed
+    greedily. Returns a formatted "Sources:" block grouped by source, or "" when
+    nothing could be extracted.
+    """
+    sources = {}
+    for response in search_results:
+        for result in response.get("results", []):
+            if isinstance(result, dict) and result.get("url") and result["url"] not in sources:
+                sources[result["url"]] = result
+
+    missing = [url for url, result in sources.items() if not result.get("raw_content")]
+    fetched = run_async(fetch_all(missing, concurrency)) if missing else {}
+
+    passages = []
+    for url, result in sources.items():
+        text = result.get("raw_content") or fetched.get(url) or result.get("content", "")
+        passages.extend((url, passage) for passage in split_passages(text))
+
+    ranked = rank_passages(query, passages, embeddings)
+    packed, _ = pack_passages(ranked, token_budget, count_tokens or default_token_counter())
+    if not packed:
+        return ""
+
+    by_source = {}
+    for url, passage in packed:
+        by_source.setdefault(url, []).append(passage)
+    formatted_text = "Sources:\n\n"
+    for url, source_passages in by_source.items():
+        formatted_text += f"Source: {sources[url].get('title', '')}\n===\n"
+        formatted_text += f"URL: {url}\n===\n"
+        formatted_text += "Most relevant content from source: " + "\n...\n".join(source_passages) + "\n===\n"
+    return formatted_text.strip()
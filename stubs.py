@@ -0,0 +1,156 @@
+"""
+Local stand-ins for the Gemma chat model, the Tavily client, the embedding
+model and the reranker.
+
+Selected with CHATAI_BACKEND=stub, so the app and the benchmarks run without
+API keys or network access. Latency and token rate are configurable to model
+the real services.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Any, Iterator, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+STUB_LATENCY_MS = float(os.environ.get("CHATAI_STUB_LATENCY_MS", 300))
+STUB_TOKENS_PER_SECOND = float(os.environ.get("CHATAI_STUB_TOKENS_PER_SECOND", 80))
+STUB_RESPONSE_TOKENS = int(os.environ.get("CHATAI_STUB_RESPONSE_TOKENS", 120))
+STUB_SEARCH_LATENCY_MS = float(os.environ.get("CHATAI_STUB_SEARCH_LATENCY_MS", 400))
+STUB_SEARCH_RECORDINGS = os.environ.get("CHATAI_STUB_SEARCH_RECORDINGS")
+
+
+def use_stubs() -> bool:
+    return os.environ.get("CHATAI_BACKEND", "live") == "stub"
+
+
+def message_text(message) -> str:
+    if isinstance(message, dict):
+        return str(message.get("content", ""))
+    return str(getattr(message, "content", message))
+
+
+def stub_reply(prompt: str, response_tokens: int) -> str:
+    # Structured prompts get structured replies so the graphs and agents keep moving
+    if '"follow_up_queries"' in prompt:
+        body = {"knowledge_gap": "implementation details", "follow_up_queries": ["stub follow-up query one", "stub follow-up query two", "stub follow-up query three"]}
+        return f"```json\n{json.dumps(body)}\n```"
+    if '"queries"' in prompt:
+        body = {"queries": ["stub query one", "stub query two", "stub query three"], "aspect": "overview", "rationale": "stub"}
+        return f"```json\n{json.dumps(body)}\n```"
+    if "Action Input" in prompt and "Final Answer" in prompt:
+        return "Thought: I now know the final answer\nFinal Answer: " + " ".join(["stub"] * response_tokens)
+    words = re.findall(r"\w+", prompt)[-20:] or ["stub"]
+    return " ".join(words[n % len(words)] for n in range(response_tokens))
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model that waits `latency_ms` before the first token and then emits
+    `response_tokens` words at `tokens_per_second`.
+    """
+
+    latency_ms: float = STUB_LATENCY_MS
+    tokens_per_second: float = STUB_TOKENS_PER_SECOND
+    response_tokens: int = STUB_RESPONSE_TOKENS
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _reply(self, messages) -> List[str]:
+        prompt = "\n".join(message_text(message) for message in messages)
+        text = stub_reply(prompt, self.response_tokens)
+        return re.findall(r"\S+\s*", text), len(prompt) // 4
+
+    def _usage(self, prompt_tokens, completion_tokens):
+        return {"input_tokens": prompt_tokens, "output_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        tokens, prompt_tokens = self._reply(messages)
+        time.sleep(self.latency_ms / 1000 + len(tokens) / self.tokens_per_second)
+        message = AIMessage(content="".join(tokens), usage_metadata=self._usage(prompt_tokens, len(tokens)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        tokens, prompt_tokens = self._reply(messages)
+        time.sleep(self.latency_ms / 1000)
+        for n, token in enumerate(tokens):
+            time.sleep(1 / self.tokens_per_second)
+            usage = self._usage(prompt_tokens, len(tokens)) if n == len(tokens) - 1 else None
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token, usage_metadata=usage))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+class FakeTavilyClient:
+    """
+    Tavily stand-in answering from recorded responses (a JSON object mapping
+    normalized query to a Tavily response), or with synthetic results for
+    queries that weren't recorded.
+    """
+
+    def __init__(self, recordings_path: str = STUB_SEARCH_RECORDINGS, latency_ms: float = STUB_SEARCH_LATENCY_MS):
+        self.latency_ms = latency_ms
+        self.recordings = {}
+        if recordings_path:
+            with open(recordings_path, "r", encoding="utf-8") as f:
+                self.recordings = {" ".join(k.lower().split()): v for k, v in json.load(f).items()}
+        self.calls = 0
+
+    def search(self, query: str, max_results: int = 5, include_raw_content: bool = False, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency_ms / 1000)
+        recorded = self.recordings.get(" ".join(query.lower().split()))
+        if recorded is not None:
+            return recorded
+        slug = re.sub(r"\W+", "-", query.lower()).strip("-")[:60] or "query"
+        results = []
+        for n in range(max_results):
+            content = f"Result {n + 1} about {query}. " * 8
+            results.append({
+                "title": f"{query} ({n + 1})",
+                "url": f"https://example.com/{slug}/{n + 1}",
+                "content": content,
+                "score": 1.0 - n * 0.1,
+                "raw_content": content * 10 if include_raw_content else None,
+            })
+        return {"query": query, "results": results}
+
+
+class FakeEmbeddings:
+    """
+    Embedding stand-in hashing words into a fixed-size bag of words, so texts
+    sharing words still land close together.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dimensions] += 1.0
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+class FakeCrossEncoder:
+    """
+    Cross-encoder stand-in scoring a (query, text) pair by the share of query words found in the text.
+    """
+
+    def predict(self, pairs, batch_size: int = 32, **kwargs) -> List[float]:
+        scores = []
+        for query, text in pairs:
+            query_words = set(re.findall(r"\w+", query.lower()))
+            text_words = set(re.findall(r"\w+", text.lower()))
+            scores.append(len(query_words & text_words) / max(len(query_words), 1))
+        return scores
@@ -0,0 +1,30 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import HistoryManager
+
+
+def test_messages_dropped_from_an_oversized_segment_are_summarized():
+    summarized = []
+
+    def summarize(summary, messages):
+        summarized.extend(m["content"] for m in messages)
+        return f"{summary} {len(messages)}".strip()
+
+    manager = HistoryManager(token_budget=100, segment_messages=4, summarize_fn=summarize)
+    # Two short segments, then a last one of three long messages that fit the budget only one at a time
+    messages = [{"role": "user" if n % 2 == 0 else "assistant", "content": f"message {n}"} for n in range(8)]
+    messages += [{"role": "user" if n % 2 == 0 else "assistant", "content": f"long {n} " + "x" * 300} for n in range(8, 11)]
+
+    history = manager.build(messages)
+    sent = " ".join(m["content"] for m in history)
+    for message in messages:
+        assert message["content"] in summarized or message["content"] in sent
+    assert history[-1]["content"].endswith(messages[-1]["content"])
+    assert "long 8" in summarized[-2] and "long 9" in summarized[-1]
+
+    calls = len(summarized)
+    assert manager.build(messages) == history
+    assert len(summarized) == calls
@@ -0,0 +1,73 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from quantized_store import QuantizedVectorStore
+from stubs import FakeEmbeddings
+
+
+def make_store(path):
+    return QuantizedVectorStore(str(path), FakeEmbeddings(dimensions=16))
+
+
+def test_duplicate_ids_in_a_batch_keep_rows_aligned(tmp_path):
+    store = make_store(tmp_path)
+    embeddings = FakeEmbeddings(dimensions=16)
+    texts = ["alpha", "beta", "gamma"]
+    added = store.add_embeddings(["a", "a", "b"], texts, embeddings.embed_documents(texts))
+
+    assert added == ["a", "b"]
+    assert len(store) == 2
+    assert store._row_count() == 2
+    assert store.similarity_search("gamma", k=1)[0].page_content == "gamma"
+
+
+def test_failed_insert_leaves_no_vectors_behind(tmp_path):
+    store = make_store(tmp_path)
+    embeddings = FakeEmbeddings(dimensions=16)
+    store.add_embeddings(["a"], ["alpha"], embeddings.embed_documents(["alpha"]))
+
+    with pytest.raises(TypeError):
+        # Metadata that can't be stored fails the insert after the vectors were written
+        store.add_embeddings(["b"], ["beta"], embeddings.embed_documents(["beta"]), [{"bad": object()}])
+
+    assert store._row_count() == len(store) == 1
+    store.add_embeddings(["c"], ["gamma"], embeddings.embed_documents(["gamma"]))
+    assert store.similarity_search("gamma", k=1)[0].page_content == "gamma"
+    assert store.similarity_search("alpha", k=1)[0].page_content == "alpha"
+
+
+def disk_usage(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def test_compact_gives_deleted_rows_back_to_the_disk(tmp_path):
+    store = make_store(tmp_path)
+    embeddings = FakeEmbeddings(dimensions=16)
+    texts = [f"chunk number {n} about topic {n % 7}" for n in range(2000)]
+    ids = [f"doc:{n}" for n in range(2000)]
+    store.add_embeddings(ids, texts, embeddings.embed_documents(texts))
+    full = disk_usage(tmp_path)
+
+    store.delete(ids=ids[:1500])
+    queries = texts[1500::50] + ["topic 3"]
+    expected = [[doc.page_content for doc in store.similarity_search(query, k=3)] for query in queries]
+    # Another process that mapped the files before the compaction
+    other = make_store(tmp_path)
+    assert [doc.page_content for doc in other.similarity_search(queries[0], k=3)] == expected[0]
+    assert disk_usage(tmp_path) >= full
+    assert store.reclaimable_bytes() > 0
+
+    assert store.compact() > 0
+    assert disk_usage(tmp_path) < full / 2
+    assert store.reclaimable_bytes() == 0
+    assert store._row_count() == len(store) == 500
+    for reader in (store, other, make_store(tmp_path)):
+        assert [[doc.page_content for doc in reader.similarity_search(query, k=3)] for query in queries] == expected
+
+    store.add_embeddings(["new"], ["a new chunk"], embeddings.embed_documents(["a new chunk"]))
+    assert len(store) == store._row_count() == 501
+    assert store.similarity_search("a new chunk", k=1)[0].page_content == "a new chunk"
@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+
+os.environ.setdefault("CHATAI_BACKEND", "stub")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rag_utils
+from stubs import FakeEmbeddings
+
+
+def register(key, **entry):
+    os.makedirs(rag_utils.CHROMA_ROOT, exist_ok=True)
+    persist_directory = os.path.join(rag_utils.CHROMA_ROOT, key)
+    os.makedirs(persist_directory, exist_ok=True)
+    registry = rag_utils.load_registry()
+    registry[key] = dict(persist_directory=persist_directory, **entry)
+    rag_utils.save_registry(registry)
+    return persist_directory
+
+
+def test_deleting_a_shared_document_keeps_it_for_other_owners(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    persist_directory = register("doc", owner="session-a", chunks=3)
+    assert rag_utils.add_document_owners("doc", ["session-b"])
+
+    assert not rag_utils.delete_document("doc", owner="session-c")
+    assert rag_utils.delete_document("doc", owner="session-b")
+    assert rag_utils.load_registry()["doc"]["owners"] == ["session-a"]
+    assert os.path.isdir(persist_directory)
+
+    assert not rag_utils.delete_document("doc", owner="session-b")
+    assert rag_utils.delete_document("doc", owner="session-a")
+    assert "doc" not in rag_utils.load_registry()
+    assert not os.path.exists(persist_directory)
+
+
+def test_garbage_collection_spares_recently_used_documents(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(rag_utils, "_last_touched", {})
+    hour_ago = time.time() - 2 * rag_utils.GC_GRACE_SECONDS
+    for key in ("idle", "searched", "fresh"):
+        persist_directory = register(key, last_used=hour_ago if key != "fresh" else time.time())
+        with open(os.path.join(persist_directory, "data"), "wb") as f:
+            f.write(b"x" * 1024)
+
+    rag_utils.touch_registry_entry(*rag_utils.filter_doc_ids(rag_utils.corpus_filter(doc_ids=["searched"])))
+    removed = rag_utils.collect_garbage(quota_mb=0)
+
+    assert removed == ["idle"]
+    assert set(rag_utils.load_registry()) == {"searched", "fresh"}
+
+
+def test_a_failed_ingest_is_retried_by_the_next_upload(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(rag_utils, "VECTOR_BACKEND", "quantized")
+    attempts = []
+
+    def process(document_path, key=None, job=None):
+        attempts.append(key)
+        register(key, corpus=True, chunks=0, bytes=0)
+        if len(attempts) == 1:
+            raise RuntimeError("broken page")
+        job.done.set()
+
+    monkeypatch.setattr(rag_utils, "ProcessDocuments", process)
+    job = rag_utils.start_ingest(b"%PDF", source="doc.pdf", owner="session-a")
+    assert job.wait(10)
+    assert rag_utils.get_ingest_status(job.key)["error"] == "broken page"
+    assert rag_utils.get_ingest_status(job.key)["done"]
+    assert job.key not in rag_utils.load_registry()
+
+    retry = rag_utils.start_ingest(b"%PDF", source="doc.pdf", owner="session-a")
+    assert retry is not job
+    assert not os.path.exists(rag_utils.ingest_progress_path(job.key))
+    assert retry.wait(10)
+    assert retry.error is None
+    assert len(attempts) == 2
+
+
+def test_each_corpus_directory_is_opened_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(rag_utils, "VECTOR_BACKEND", "quantized")
+    corpus = rag_utils.get_corpus()
+    others = [rag_utils.get_corpus(str(tmp_path / f"other-{n}")) for n in range(8)]
+
+    assert rag_utils.get_corpus() is corpus
+    assert rag_utils.get_corpus(os.path.join(str(tmp_path), rag_utils.CHROMA_ROOT, rag_utils.CORPUS_NAME)) is corpus
+    assert [rag_utils.get_corpus(str(tmp_path / f"other-{n}")) for n in range(8)] == others
+
+
+def test_garbage_collection_compacts_the_corpus(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(rag_utils, "VECTOR_BACKEND", "quantized")
+    monkeypatch.setattr(rag_utils, "_last_touched", {})
+    corpus = rag_utils.get_corpus()
+    embeddings = FakeEmbeddings(dimensions=16)
+    hour_ago = time.time() - 2 * rag_utils.GC_GRACE_SECONDS
+    registry = {}
+    for key in ("idle-a", "idle-b", "fresh"):
+        texts = [f"{key} chunk {n}" for n in range(500)]
+        corpus.vector_database.add_embeddings(
+            rag_utils.document_chunk_ids(key, 500), texts, embeddings.embed_documents(texts)
+        )
+        registry[key] = dict(
+            persist_directory=corpus.persist_directory, corpus=True, chunks=500, bytes=500 * 200,
+            backend="quantized", last_used=time.time() if key == "fresh" else hour_ago,
+        )
+    rag_utils.save_registry(registry)
+    before = rag_utils.directory_size(rag_utils.CHROMA_ROOT)
+
+    assert sorted(rag_utils.collect_garbage(quota_mb=0)) == ["idle-a", "idle-b"]
+    assert rag_utils.directory_size(rag_utils.CHROMA_ROOT) < before / 2
+    assert len(corpus.vector_database) == 500
+    assert corpus.reclaimable_bytes() == 0
+
+
+def test_garbage_collection_measures_the_store_on_disk(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(rag_utils, "VECTOR_BACKEND", "quantized")
+    monkeypatch.setattr(rag_utils, "_last_touched", {})
+    corpus = rag_utils.get_corpus()
+    embeddings = FakeEmbeddings(dimensions=16)
+    long_ago = time.time() - 10 * rag_utils.GC_GRACE_SECONDS
+    registry = {}
+    for age, key in enumerate(("newest", "middle", "oldest")):
+        texts = [f"{key} chunk {n} " * 20 for n in range(500)]
+        corpus.vector_database.add_embeddings(
+            rag_utils.document_chunk_ids(key, 500), texts, embeddings.embed_documents(texts)
+        )
+        # Estimates far below the real size must not count as freed space
+        registry[key] = dict(
+            persist_directory=corpus.persist_directory, corpus=True, chunks=500, bytes=1,
+            backend="quantized", last_used=long_ago - age,
+        )
+    rag_utils.save_registry(registry)
+    quota_bytes = 0.8 * rag_utils.directory_size(rag_utils.CHROMA_ROOT)
+
+    assert rag_utils.collect_garbage(quota_mb=quota_bytes / 1024 / 1024) == ["oldest"]
+    assert rag_utils.directory_size(rag_utils.CHROMA_ROOT) <= quota_bytes
@@ -0,0 +1,65 @@
+import os
+import sys
+
+os.environ.setdefault("CHATAI_BACKEND", "stub")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import run_model
+import search_cache
+import server
+
+
+@pytest.fixture(scope="module")
+def client():
+    # One lifespan for the module, its end shuts the worker pool down for good
+    with TestClient(server.app, raise_server_exceptions=False) as client:
+        yield client
+
+
+def test_failed_streams_give_back_their_slot(client, monkeypatch):
+    def failing_stream(history=None, **sampling):
+        yield "partial answer"
+        raise RuntimeError("model went away")
+
+    monkeypatch.setattr(run_model, "stream_response", failing_stream)
+    limiter = server.limiters["chat"]
+    for _ in range(limiter.limit + 2):
+        try:
+            client.post("/v1/chat", json={"messages": [{"role": "user", "content": "hi"}]})
+        except Exception:
+            pass
+        assert limiter.stats()["active"] == 0
+
+    monkeypatch.setattr(run_model, "stream_response", lambda history=None, **sampling: iter(["ok"]))
+    response = client.post("/v1/chat", json={"messages": [{"role": "user", "content": "hi"}]})
+    assert response.status_code == 200
+    assert response.text == "ok"
+    assert limiter.stats()["active"] == 0
+
+
+@pytest.mark.parametrize("settings", [
+    {"unknown_setting": 1},
+    {"thread_id": "someone-else"},
+    {"max_web_research_loops": 1000},
+])
+def test_research_rejects_unsupported_settings(client, settings):
+    response = client.post("/v1/research", json={"query": "topic", "settings": settings})
+    assert response.status_code == 422
+    assert server.limiters["research"].stats()["active"] == 0
+
+
+def test_search_cache_counters_are_reported(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(search_cache, "_search_cache", search_cache.SearchCache(str(tmp_path / "search.sqlite3")))
+    monkeypatch.setattr(search_cache, "_search_client", None)
+    for _ in range(3):
+        search_cache.get_search_client().search("solid state batteries", max_results=3)
+
+    stats = client.get("/v1/stats").json()["search_cache"]
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 1, 1)
+    metrics = client.get("/metrics").text
+    assert 'chatai_cache_lookups_total{cache="search",result="hit"} 2' in metrics
+    assert 'chatai_cache_lookups_total{cache="search",result="miss"} 1' in metrics
+    assert 'chatai_cache_entries{cache="search"} 1' in metrics
@@ -0,0 +1,75 @@
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import source_fetcher
+
+
+@pytest.fixture
+def local_server():
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/redirect":
+                self.send_response(302)
+                self.send_header("Location", "http://169.254.169.254/latest/meta-data/")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.end_headers()
+            if self.path == "/slow":
+                try:
+                    for _ in range(20):
+                        self.wfile.write(b"still loading\n")
+                        self.wfile.flush()
+                        time.sleep(0.1)
+                except ConnectionError:
+                    # The client gave up at its deadline
+                    pass
+            else:
+                self.wfile.write(b"internal page")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.mark.parametrize("url", [
+    "file:///etc/passwd",
+    "http://127.0.0.1/",
+    "http://localhost/",
+    "http://10.1.2.3/",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[::1]/",
+])
+def test_only_public_http_urls_are_fetched(url):
+    with pytest.raises(ValueError):
+        source_fetcher.fetch_url(url)
+
+
+def test_local_hosts_need_to_be_allowed(local_server, monkeypatch):
+    with pytest.raises(ValueError):
+        source_fetcher.fetch_url(local_server)
+    monkeypatch.setattr(source_fetcher, "FETCH_ALLOWED_HOSTS", ["127.0.0.1"])
+    assert source_fetcher.fetch_url(local_server) == "internal page"
+
+    with pytest.raises(ValueError, match="169.254.169.254"):
+        source_fetcher.fetch_url(f"{local_server}/redirect")
+
+
+def test_a_slow_download_stops_at_the_deadline(local_server, monkeypatch):
+    monkeypatch.setattr(source_fetcher, "FETCH_ALLOWED_HOSTS", ["127.0.0.0/8"])
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        source_fetcher.fetch_url(f"{local_server}/slow", timeout=0.5)
+    assert time.monotonic() - start < 1.0
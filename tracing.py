@@ -0,0 +1,249 @@
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+TRACE_PATH = os.environ.get("CHATAI_TRACE_PATH", "./traces.jsonl")
+# Set CHATAI_TRACE_EXPORT=1 to also append every span to TRACE_PATH
+TRACE_EXPORT = os.environ.get("CHATAI_TRACE_EXPORT", "0") == "1"
+# The export is rotated to TRACE_PATH.1 once it grows past this
+TRACE_MAX_BYTES = int(os.environ.get("CHATAI_TRACE_MAX_MB", 50)) * 1024 * 1024
+RECENT_SPANS = 2000
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+class Tracer:
+    """
+    Collects timed spans from the chat, agent, research and RAG pipelines.
+
+    Every span is kept in a bounded in-memory window for the debug panel and
+    folded into per-name aggregates that can be rendered in the Prometheus
+    text format. When `path` is set spans are also appended to a JSONL file,
+    rotated once it reaches `max_bytes`.
+    """
+
+    def __init__(self, path: str = None, recent: int = RECENT_SPANS, max_bytes: int = TRACE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.recent = deque(maxlen=recent)
+        self._totals = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+        # Export writes take their own lock, readers of the aggregates never wait on disk
+        self._export_lock = threading.Lock()
+        self._export_file = None
+
+    def record(self, name: str, duration: float, kind: str = "span", **attributes):
+        span = {
+            "name": name,
+            "kind": kind,
+            "time": time.time(),
+            "duration": duration,
+            **{key: value for key, value in attributes.items() if value is not None},
+        }
+        with self._lock:
+            self.recent.append(span)
+            totals = self._totals[name]
+            totals["count"] += 1
+            totals["seconds"] += duration
+            for key in ("prompt_tokens", "completion_tokens", "retries", "errors"):
+                totals[key] += span.get(key, 0) or 0
+        if self.path:
+            self._export(json.dumps(span, default=str) + "\n")
+        return span
+
+    def _export(self, line: str):
+        with self._export_lock:
+            if self._export_file is None:
+                self._export_file = open(self.path, "a", encoding="utf-8")
+            self._export_file.write(line)
+            self._export_file.flush()
+            if self._export_file.tell() >= self.max_bytes:
+                self._export_file.close()
+                os.replace(self.path, self.path + ".1")
+                self._export_file = None
+
+    @contextmanager
+    def span(self, name: str, kind: str = "span", **attributes):
+        """
+        Time the enclosed block. The yielded dict can be filled with extra attributes.
+        """
+        start = time.perf_counter()
+        extra = {}
+        try:
+            yield extra
+        except Exception as e:
+            extra["errors"] = 1
+            extra["error"] = repr(e)
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, kind, **{**attributes, **extra})
+
+    def summary(self):
+        # Latency percentiles come from the recent window, counts and tokens from all spans
+        durations = defaultdict(list)
+        with self._lock:
+            for span in self.recent:
+                durations[span["name"]].append(span["duration"])
+            totals = {name: dict(values) for name, values in self._totals.items()}
+        rows = []
+        for name, values in sorted(totals.items()):
+            rows.append({
+                "name": name,
+                "count": int(values["count"]),
+                "p50_ms": round(percentile(durations[name], 0.5) * 1000, 1),
+                "p95_ms": round(percentile(durations[name], 0.95) * 1000, 1),
+                "total_s": round(values["seconds"], 2),
+                "prompt_tokens": int(values["prompt_tokens"]),
+                "completion_tokens": int(values["completion_tokens"]),
+                "retries": int(values["retries"]),
+                "errors": int(values["errors"]),
+            })
+        return rows
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            totals = {name: dict(values) for name, values in self._totals.items()}
+        lines = [
+            "# TYPE chatai_span_seconds summary",
+            "# TYPE chatai_tokens_total counter",
+            "# TYPE chatai_retries_total counter",
+            "# TYPE chatai_errors_total counter",
+        ]
+        for name, values in sorted(totals.items()):
+            label = f'{{span="{name}"}}'
+            lines.append(f"chatai_span_seconds_count{label} {int(values['count'])}")
+            lines.append(f"chatai_span_seconds_sum{label} {values['seconds']:.6f}")
+            lines.append(f'chatai_tokens_total{{span="{name}",type="prompt"}} {int(values["prompt_tokens"])}')
+            lines.append(f'chatai_tokens_total{{span="{name}",type="completion"}} {int(values["completion_tokens"])}')
+            lines.append(f"chatai_retries_total{label} {int(values['retries'])}")
+            lines.append(f"chatai_errors_total{label} {int(values['errors'])}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.recent.clear()
+            self._totals.clear()
+
+
+tracer = Tracer(TRACE_PATH if TRACE_EXPORT else None)
+
+
+def traced(name: str, kind: str = "span"):
+    """
+    Decorator recording a span around every call of the function.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name, kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def token_usage(response):
+    # Chat models report usage on the message, older LLM wrappers in llm_output
+    for generations in response.generations or []:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens"), usage.get("output_tokens")
+    usage = (response.llm_output or {}).get("token_usage") or (response.llm_output or {}).get("usage_metadata") or {}
+    return (
+        usage.get("prompt_tokens", usage.get("input_tokens")),
+        usage.get("completion_tokens", usage.get("output_tokens")),
+    )
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback recording model calls, tool calls and ReAct steps as spans.
+
+    One instance is shared by every run, in-flight calls are tracked by run id.
+    An agent step runs from the agent's action to the end of the tool it
+    called (whose parent is the agent run), or to the agent's finish.
+    """
+
+    def __init__(self, tracer: Tracer = tracer):
+        self.tracer = tracer
+        self._runs = {}
+        self._steps = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, name, kind):
+        with self._lock:
+            self._runs[run_id] = {"start": time.perf_counter(), "name": name, "kind": kind, "retries": 0}
+
+    def _end(self, run_id, **attributes):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is not None:
+            self.tracer.record(
+                run["name"], time.perf_counter() - run["start"], run["kind"],
+                retries=run["retries"] or None, **attributes
+            )
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "llm", "llm")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "llm", "llm")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt_tokens, completion_tokens = token_usage(response)
+        self._end(run_id, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, errors=1, error=repr(error))
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        with self._lock:
+            if run_id in self._runs:
+                self._runs[run_id]["retries"] += 1
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, f"tool.{(serialized or {}).get('name', 'unknown')}", "tool")
+
+    def on_tool_end(self, output, *, run_id, parent_run_id=None, **kwargs):
+        self._end(run_id)
+        self._end_step(parent_run_id)
+
+    def on_tool_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        self._end(run_id, errors=1, error=repr(error))
+        self._end_step(parent_run_id, errors=1)
+
+    def on_agent_action(self, action, *, run_id, **kwargs):
+        # A step whose tool never reported back ends where the next one starts
+        self._end_step(run_id)
+        with self._lock:
+            self._steps[run_id] = {"start": time.perf_counter(), "tool": getattr(action, "tool", None)}
+
+    def on_agent_finish(self, finish, *, run_id, **kwargs):
+        self._end_step(run_id)
+
+    def _end_step(self, agent_run_id, **attributes):
+        if agent_run_id is None:
+            return
+        with self._lock:
+            step = self._steps.pop(agent_run_id, None)
+        if step is not None:
+            self.tracer.record("agent.step", time.perf_counter() - step["start"], "agent", tool=step["tool"], **attributes)
+
+
+tracing_handler = TracingCallbackHandler()
+
+
+def get_callbacks():
+    return [tracing_handler]
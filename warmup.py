@@ -0,0 +1,64 @@
+import threading
+import time
+
+
+def warm_simple_chat():
+    from model import get_gemma
+    get_gemma()
+
+
+def warm_web_search():
+    # The ReAct agent is only a fallback and stays lazy
+    from model import get_gemma
+    from search_cache import get_search_client
+    import web_search
+    get_gemma()
+    get_search_client()
+
+
+def warm_pdf():
+    from rag_utils import get_embedding_model, RERANK
+    from reranker import get_reranker_model
+    # The first encode also loads the tokenizer and weights into memory
+    get_embedding_model().embed_query("warm up")
+    if RERANK:
+        get_reranker_model().predict([("warm up", "warm up")])
+
+
+def warm_deep_research():
+    from deep_research import get_research_graph, research_model, research_search_client
+    get_research_graph()
+    research_model()
+    research_search_client()
+
+
+# Keyed by the tool names shown in the app sidebar
+MODE_WARMERS = {
+    "Simple Chat": warm_simple_chat,
+    "Web Search": warm_web_search,
+    "Upload PDF": warm_pdf,
+    "Deep Web Search": warm_deep_research,
+}
+
+
+def warm_mode(mode: str) -> float:
+    """
+    Initialize everything `mode` needs and return how long it took in seconds.
+    """
+    start = time.perf_counter()
+    MODE_WARMERS[mode]()
+    return time.perf_counter() - start
+
+
+def prewarm(modes=None):
+    for mode in modes or MODE_WARMERS:
+        try:
+            print(f"[prewarm] {mode}: {warm_mode(mode):.2f}s")
+        except Exception as e:
+            print(f"[prewarm] {mode} failed: {e}")
+
+
+def start_prewarm_thread(modes=None) -> threading.Thread:
+    thread = threading.Thread(target=prewarm, args=(modes,), name="prewarm", daemon=True)
+    thread.start()
+    return thread
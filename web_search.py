@@ -1,12 +1,14 @@
-from langchain.agents import AgentExecutor, create_react_agent
-from langchain.agents import load_tools, Tool
+from functools import lru_cache
 # from langchain.tools import DuckDuckGoSearchResults
-from tavily import TavilyClient
 from langchain.prompts import PromptTemplate
 from model import get_gemma
-from api_key import TAVILY_API_KEY
+from search_cache import get_search_client
+from tracing import tracer, get_callbacks
 
-gemma_model = get_gemma()
+# Results fetched by the direct search, and the cap on agent steps when it falls back
+FAST_PATH_MAX_RESULTS = 3
+AGENT_MAX_ITERATIONS = 4
+INSUFFICIENT_CONTEXT = "INSUFFICIENT_CONTEXT"
 
 
 # Create the ReAct template
@@ -36,41 +38,115 @@ prompt = PromptTemplate(
 )
 
 
-tavily_client = TavilyClient(api_key=TAVILY_API_KEY)
+# Grounded answer for the direct search path
+grounded_answer_template = """Answer the question using only the search results below.
+Cite the results you use inline as [1], [2], ... matching their numbers.
+If the results don't contain enough information to answer, reply with exactly: {insufficient}
 
-tavily_search_tool = Tool(
-    name="tavily search",
-    description = "A web search engine. Use this to as a search engine for general queries.",
-    func = lambda x: tavily_client.search(x, max_results=1)
-)
+Question: {question}
 
-# Prepare tools
-tools = load_tools(["llm-math"], llm=gemma_model)
-tools.append(tavily_search_tool)
+Search results:
+{results}
+"""
 
 
-# Construct the ReAct agent
-agent = create_react_agent(gemma_model, tools, prompt)
-agent_executor = AgentExecutor(
-    agent=agent,
-    tools=tools,
-    verbose=True,
-    handle_parsing_errors=True,
-    return_intermediate_steps=True
-)
+@lru_cache(maxsize=1)
+def get_agent_executor():
+    # Built on the first search the fast path can't answer, then shared by every session
+    from langchain.agents import AgentExecutor, create_react_agent
+    from langchain.agents import load_tools, Tool
+
+    gemma_model = get_gemma()
+    tavily_client = get_search_client()
+
+    tavily_search_tool = Tool(
+        name="tavily search",
+        description = "A web search engine. Use this to as a search engine for general queries.",
+        func = lambda x: tavily_client.search(x, max_results=1)
+    )
+
+    # Prepare tools
+    tools = load_tools(["llm-math"], llm=gemma_model)
+    tools.append(tavily_search_tool)
+
+
+    # Construct the ReAct agent
+    agent = create_react_agent(gemma_model, tools, prompt)
+    return AgentExecutor(
+        agent=agent,
+        tools=tools,
+        verbose=True,
+        handle_parsing_errors=True,
+        return_intermediate_steps=True,
+        max_iterations=AGENT_MAX_ITERATIONS,
+        early_stopping_method="force"
+    )
+
+
+def extract_sources(search_response):
+    # Only Tavily-shaped observations carry sources, calculator steps and parse errors don't
+    if not isinstance(search_response, dict):
+        return []
+    return [
+        result["url"] for result in search_response.get("results", [])
+        if isinstance(result, dict) and result.get("url")
+    ]
+
 
 def get_urls_from_response(response):
     urls = []
-    for step in response["intermediate_steps"]:
-        urls.append(step[1]["results"][0]["url"])
+    for step in response.get("intermediate_steps", []):
+        for url in extract_sources(step[1]):
+            if url not in urls:
+                urls.append(url)
     return urls
 
 
-def search_web(query):
-    response = agent_executor.invoke({"input" : query})
+def format_search_results(results) -> str:
+    return "\n\n".join(
+        f"[{n}] {result.get('title', '')}\nURL: {result.get('url', '')}\n{result.get('content', '')}"
+        for n, result in enumerate(results, 1)
+    )
+
+
+def search_web_fast(query):
+    """
+    Answer with one search and one grounded model call.
+
+    Returns (answer, sources), or None when the results can't answer the question.
+    """
+    search_response = get_search_client().search(query, max_results=FAST_PATH_MAX_RESULTS)
+    results = [result for result in search_response.get("results", []) if isinstance(result, dict)]
+    if not results:
+        return None
+
+    grounded_prompt = grounded_answer_template.format(
+        insufficient=INSUFFICIENT_CONTEXT, question=query, results=format_search_results(results)
+    )
+    answer = get_gemma().invoke(
+        [{"role": "user", "content": grounded_prompt}], config={"callbacks": get_callbacks()}
+    ).content.strip()
+    if not answer or INSUFFICIENT_CONTEXT in answer:
+        return None
+    return answer, extract_sources(search_response)
+
+
+def search_agent(query):
+    response = get_agent_executor().invoke({"input" : query}, config={"callbacks": get_callbacks()})
 
     output = response["output"]
     sources = get_urls_from_response(response)
 
-    return output, sources 
+    return output, sources
+
+
+def search_web(query):
+    # Direct search and a single answer call first; the ReAct agent only when that can't answer
+    with tracer.span("web_search", "agent") as span:
+        result = search_web_fast(query)
+        span["path"] = "fast" if result is not None else "agent"
+        if result is None:
+            result = search_agent(query)
+
+    return result 
     
\ No newline at end of file